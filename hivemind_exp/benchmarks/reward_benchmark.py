@@ -0,0 +1,337 @@
+"""
+Times every stage 1/2/3 reward function and the RewardEngine that training
+uses, on synthetic GSM8K-style prompts and completions. Runs offline.
+
+    python -m hivemind_exp.benchmarks.reward_benchmark --json > rewards.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Callable
+
+import numpy as np
+
+import hivemind_exp.gsm8k.answer_normalizer as answer_normalizer
+import hivemind_exp.gsm8k.prompt_analysis as prompt_analysis
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+from hivemind_exp.gsm8k.generate_prompts import (
+    generate_stage2_user_prompt,
+    generate_stage3_user_prompt,
+)
+from hivemind_exp.gsm8k.sample_logger import SAMPLE_LOGGER
+from hivemind_exp.gsm8k.stages import stage_reward_engines
+from hivemind_exp.hivemind_utils import HivemindNode
+
+VARIANTS = ("well_formed", "malformed", "long")
+NUM_STUDENTS = 5
+SYSTEM_PROMPT = "Respond in the following format: <think> ... </think> <answer> ... </answer>"
+
+# Cleared before every timed call, so each measurement starts cold.
+CACHES = (
+    parse_completion,
+    answer_normalizer._cached_normalize,
+    prompt_analysis._cached_analyze,
+)
+
+
+@dataclass
+class Case:
+    stage: int
+    variant: str
+    prompts: list
+    completions: list
+    answer: list
+
+    @property
+    def completion_chars(self) -> float:
+        return statistics.mean(len(c[0]["content"]) for c in self.completions)
+
+
+def make_question(rng: random.Random) -> tuple[str, str]:
+    a, b, c = rng.randint(2, 60), rng.randint(2, 60), rng.randint(2, 12)
+    return rng.choice(
+        [
+            (
+                f"A baker makes {a} loaves each morning and {b} each evening. How many loaves does the baker make in {c} days?",
+                str((a + b) * c),
+            ),
+            (
+                f"Maya has {a * c} stickers and gives {c} friends {a} stickers each. She then buys {b} more. How many stickers does she have now?",
+                str(b),
+            ),
+            (
+                f"A train travels {a} miles per hour for {c} hours, then {b} miles per hour for 1 hour. How far does it travel?",
+                str(a * c + b),
+            ),
+        ]
+    )
+
+
+def reasoning(rng: random.Random, sentences: int) -> str:
+    steps = [
+        "First, find the amount for one day.",
+        "Then multiply by the number of days.",
+        "Add the remaining amount to the total.",
+        "Check the arithmetic once more.",
+        "So the total follows from the numbers above.",
+    ]
+    return " ".join(rng.choice(steps) for _ in range(sentences))
+
+
+def stage1_completion(rng: random.Random, variant: str, answer: str) -> str:
+    guess = answer if rng.random() < 0.6 else str(int(answer) + rng.randint(1, 9))
+    if variant == "well_formed":
+        return f"<think>\n{reasoning(rng, 4)}\n</think>\n<answer>\n{guess}\n</answer>\n"
+    if variant == "malformed":
+        return rng.choice(
+            [
+                f"{reasoning(rng, 4)} The answer is {guess}.",
+                f"<think>{reasoning(rng, 3)}</think> <answer>{guess}</answer>",
+                f"<think>\n{reasoning(rng, 3)}\n<answer>\n{guess}",
+                "",
+            ]
+        )
+    # Runaway generations: a long think block, tag spam and one huge line.
+    return rng.choice(
+        [
+            f"<think>\n{reasoning(rng, 2000)}\n</think>\n<answer>\n{guess}\n</answer>\n",
+            "<think>" + "x</think> <answer>" * 5000,
+            reasoning(rng, 4000),
+        ]
+    )
+
+
+def stage2_completion(rng: random.Random, variant: str, students: list[str]) -> str:
+    choice = rng.choice([*students, "None"])
+    if variant == "well_formed":
+        return (
+            f"<compare>\n{reasoning(rng, 3)}\n</compare>\n"
+            f"<explain>\n{reasoning(rng, 2)}\n</explain>\n"
+            f"<identify>\n{choice}\n</identify>\n"
+        )
+    if variant == "malformed":
+        return rng.choice(
+            [
+                f"{reasoning(rng, 4)} I think {choice} is right.",
+                f"<compare>{reasoning(rng, 2)}</compare><identify>{choice}</identify>",
+                f"<identify>\nStudent #{len(students) + 3}\n</identify>\n",
+                "",
+            ]
+        )
+    return rng.choice(
+        [
+            f"<compare>\n{reasoning(rng, 2000)}\n</compare>\n<explain>\n{reasoning(rng, 100)}\n</explain>\n<identify>\n{choice}\n</identify>\n",
+            "<compare>" + "x</compare> <explain>y</explain> <identify>" * 3000,
+            reasoning(rng, 4000),
+        ]
+    )
+
+
+def stage3_completion(
+    rng: random.Random, variant: str, students: list[str], question: str, answer: str
+) -> str:
+    choice = rng.choice([*students, "None"])
+    if variant == "well_formed":
+        return (
+            f"<summarize_feedback>\n{reasoning(rng, 2)}\n</summarize_feedback>\n"
+            f"<majority>\n{choice}\n</majority>\n"
+            f"<question>\n{question}\n</question>\n"
+            f"<think>\n{reasoning(rng, 3)}\n</think>\n"
+            f"<answer>\n{answer}\n</answer>\n"
+        )
+    if variant == "malformed":
+        return rng.choice(
+            [
+                f"{reasoning(rng, 4)} The majority picked {choice}; the answer is {answer}.",
+                f"<majority>{choice}</majority><answer>{answer}</answer>",
+                f"<question>\n{question}\n</question>\n<answer>\n{answer}",
+                "",
+            ]
+        )
+    return rng.choice(
+        [
+            f"<summarize_feedback>\n{reasoning(rng, 1000)}\n</summarize_feedback>\n<majority>\n{choice}\n</majority>\n"
+            f"<question>\n{question * 40}\n</question>\n<think>\n{reasoning(rng, 1000)}\n</think>\n<answer>\n{answer}\n</answer>\n",
+            "<summarize_feedback>" + "x</summarize_feedback> <majority>" * 3000,
+            reasoning(rng, 4000),
+        ]
+    )
+
+
+def make_cases(rng: random.Random, variant: str, batch_size: int) -> list[Case]:
+    """
+    One batch per stage for a single question, with student and critic
+    prompts built the way the stage 2/3 datasets build them.
+    """
+    question, answer = make_question(rng)
+    answers = {
+        str(i): stage1_completion(rng, "well_formed", answer) for i in range(NUM_STUDENTS)
+    }
+    stage2_prompt = generate_stage2_user_prompt({"question": question}, answers)
+    students = [f"Student #{i}" for i in range(NUM_STUDENTS)]
+    opinions = {
+        str(i): stage2_completion(rng, "well_formed", students) for i in range(NUM_STUDENTS)
+    }
+    stage3_prompt = generate_stage3_user_prompt({"stage2_prompt": stage2_prompt}, opinions)
+
+    def case(stage, prompt, completion_fn):
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        return Case(
+            stage,
+            variant,
+            prompts=[messages] * batch_size,
+            completions=[
+                [{"role": "assistant", "content": completion_fn()}]
+                for _ in range(batch_size)
+            ],
+            answer=[answer] * batch_size,
+        )
+
+    return [
+        case(1, question, lambda: stage1_completion(rng, variant, answer)),
+        case(2, stage2_prompt, lambda: stage2_completion(rng, variant, students)),
+        case(
+            3,
+            stage3_prompt,
+            lambda: stage3_completion(rng, variant, students, question, answer),
+        ),
+    ]
+
+
+def measure(fn: Callable[[], object], num_completions: int, repeats: int) -> dict:
+    times = []
+    for _ in range(repeats):
+        for cache in CACHES:
+            cache.cache_clear()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    for cache in CACHES:
+        cache.cache_clear()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = statistics.median(times)
+    return {
+        "seconds": seconds,
+        "best_seconds": min(times),
+        "completions_per_second": num_completions / seconds if seconds else None,
+        "peak_bytes": peak,
+    }
+
+
+def benchmark_case(case: Case, module: ModuleType, engine, repeats: int) -> list[dict]:
+    kwargs = dict(prompts=case.prompts, completions=case.completions, answer=case.answer)
+    node = HivemindNode("benchmark", "benchmark")
+    targets = {
+        fn.__name__: (lambda fn=fn: fn(**kwargs, logging=False))
+        for fn in module.CUMULATIVE_REWARD_FUNCS
+    }
+    # A new completions list each call, since the engine memoizes by batch.
+    targets["reward_engine"] = lambda: engine.hivemind_cumulative_reward(
+        node,
+        module.hivemind_outputs,
+        case.prompts,
+        list(case.completions),
+        case.answer,
+    )
+
+    rows = []
+    for name, fn in targets.items():
+        rows.append(
+            {
+                "stage": case.stage,
+                "variant": case.variant,
+                "batch_size": len(case.completions),
+                "completion_chars": case.completion_chars,
+                "function": name,
+                **measure(fn, len(case.completions), repeats),
+            }
+        )
+    return rows
+
+
+def run(batch_sizes: list[int], variants: list[str], repeats: int, seed: int) -> dict:
+    # Sample logging would time disk writes, not rewards.
+    SAMPLE_LOGGER.rate = 0.0
+    rng = random.Random(seed)
+    modules = (stage1_rewards, stage2_rewards, stage3_rewards)
+    engines = stage_reward_engines()
+
+    rows = []
+    for variant in variants:
+        for batch_size in batch_sizes:
+            for case in make_cases(rng, variant, batch_size):
+                i = case.stage - 1
+                rows.extend(benchmark_case(case, modules[i], engines[i], repeats))
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "batch_sizes": batch_sizes,
+            "variants": variants,
+            "repeats": repeats,
+            "seed": seed,
+            # Kilobytes on Linux, bytes on macOS.
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": rows,
+    }
+
+
+def print_table(report: dict):
+    header = f"{'stage':>5} {'variant':<12} {'batch':>5} {'chars':>8}  {'function':<36} {'ms':>9} {'compl/s':>10} {'peak KiB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        print(
+            f"{r['stage']:>5} {r['variant']:<12} {r['batch_size']:>5} {r['completion_chars']:>8.0f}  "
+            f"{r['function']:<36} {r['seconds'] * 1e3:>9.2f} "
+            f"{r['completions_per_second'] or float('inf'):>10.0f} {r['peak_bytes'] / 1024:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    report = run(args.batch_sizes, args.variants, args.repeats, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares question_similarity with difflib's SequenceMatcher.ratio(), the
+similarity question_recreation_reward_func used before, on GSM8K questions
+and model-style recreations of them.
+
+    python -m hivemind_exp.benchmarks.similarity_benchmark --num_questions 200
+"""
+
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from hivemind_exp.gsm8k.stage3_rewards import question_similarity
+
+# Used when GSM8K can't be downloaded.
+FALLBACK_QUESTIONS = [
+    "Natalia sold clips to 48 of her friends in April, and then she sold half as many clips in May. How many clips did Natalia sell altogether in April and May?",
+    "Weng earns $12 an hour for babysitting. Yesterday, she just did 50 minutes of babysitting. How much did she earn?",
+    "Betty is saving money for a new wallet which costs $100. Betty has only half of the money she needs. Her parents decided to give her $15 for that purpose, and her grandparents twice as much as her parents. How much more money does Betty need to buy the wallet?",
+    "James writes a 3-page letter to 2 different friends twice a week. How many pages does he write a year?",
+    "Mark has a garden with flowers. He planted plants of three different colors in it. Ten of them are yellow, and there are 80% more of those in purple. There are only 25% as many green flowers as there are yellow and purple flowers. How many flowers does Mark have in his garden?",
+]
+
+
+def load_questions(num_questions: int) -> list[str]:
+    try:
+        from datasets import load_dataset
+
+        dataset = load_dataset("openai/gsm8k", "main", split="test")
+        return dataset["question"][:num_questions]
+    except Exception as e:
+        print(f"Couldn't load GSM8K ({e!r}); using built-in questions.")
+        return FALLBACK_QUESTIONS
+
+
+def recreations(question: str, questions: list[str], rng: random.Random) -> list[str]:
+    """
+    What a stage 3 completion's <question> block tends to hold: the question
+    verbatim or lightly edited, part of it, another question, or a runaway.
+    """
+    words = question.split()
+    swapped = words[:]
+    i = rng.randrange(len(words) - 1)
+    swapped[i], swapped[i + 1] = swapped[i + 1], swapped[i]
+    return [
+        question,
+        question.lower(),
+        " ".join(w for w in words if rng.random() > 0.15),
+        " ".join(swapped).replace("How many", "What is the number of"),
+        " ".join(words[: rng.randrange(1, len(words))]),
+        f"The question asks: {question} We need to find the answer.",
+        rng.choice(questions),
+    ]
+
+
+def runaways(question: str) -> list[str]:
+    # Degenerate, very long <question> blocks.
+    return [question * 50, "Let me think. " * 2000]
+
+
+def timed(fn, pairs) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    scores = np.array([fn(a, b) for a, b in pairs])
+    return scores, time.perf_counter() - start
+
+
+def ratio(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num_questions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    questions = load_questions(args.num_questions)
+    pairs = [(r, q) for q in questions for r in recreations(q, questions, rng)]
+
+    expected, ratio_time = timed(ratio, pairs)
+    got, similarity_time = timed(question_similarity, pairs)
+    error = np.abs(got - expected)
+    print(f"{len(pairs)} recreations of {len(questions)} questions")
+    print(f"  correlation:     {np.corrcoef(expected, got)[0, 1]:.4f}")
+    print(f"  mean abs error:  {error.mean():.4f}")
+    print(f"  max abs error:   {error.max():.4f}")
+    print(f"  SequenceMatcher: {ratio_time * 1e3:.1f} ms")
+    print(f"  n-gram Dice:     {similarity_time * 1e3:.1f} ms")
+
+    long_pairs = [(r, q) for q in questions[:5] for r in runaways(q)]
+    _, ratio_time = timed(ratio, long_pairs)
+    _, similarity_time = timed(question_similarity, long_pairs)
+    print(f"{len(long_pairs)} runaway recreations")
+    print(f"  SequenceMatcher: {ratio_time * 1e3:.1f} ms")
+    print(f"  n-gram Dice:     {similarity_time * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
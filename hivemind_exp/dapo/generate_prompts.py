@@ -1,3 +1,5 @@
+import random
+
 from datasets import Dataset, load_dataset
 
 # TODO: Refactor common math components.
@@ -19,20 +21,25 @@ def get_dapo_questions(data) -> Dataset:
             "answer": x["solution"]
         }
 
-    return data.map(map_sample)
+    return data.map(map_sample, keep_in_memory=True)
+
+
+def sample_indices(num_rows, num_samples, seed=42) -> list[int]:
+    # Deterministic random subset of row ids; nothing is shuffled or copied.
+    return random.Random(seed).sample(range(num_rows), min(num_samples, num_rows))
 
 
 def get_stage1_samples(num_samples=100):
-    # Load dataset from Hugging Face Hub
+    # Load dataset from Hugging Face Hub (memory-mapped Arrow)
     dataset_id = "open-r1/DAPO-Math-17k-Processed"
     dataset: Dataset = load_dataset(dataset_id, "en")["train"] # type: ignore
-    datasets = (
-        dataset.shuffle(seed=42)
-        .select(range(num_samples))
-        .train_test_split(test_size=0.5)
-    )  # type: ignore
-    train_dataset = datasets["train"]
-    test_dataset = datasets["test"]
+
+    # Only the sampled rows are read; first half trains, second half tests.
+    # Indices stay in memory rather than in cache files in the shared HF cache.
+    indices = sample_indices(len(dataset), num_samples)
+    split = len(indices) // 2
+    train_dataset = dataset.select(indices[:split], keep_in_memory=True)
+    test_dataset = dataset.select(indices[split:], keep_in_memory=True)
 
     # convert our dataset to the r1 prompt
     train_dataset = get_dapo_questions(train_dataset)
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+
+from datasets import Dataset
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "RL_SWARM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rl_swarm")
+)
+
+ROUND_DIR_PATTERN = re.compile(r"^round_(\d+)$")
+
+logger = logging.getLogger(__name__)
+
+
+def keyed_items_digest(
+    node_key: str, prev_items: dict[str, list], config: str = ""
+) -> str:
+    """
+    Digest of everything a merge depends on: the merging node, the settings
+    that shape the built datasets (`config`), the contributing peers and, per
+    peer, the question hashes + output timestamps.
+    """
+    hash_fxn = hashlib.md5()
+    hash_fxn.update(f"{node_key}\x00{config}".encode())
+    for peer_key in sorted(prev_items):
+        hash_fxn.update(b"\x00" + peer_key.encode())
+        for q_hash, (ts, _) in sorted(prev_items[peer_key], key=lambda t: t[0]):
+            hash_fxn.update(f"\x01{q_hash}:{ts}".encode())
+    return hash_fxn.hexdigest()
+
+
+def cleanup_cache_files(
+    *datasets: Dataset, cache_dir: str = DEFAULT_CACHE_DIR
+) -> int:
+    """
+    Removes HF datasets `cache-*.arrow` files (e.g. indices left behind by
+    earlier runs' selects) next to `datasets`, keeping the ones they still use.
+    Only directories under `cache_dir` are cleaned; the shared HF cache may
+    still be read by other processes.
+    """
+    root = os.path.join(os.path.realpath(cache_dir), "")
+    in_use = {f["filename"] for d in datasets for f in d.cache_files}
+    removed = 0
+    for directory in {os.path.dirname(f) for f in in_use}:
+        if not os.path.join(os.path.realpath(directory), "").startswith(root):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith("cache-") and name.endswith(".arrow") and path not in in_use:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+
+    if removed:
+        logger.info(f"Removed {removed} stale dataset cache files")
+    return removed
+
+
+def load_datasets(path: str) -> tuple[Dataset, Dataset] | None:
+    """
+    Memory-maps a (train, test) pair written by `save_datasets`, or returns None
+    if there's no (readable) entry at `path`.
+    """
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        train = Dataset.load_from_disk(os.path.join(path, "train"))
+        test_path = os.path.join(path, "test")
+        test = Dataset.load_from_disk(test_path) if os.path.isdir(test_path) else train
+    except Exception as e:
+        logger.warning(f"Dropping unreadable dataset cache at {path}: {e}")
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    return train, test
+
+
+def save_datasets(path: str, train: Dataset, test: Dataset):
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        train.save_to_disk(os.path.join(tmp_path, "train"))
+        if test is not train:
+            test.save_to_disk(os.path.join(tmp_path, "test"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # Another process may have raced us to the same entry; either way the
+        # cache is best-effort.
+        logger.debug(f"Could not cache datasets at {path}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+class MergedDatasetCache:
+    """
+    Memory-mapped Arrow cache for merged stage datasets.
+
+    Entries live under <cache_dir>/merged/round_<r>/stage_<s>_<digest> so that
+    retries and restarts within a round can skip re-merging. Only the last
+    `keep_rounds` rounds are kept on disk.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, keep_rounds: int = 2):
+        self.root = os.path.join(cache_dir, "merged")
+        self.keep_rounds = keep_rounds
+
+    def _round_dir(self, r: int) -> str:
+        return os.path.join(self.root, f"round_{r}")
+
+    def path(self, r: int, s: int, digest: str) -> str:
+        return os.path.join(self._round_dir(r), f"stage_{s}_{digest}")
+
+    def load(self, r: int, s: int, digest: str) -> tuple[Dataset, Dataset] | None:
+        return load_datasets(self.path(r, s, digest))
+
+    def save(self, r: int, s: int, digest: str, train: Dataset, test: Dataset):
+        save_datasets(self.path(r, s, digest), train, test)
+        self.evict(r)
+
+    def evict(self, current_round: int):
+        if not os.path.isdir(self.root):
+            return
+
+        # Rounds ahead of the current one are left over from a previous swarm.
+        min_round = current_round - self.keep_rounds + 1
+        for name in os.listdir(self.root):
+            m = ROUND_DIR_PATTERN.match(name)
+            if m and not min_round <= int(m.group(1)) <= current_round:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,125 @@
+import re
+from fractions import Fraction
+from functools import lru_cache
+
+# Strings longer than this aren't parsed as numbers, which also bounds their
+# digit count.
+MAX_NUMBER_CHARS = 64
+# Nor are numbers with a larger decimal exponent: Fraction() builds the exact
+# value, so "1e99999999" would take forever and "1e5000" is too long to print.
+MAX_EXPONENT = 100
+# Answers longer than this are normalized without being cached.
+MAX_CACHED_CHARS = 256
+
+MATH_DELIMITERS = (("$$", "$$"), ("$", "$"), ("\\(", "\\)"), ("\\[", "\\]"))
+# Commands whose braced argument is kept as plain text.
+UNWRAPPED_COMMANDS = ("\\boxed", "\\text", "\\textbf", "\\mathrm", "\\mbox")
+DROPPED_TOKENS = (
+    "\\left",
+    "\\right",
+    "\\!",
+    "\\,",
+    "\\;",
+    "\\ ",
+    "^\\circ",
+    "^{\\circ}",
+    # Percent signs are dropped like units: GSM8K's gold answers to percentage
+    # questions are the bare number of percent ("50", not "0.5").
+    "\\%",
+    "%",
+    "\\$",
+    "$",
+)
+
+THOUSANDS_SEPARATOR = re.compile(r"(?<=\d),(?=\d{3}(?!\d))")
+# Digits grouped by single spaces, as in "1 000 000".
+SPACE_GROUPED_NUMBER = re.compile(r"\b\d{1,3}(?: \d{3})+\b")
+# Whitespace between digits, which is kept (as one space) so "1 2" stays
+# distinct from "12"; all other whitespace is dropped.
+DIGIT_GAP = re.compile(r"(?<=\d)\s+(?=\d)")
+DROPPED_WHITESPACE = re.compile(r"(?<!\d)\s+|\s+(?!\d)")
+FRAC_COMMAND = re.compile(r"\\[dt]frac(?![a-zA-Z])")
+NUMERIC_FRAC = re.compile(r"\\frac\{\s*([-+]?[\d.]+)\s*\}\{\s*([-+]?[\d.]+)\s*\}")
+VARIABLE_PREFIX = re.compile(r"^[a-zA-Z]\s*=\s*")
+EXPONENT = re.compile(r"[eE]([-+]?[\d_]+)\s*$")
+# A number followed by a one-word unit, such as "18 dollars" or "5 ft.".
+NUMBER_WITH_UNIT = re.compile(r"^([-+]?[\d.]+(?:/[\d.]+)?)\s*[a-zA-Z]+\.?$")
+
+
+def unwrap_command(s: str, command: str) -> str:
+    # \command{...} -> ..., honoring nested braces.
+    while (start := s.find(command + "{")) != -1:
+        depth, i = 0, start + len(command)
+        for i in range(start + len(command), len(s)):
+            depth += {"{": 1, "}": -1}.get(s[i], 0)
+            if depth == 0:
+                break
+        else:
+            return s
+        s = s[:start] + s[start + len(command) + 1 : i] + s[i + 1 :]
+    return s
+
+
+def canonical_number(s: str) -> str | None:
+    if len(s) > MAX_NUMBER_CHARS:
+        return None
+    try:
+        if (m := EXPONENT.search(s)) and abs(int(m[1])) > MAX_EXPONENT:
+            return None
+        value = Fraction(s)
+        if value.denominator == 1:
+            return str(value.numerator)
+        return f"{value.numerator}/{value.denominator}"
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _normalize_answer(text: str) -> str:
+    # Plain digits: the common GSM8K case.
+    if text.isascii() and text.isdigit():
+        return text.lstrip("0") or "0"
+
+    s = text.strip()
+    for left, right in MATH_DELIMITERS:
+        if len(s) > len(left) + len(right) and s.startswith(left) and s.endswith(right):
+            s = s[len(left) : -len(right)].strip()
+            break
+    for command in UNWRAPPED_COMMANDS:
+        s = unwrap_command(s, command)
+    for token in DROPPED_TOKENS:
+        s = s.replace(token, "")
+    s = FRAC_COMMAND.sub(r"\\frac", s)
+    s = NUMERIC_FRAC.sub(r"\1/\2", s)
+    s = VARIABLE_PREFIX.sub("", s.strip()).rstrip(".").strip()
+    s = THOUSANDS_SEPARATOR.sub("", s)
+    s = SPACE_GROUPED_NUMBER.sub(lambda m: m[0].replace(" ", ""), s)
+
+    if m := NUMBER_WITH_UNIT.match(s):
+        s = m[1]
+    s = DROPPED_WHITESPACE.sub("", DIGIT_GAP.sub(" ", s))
+    number = canonical_number(s)
+    if number is not None:
+        return number
+    return s
+
+
+_cached_normalize = lru_cache(maxsize=65536)(_normalize_answer)
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Canonical form of an answer, so equal values compare equal as strings:
+    "1,000", "1 000", "$1000", "1000.0" and "\\boxed{1000}" all become "1000",
+    and "0.5", "1/2" and "\\frac{1}{2}" become "1/2". A trailing unit word and
+    simple LaTeX markup are dropped; anything that isn't a number is returned
+    with its whitespace removed, except single spaces between digits.
+    """
+    if len(text) > MAX_CACHED_CHARS:
+        return _normalize_answer(text)
+    return _cached_normalize(text)
+
+
+def answers_match(response, answer) -> bool:
+    if not isinstance(response, str) or not isinstance(answer, str):
+        return response == answer
+    return normalize_answer(response) == normalize_answer(answer)
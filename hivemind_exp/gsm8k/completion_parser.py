@@ -0,0 +1,96 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable
+
+TAG_PATTERN = re.compile(r"<(/?)([a-z_]+)>")
+
+
+class CompletionView:
+    """
+    Tag positions of a completion, from a single scan. Answers the same
+    questions reward functions used to ask with repeated str.count /
+    str.split / re.match calls, with identical results.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.opens: dict[str, list[int]] = defaultdict(list)
+        self.closes: dict[str, list[int]] = defaultdict(list)
+        for m in TAG_PATTERN.finditer(text):
+            (self.closes if m.group(1) else self.opens)[m.group(2)].append(m.start())
+        self._spans: dict[str, list[tuple[int, int]]] = {}
+        self._checks: dict[Callable[[str], object], bool] = {}
+
+    def _tag_starts(self, tag: str) -> list[int]:
+        m = TAG_PATTERN.fullmatch(tag)
+        assert m, f"not a tag: {tag!r}"
+        return (self.closes if m.group(1) else self.opens).get(m.group(2), [])
+
+    def spans(self, token: str) -> list[tuple[int, int]]:
+        """
+        Non-overlapping (start, end) spans of `token`, a tag optionally wrapped
+        in newlines, as found by str.count / str.split.
+        """
+        if token not in self._spans:
+            tag = token.strip("\n")
+            lead = len(token) - len(token.lstrip("\n"))
+            trail = len(token) - len(token.rstrip("\n"))
+            text, spans, last_end = self.text, [], 0
+            for pos in self._tag_starts(tag):
+                start, end = pos - lead, pos + len(tag) + trail
+                if (
+                    start >= last_end
+                    and text[start:pos] == "\n" * lead
+                    and text[pos + len(tag) : end] == "\n" * trail
+                ):
+                    spans.append((start, end))
+                    last_end = end
+            self._spans[token] = spans
+        return self._spans[token]
+
+    def count(self, token: str) -> int:
+        return len(self.spans(token))
+
+    def tail_len(self, token: str) -> int:
+        # len(text.split(token)[-1])
+        spans = self.spans(token)
+        return len(self.text) - (spans[-1][1] if spans else 0)
+
+    def _close_after(self, tag: str, pos: int) -> int:
+        for close in self.closes.get(tag, []):
+            if close >= pos:
+                return close
+        return len(self.text)
+
+    def tag_content(self, tag: str) -> str:
+        # text.split("<tag>")[-1].split("</tag>")[0].strip()
+        opens = self.opens.get(tag)
+        start = opens[-1] + len(tag) + 2 if opens else 0
+        return self.text[start : self._close_after(tag, start)].strip()
+
+    def tag_contents(self, tag: str) -> list[str]:
+        # [s.split("</tag>")[0].strip() for s in text.split("<tag>")[1:]]
+        opens = self.opens.get(tag, [])
+        contents = []
+        for i, pos in enumerate(opens):
+            start = pos + len(tag) + 2
+            end = opens[i + 1] if i + 1 < len(opens) else len(self.text)
+            end = min(end, self._close_after(tag, start))
+            contents.append(self.text[start:end].strip())
+        return contents
+
+    def check(self, validator: Callable[[str], object]) -> bool:
+        # Cached truth of validator(text), e.g. a format check.
+        if validator not in self._checks:
+            self._checks[validator] = bool(validator(self.text))
+        return self._checks[validator]
+
+    def match(self, pattern: re.Pattern) -> bool:
+        return self.check(pattern.match)
+
+
+@lru_cache(maxsize=4096)
+def parse_completion(text: str) -> CompletionView:
+    # Every reward function of a step sees the same completion strings.
+    return CompletionView(text)
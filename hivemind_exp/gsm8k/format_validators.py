@@ -0,0 +1,67 @@
+import re
+from typing import Sequence
+
+
+class FormatGrammar:
+    """
+    A stage's completion format: a sequence of XML-style sections. Checks the
+    same strict and soft formats as `strict_pattern` / `soft_pattern` with
+    linear scans, so long completions can't trigger regex backtracking.
+
+    Strict: every tag on its own line, each section's content a single line,
+    and nothing after the last closing tag but an optional extra newline.
+    Soft: starting at the first tag, each section's content stays on one line
+    and sections are separated by whitespace only; anything may follow.
+    """
+
+    def __init__(self, tags: Sequence[str]):
+        self.tags = tuple(tags)
+        self.opens = tuple(f"<{t}>" for t in self.tags)
+        self.closes = tuple(f"</{t}>" for t in self.tags)
+        self.strict_pattern = re.compile(
+            "^" + "".join(rf"<{t}>\n.*?\n</{t}>\n" for t in self.tags) + "$"
+        )
+        self.soft_pattern = re.compile(
+            r"\s*".join(rf"<{t}>.*?</{t}>" for t in self.tags)
+        )
+
+    def strict(self, text: str) -> bool:
+        lines = text.split("\n")
+        n = 3 * len(self.tags)
+        if len(lines) not in (n + 1, n + 2) or any(lines[n:]):
+            return False
+        return all(
+            lines[3 * i] == o and lines[3 * i + 2] == c
+            for i, (o, c) in enumerate(zip(self.opens, self.closes))
+        )
+
+    def soft(self, text: str) -> bool:
+        if not text.startswith(self.opens[0]):
+            return False
+        # Positions right after an opening tag that a match can reach.
+        starts = [len(self.opens[0])]
+        for i, close in enumerate(self.closes):
+            last = i + 1 == len(self.closes)
+            next_starts = []
+            j, start_end = 0, None
+            q = text.find(close, starts[0])
+            while q != -1:
+                # Latest reachable start at or before q; a section's content
+                # can't span a newline.
+                while j < len(starts) and starts[j] <= q:
+                    if start_end is None or -1 < start_end < starts[j]:
+                        start_end = text.find("\n", starts[j])
+                    j += 1
+                if start_end == -1 or q <= start_end:
+                    if last:
+                        return True
+                    w = q + len(close)
+                    while w < len(text) and text[w].isspace():
+                        w += 1
+                    if text.startswith(self.opens[i + 1], w):
+                        next_starts.append(w + len(self.opens[i + 1]))
+                q = text.find(close, q + len(close))
+            if not next_starts:
+                return False
+            starts = next_starts
+        return False
@@ -1,12 +1,27 @@
 # For geting top-k ranking for subsampling
 import hashlib
+import heapq
+import logging
 import os
 import random
+import uuid
+from functools import lru_cache
 
 from datasets import Dataset, load_dataset
+from datasets.exceptions import DatasetGenerationError
+from huggingface_hub import HfApi
 
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
 import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+from hivemind_exp.dataset_cache import (
+    DEFAULT_CACHE_DIR,
+    cleanup_cache_files,
+    load_datasets,
+    save_datasets,
+)
+from hivemind_exp.gsm8k.score_cache import SCORE_CACHE
+
+logger = logging.getLogger(__name__)
 
 #############################################################################################################
 # TODO: Lots of repitition across stages, so would be good to fold them into one another and simplify things.#
@@ -91,145 +106,161 @@ def generate_system_prompt(default_sys_prompt):
         return default_sys_prompt
 
 
+AGENT_FIELDS = ("agent_answers", "agent_opinion")
+
+
+def agent_entries(texts: dict[str, str]) -> list[dict[str, str]]:
+    # Nested (agent_id, text) entries, so rows scale with actual contributors.
+    # Missing answers are simply absent; no placeholders are synthesized.
+    return [{"agent_id": a, "text": texts[a]} for a in sorted(texts)]
+
+
+def agent_texts(datum, field) -> dict[str, str]:
+    return {e["agent_id"]: e["text"] for e in datum.get(field) or []}
+
+
 def stage2_generator(values):
-    # TODO: A bit hacky/ugly. Should come back and clean up a bit
     for val in values:
-        output = {}
-        for field in val:
-            if field not in ["agent_answers"]:
-                output[field] = val[field]
-            else:
-                for subfield in val[field]:
-                    output[f"{field}_{subfield}"] = val[field][subfield]
+        if not val["agent_answers"]:
+            continue  # Nothing to compare.
+        output = dict(val)
+        output["agent_answers"] = agent_entries(val["agent_answers"])
         yield output
 
 
 def stage3_generator(values):
-    # TODO: A bit hacky/ugly. Should come back and clean up a bit
     for val in values:
-        output = {}
-        for field in val:
-            if field not in {"agent_answers", "agent_opinion"}:
-                output[field] = val[field]
-            else:
-                for subfield in val[field]:
-                    output[f"{field}_{subfield}"] = val[field][subfield]
+        if not val["agent_opinion"]:
+            continue  # Nothing to compare.
+        output = dict(val)
+        for field in AGENT_FIELDS:
+            if field in val:
+                output[field] = agent_entries(val[field])
         yield output
 
 
-def sorted_agent_ids(cols, prefix):
-    # Undos the _ encoding.
-    agent_ids = []
-    for c in cols:
-        if c.startswith(prefix):
-            agent_ids.append(c[len(prefix) :])
-    agent_ids.sort(reverse=False)
-    return agent_ids
+def records_to_dataset(records) -> Dataset:
+    # Built in memory: unlike Dataset.from_generator, nothing is fingerprinted or
+    # written under the HF datasets cache.
+    if not records:
+        raise DatasetGenerationError("no merged samples to build a dataset from")
+
+    columns = {}
+    for record in records:
+        columns.update(dict.fromkeys(record))
+    return Dataset.from_dict({c: [record.get(c) for record in records] for c in columns})
 
 
 # Generating unique student ids here to ensure consistency in future rounds with the same agents.
 # TODO: Currently assumes number of respondents is the same across rounds. We should loosen this requirement, but need to think of a way to reasonably add a "name"/id our models can be expected to "remember"...
-def get_unique_student_ids(cols):
-    return {a: i for i, a in enumerate(sorted_agent_ids(cols, "agent_answers_"))}
+def get_unique_student_ids(agent_ids):
+    return {a: i for i, a in enumerate(sorted(agent_ids))}
+
 
+def get_unique_critic_ids(agent_ids):
+    return {a: i for i, a in enumerate(sorted(agent_ids))}
 
-def get_unique_critic_ids(cols):
-    return {a: i for i, a in enumerate(sorted_agent_ids(cols, "agent_opinion_"))}
 
+@lru_cache(maxsize=4096)
+def answer_tiebreaker(field, agent_id) -> int:
+    # Hash of the (legacy) column name. Note: Only needed in experimental setting since we don't have a consistent numerical ID per model output.
+    hash_fxn = hashlib.md5()
+    hash_fxn.update(str.encode(f"{field}_{agent_id}"))
+    return int(hash_fxn.hexdigest(), 16)
 
-def pick_k_cols(cols, datum, current_stage, default_k=5, method="top_k"):
-    # Filter columns according to current round
+
+def pick_k_answers(datum, current_stage, default_k=5, method="top_k"):
+    # Filter answers according to current round
     if current_stage == 2:
-        prefix = "agent_answers"
+        field = "agent_answers"
     elif current_stage == 3:
-        prefix = "agent_opinion"
-    valid_cols = [c for c in cols if c.startswith(prefix)]
+        field = "agent_opinion"
+    texts = agent_texts(datum, field)
+    agent_ids = list(texts)
     # Set k to appropriate length if too large
-    k = min(default_k, len(valid_cols))
+    k = min(default_k, len(agent_ids))
     # Subsample according to chosen method
     if method == "uniform_random":
-        # Random sample k cols without replacement
-        subsampled_cols = random.sample(valid_cols, k)
-    elif (
-        method == "top_k"
-    ):  # TODO: Clean this up. Super ugly way of doing this, but too jet-lagged to optimize...
-        # Find total reward per answer and map in dict for easy sorting/filtering
-        question, completions, answer = (
-            [[{"content": datum["question"]}]],
-            [[{"content": datum[c]}] for c in valid_cols],
-            [datum["answer"] for _ in valid_cols],
-        )  # Weird formatting is for compatability with stage reward functions
+        # Random sample k answers without replacement
+        subsampled_ids = random.sample(agent_ids, k)
+    elif method == "top_k":
+        # Find total reward per answer; identical answers are only scored once
+        # per round (see SCORE_CACHE).
         if current_stage == 2:
-            total_rewards = stage1_rewards.top_k_cumulative_reward(
-                question, completions, answer
-            )
+            kind, cumulative_reward = "stage1_top_k", stage1_rewards.cumulative_reward
         elif current_stage == 3:
-            total_rewards = stage2_rewards.top_k_cumulative_reward(
-                question, completions, answer
+            kind, cumulative_reward = "stage2_top_k", stage2_rewards.cumulative_reward
+
+        def score_fn(batch):
+            # Weird formatting is for compatability with stage reward functions
+            return cumulative_reward(
+                [[{"content": datum["question"]}]],
+                [[{"content": t}] for t in batch],
+                [datum["answer"] for _ in batch],
             )
-        reward_per_col = {c: {} for c in valid_cols}
-        for idx, c in enumerate(valid_cols):
-            # First hash column name for tiebreaker. Note: Only needed in experimental setting since we don't have a consistent numerical ID per model output.
-            hash_fxn = hashlib.md5()
-            hash_fxn.update(str.encode(c))
-            reward_per_col[c]["tiebreaker"] = int(hash_fxn.hexdigest(), 16)
-            # Add reward for this answer
-            reward_per_col[c]["reward"] = total_rewards[idx]
-        # Pick top k and resolve ties deterministically using the hashed tiebreakers
-        to_sort = [
-            (reward_per_col[c]["reward"], reward_per_col[c]["tiebreaker"], c)
-            for c in reward_per_col
-        ]
-        to_sort.sort(key=lambda x: (x[0], x[1], x[2]))
-        _, _, valid_cols = zip(*to_sort)
-        subsampled_cols = valid_cols[-k:]
-    return subsampled_cols
-
 
-def generate_stage2_user_prompt(datum, cols):
+        total_rewards = SCORE_CACHE.get_scores(
+            kind,
+            datum["question"],
+            datum["answer"],
+            [texts[a] for a in agent_ids],
+            score_fn,
+        )
+        # Pick top k and resolve ties deterministically using the hashed tiebreakers
+        top = heapq.nlargest(
+            k,
+            (
+                (reward, answer_tiebreaker(field, a), a)
+                for reward, a in zip(total_rewards, agent_ids)
+            ),
+        )
+        subsampled_ids = [a for _, _, a in reversed(top)]
+    return {a: texts[a] for a in subsampled_ids}
+
+
+def generate_stage2_user_prompt(datum, subsampled=None):
     sp = []
     sp.append(f"The question we were given is: {datum['question']}" + "  \n\n")
     sp.append("The following answers to this question were suggested:" + " \n")
-    subsampled_cols = pick_k_cols(
-        cols, datum, 2
-    )  # Subsample columns to stop prompt bloating
-    agentID_to_studentID = get_unique_student_ids(subsampled_cols)
+    if subsampled is None:
+        subsampled = pick_k_answers(
+            datum, 2
+        )  # Subsample answers to stop prompt bloating
+    agentID_to_studentID = get_unique_student_ids(subsampled)
     for agentID in agentID_to_studentID:
-        feature = f"agent_answers_{agentID}"
-        if feature in datum:
-            sp.append(
-                f"<student>Student #{agentID_to_studentID[agentID]}</student> said \n"
-            )
-            sp.append(datum[feature])
-            sp.append("\n\n\n")
+        sp.append(
+            f"<student>Student #{agentID_to_studentID[agentID]}</student> said \n"
+        )
+        sp.append(subsampled[agentID])
+        sp.append("\n\n\n")
     return "".join(sp)
 
 
-def generate_stage3_user_prompt(datum, cols):
+def generate_stage3_user_prompt(datum, subsampled=None):
     sp = []
     sp.append(f"{datum['stage2_prompt']}" + "  \n")
     sp.append(
         "After comparing these answers, the following feedback was given about which answer is best:"
         + " \n"
     )
-    subsampled_cols = pick_k_cols(
-        cols, datum, 3
-    )  # Subsample columns to stop prompt bloating
+    if subsampled is None:
+        subsampled = pick_k_answers(
+            datum, 3
+        )  # Subsample opinions to stop prompt bloating
     # TODO: Why is this different from shared_fs_experiments?
-    agentID_to_criticID = get_unique_critic_ids(subsampled_cols)
+    agentID_to_criticID = get_unique_critic_ids(subsampled)
     for agentID in agentID_to_criticID:
-        feature = f"agent_opinion_{agentID}"
-        if feature in datum:
-            sp.append(
-                f"<criticism>Criticism #{agentID_to_criticID[agentID]}</criticism> was \n"
-            )
-            sp.append(datum[feature])
-            sp.append("\n\n\n")
+        sp.append(
+            f"<criticism>Criticism #{agentID_to_criticID[agentID]}</criticism> was \n"
+        )
+        sp.append(subsampled[agentID])
+        sp.append("\n\n\n")
     return "".join(sp)
 
 
-def get_gsm8k_questions(data) -> Dataset:
-    sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
+def get_gsm8k_questions(data, sys_prompt=None, keep_in_memory=False) -> Dataset:
+    if sys_prompt is None:
+        sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
 
     data = data.map(
         lambda x: {
@@ -238,86 +269,242 @@ def get_gsm8k_questions(data) -> Dataset:
                 {"role": "user", "content": x["question"]},
             ],
             "answer": extract_hash_answer(x["answer"]),
-        }
+        },
+        keep_in_memory=keep_in_memory,
     )
     return data
 
 
-def get_gsm8k_questions_with_stage1_answers(data) -> Dataset:
+def batch_rows(batch):
+    # Rows of a batched map's column dict.
+    columns = list(batch)
+    return [dict(zip(columns, values)) for values in zip(*batch.values())]
+
+
+class PromptBudget:
+    """
+    Fits stage 2/3 prompts into `max_prompt_length` tokens of the run's
+    tokenizer, so the trainer never truncates them. Answer lengths are cached
+    by content hash.
+    """
+
+    def __init__(self, tokenizer, max_prompt_length: int):
+        self.tokenizer = tokenizer
+        self.max_prompt_length = max_prompt_length
+        self.lengths: dict[str, int] = {}
+        self.overflows = 0
+
+    @property
+    def fingerprint(self) -> str:
+        # What the picked answers depend on, for merged dataset cache keys.
+        return f"{self.tokenizer.name_or_path}:{self.max_prompt_length}"
+
+    def text_length(self, text: str) -> int:
+        key = hashlib.md5(text.encode()).hexdigest()
+        if key not in self.lengths:
+            self.lengths[key] = len(
+                self.tokenizer.encode(text, add_special_tokens=False)
+            )
+        return self.lengths[key]
+
+    def prompt_length(self, messages) -> int:
+        return len(
+            self.tokenizer.apply_chat_template(
+                messages, tokenize=True, add_generation_prompt=True
+            )
+        )
+
+    def pick_answers(self, datum, current_stage, render, method="top_k"):
+        """
+        Best-first answers (per `pick_k_answers` ranking) that fit the budget
+        when rendered with `render`. If not even the best answer fits, falls
+        back to the default top-k selection.
+        """
+        if current_stage == 2:
+            field, label = "agent_answers", "<student>Student #0</student> said \n"
+        elif current_stage == 3:
+            field, label = "agent_opinion", "<criticism>Criticism #0</criticism> was \n"
+        texts = agent_texts(datum, field)
+        # All answers, best first.
+        ranked = list(
+            pick_k_answers(datum, current_stage, default_k=len(texts), method=method)
+        )[::-1]
+        if not ranked:
+            return {}
+
+        # Estimate from cached per-answer lengths, packing as many as fit...
+        entry_overhead = self.text_length(label + "\n\n\n")
+        remaining = self.max_prompt_length - self.prompt_length(render({}))
+        picked = []
+        for a in ranked:
+            cost = self.text_length(texts[a]) + entry_overhead
+            if cost <= remaining:
+                picked.append(a)
+                remaining -= cost
+
+        # ...then check the rendered prompt, since tokens don't add up exactly
+        # across answer boundaries.
+        while (
+            picked
+            and self.prompt_length(render({a: texts[a] for a in picked}))
+            > self.max_prompt_length
+        ):
+            picked.pop()
+
+        if not picked:
+            # The trainer will truncate this prompt either way; don't also
+            # starve it of answers.
+            self.overflows += 1
+            if self.overflows == 1:
+                logger.warning(
+                    f"Stage {current_stage} prompts don't fit in max_prompt_length="
+                    f"{self.max_prompt_length} tokens; using top-k answers instead"
+                )
+            return pick_k_answers(datum, current_stage, method=method)
+        return {a: texts[a] for a in picked}
+
+
+def stage_prompt(datum, current_stage, sys_prompt, budget=None):
+    if current_stage == 2:
+        user_prompt_fn = generate_stage2_user_prompt
+    elif current_stage == 3:
+        user_prompt_fn = generate_stage3_user_prompt
+
+    def render(subsampled):
+        return [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_prompt_fn(datum, subsampled)},
+        ]
+
+    if budget is None:
+        return render(None)
+    return render(budget.pick_answers(datum, current_stage, render))
+
+
+def build_stage2_prompts(batch, sys_prompt, budget=None):
+    return {
+        "prompt": [
+            stage_prompt(x, 2, sys_prompt, budget) for x in batch_rows(batch)
+        ],
+        "answer": batch["answer"],
+    }
+
+
+def build_stage3_prompts(batch, sys_prompt, budget=None):
+    return {
+        "prompt": [
+            stage_prompt(x, 3, sys_prompt, budget) for x in batch_rows(batch)
+        ],
+        "answer": batch["answer"],
+    }
+
+
+# Module-level builders (instead of per-call lambdas) pickle cleanly for
+# num_proc workers and hash to stable dataset fingerprints.
+def get_gsm8k_questions_with_stage1_answers(
+    data, num_proc=None, budget: PromptBudget | None = None
+) -> Dataset:
     sys_prompt = generate_system_prompt(STAGE2_SYSTEM_PROMPT)
-    cols = data.column_names
     data = data.map(
-        lambda x: {  # type: ignore
-            "prompt": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": generate_stage2_user_prompt(x, cols)},
-            ],
-            "answer": x["answer"],
-        }
+        build_stage2_prompts,
+        batched=True,
+        fn_kwargs={"sys_prompt": sys_prompt, "budget": budget},
+        num_proc=num_proc,
+        keep_in_memory=True,
     )
     return data
 
 
-def get_gsm8k_questions_with_stage1and2_answers(data) -> Dataset:
+def get_gsm8k_questions_with_stage1and2_answers(
+    data, num_proc=None, budget: PromptBudget | None = None
+) -> Dataset:
     sys_prompt = generate_system_prompt(STAGE3_SYSTEM_PROMPT)
-    cols = data.column_names
     data = data.map(
-        lambda x: {  # type: ignore
-            "prompt": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": generate_stage3_user_prompt(x, cols)},
-            ],
-            "answer": x["answer"],
-        }
+        build_stage3_prompts,
+        batched=True,
+        fn_kwargs={"sys_prompt": sys_prompt, "budget": budget},
+        num_proc=num_proc,
+        keep_in_memory=True,
     )
     return data
 
 
-def fill_unknown_answers_opinions(values):
-    FILLED_FIELDS = ("agent_answers", "agent_opinion")
+def stage1_cache_path(cache_dir, dataset_id, revision, sys_prompt) -> str:
+    hash_fxn = hashlib.md5()
+    hash_fxn.update(f"{dataset_id}\x00{revision}\x00{sys_prompt}".encode())
+    return os.path.join(cache_dir, "stage1", hash_fxn.hexdigest())
 
-    # Collect all agent keys
-    agent_set = set()
-    for val in values:
-        for field in val:
-            if field in FILLED_FIELDS:
-                agent_set |= val[field].keys()
 
-    # Fill in empty agent_answers + agent_opinions
-    for val in values:
-        for field in val:
-            if field in FILLED_FIELDS:
-                diff_keys = agent_set - val[field].keys()
-                for agent in (
-                    diff_keys
-                ):  # Fill with default values. TODO: Decide if this is a good choice.
-                    val[field].update({agent: "No answer received..."})
+def resolve_dataset_revision(dataset_id, revision=None) -> str | None:
+    # Commit SHA of a Hub dataset revision (branch, tag or SHA); None offline.
+    try:
+        return HfApi().dataset_info(dataset_id, revision=revision).sha
+    except Exception as e:
+        logger.info(f"Could not resolve {dataset_id}@{revision or 'main'}: {e}")
+        return None
 
 
-def get_stage1_samples():
-    # Load dataset from Hugging Face Hub
+def resolved_revision_path(cache_dir, dataset_id, revision) -> str:
+    # Last commit SHA `revision` resolved to, for startups without Hub access.
+    hash_fxn = hashlib.md5()
+    hash_fxn.update(f"{dataset_id}\x00{revision}".encode())
+    return os.path.join(cache_dir, "stage1", f"{hash_fxn.hexdigest()}.revision")
+
+
+def get_stage1_samples(cache_dir=DEFAULT_CACHE_DIR, revision=None):
     dataset_id = "openai/gsm8k"
-    train_dataset = load_dataset(dataset_id, "main")["train"]  # type: ignore
-    test_dataset = load_dataset(dataset_id, "main")["test"]  # type: ignore
+    sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
 
-    # convert our dataset to the r1 prompt
-    train_dataset = get_gsm8k_questions(train_dataset)
-    test_dataset = get_gsm8k_questions(test_dataset)
-    return train_dataset, test_dataset
+    # Preprocessed splits are memory-mapped from disk, keyed by the dataset's
+    # commit SHA and system prompt (incl. role), so Hub updates invalidate
+    # them and later startups need no Hub access.
+    sha_path = resolved_revision_path(cache_dir, dataset_id, revision or "main")
+    sha = resolve_dataset_revision(dataset_id, revision)
+    if sha is None and os.path.isfile(sha_path):
+        with open(sha_path) as f:
+            sha = f.read().strip() or None
+
+    path = None
+    if sha:
+        path = stage1_cache_path(cache_dir, dataset_id, sha, sys_prompt)
+        if cached := load_datasets(path):
+            # Drop cache files left next to them, e.g. by earlier runs' selects.
+            cleanup_cache_files(*cached, cache_dir=cache_dir)
+            return cached
 
-def get_stage2_samples(values, test_size=0.1):
-    fill_unknown_answers_opinions(values)
-    dataset = Dataset.from_generator(stage2_generator, gen_kwargs={"values": values})
+    # Load dataset from Hugging Face Hub
+    dataset = load_dataset(dataset_id, "main", revision=sha or revision)
+    train_dataset, test_dataset = dataset["train"], dataset["test"]  # type: ignore
+
+    # convert our dataset to the r1 prompt
+    train_dataset = get_gsm8k_questions(train_dataset, sys_prompt, keep_in_memory=True)
+    test_dataset = get_gsm8k_questions(test_dataset, sys_prompt, keep_in_memory=True)
+
+    if not path:
+        # Unknown commit, so nothing to key a cache entry on.
+        return train_dataset, test_dataset
+    save_datasets(path, train_dataset, test_dataset)
+    try:
+        tmp_path = f"{sha_path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            f.write(sha)
+        os.replace(tmp_path, sha_path)
+    except OSError as e:
+        logger.debug(f"Could not record dataset revision at {sha_path}: {e}")
+    return load_datasets(path) or (train_dataset, test_dataset)
+
+
+def get_stage2_samples(values, test_size=0.1, num_proc=None, budget=None):
+    dataset = records_to_dataset(list(stage2_generator(values)))
 
     # convert our dataset to the r1 prompt
-    dataset = get_gsm8k_questions_with_stage1_answers(dataset)
+    dataset = get_gsm8k_questions_with_stage1_answers(dataset, num_proc, budget)
     return dataset, dataset
 
 
-def get_stage3_samples(values, test_size=0.1):
-    fill_unknown_answers_opinions(values)
-    dataset = Dataset.from_generator(stage3_generator, gen_kwargs={"values": values})
+def get_stage3_samples(values, test_size=0.1, num_proc=None, budget=None):
+    dataset = records_to_dataset(list(stage3_generator(values)))
 
     # convert our dataset to the r1 prompt
-    dataset = get_gsm8k_questions_with_stage1and2_answers(dataset)
+    dataset = get_gsm8k_questions_with_stage1and2_answers(dataset, num_proc, budget)
     return dataset, dataset
\ No newline at end of file
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from typing import Iterable
+
+import numpy as np
+
+from hivemind_exp.gsm8k.answer_normalizer import normalize_answer
+
+logger = logging.getLogger(__name__)
+
+# Open-addressing table of 128-bit question hashes; an all-zero key marks an
+# empty slot. Answers live in one UTF-8 blob, addressed by offset and length.
+SLOT_DTYPE = np.dtype(
+    [("hi", "<u8"), ("lo", "<u8"), ("offset", "<u8"), ("length", "<u4")]
+)
+MAX_LOAD_FACTOR = 0.5
+
+
+def question_hash(question: str) -> str:
+    # Same key the trainer publishes stage outputs under.
+    return hashlib.md5(question.encode()).hexdigest()
+
+
+def _key(q_hash: str) -> tuple[int, int]:
+    return int(q_hash[:16], 16), int(q_hash[16:32], 16)
+
+
+class GoldAnswerIndex:
+    """
+    Normalized gold answers of the stage 1 questions, keyed by question hash,
+    so any stage can recover the answer of a merged record or final output
+    that doesn't carry one. Two flat arrays that `save` writes as .npy files
+    and `load` memory-maps; lookups probe a couple of slots.
+    """
+
+    def __init__(self, slots: np.ndarray, answers: np.ndarray):
+        assert len(slots) and len(slots) & (len(slots) - 1) == 0
+        self.slots = slots
+        self.answers = answers
+        self._mask = len(slots) - 1
+
+    @classmethod
+    def build(cls, questions: Iterable[str], answers: Iterable) -> "GoldAnswerIndex":
+        entries = {
+            question_hash(q): normalize_answer(a).encode()
+            for q, a in zip(questions, answers)
+            if isinstance(q, str) and isinstance(a, str)
+        }
+        capacity = 8
+        while capacity * MAX_LOAD_FACTOR < len(entries):
+            capacity *= 2
+
+        slots = np.zeros(capacity, dtype=SLOT_DTYPE)
+        mask, offset = capacity - 1, 0
+        for q_hash, answer in entries.items():
+            hi, lo = _key(q_hash)
+            i = lo & mask
+            while slots["hi"][i] or slots["lo"][i]:
+                i = (i + 1) & mask
+            slots[i] = (hi, lo, offset, len(answer))
+            offset += len(answer)
+        blob = np.frombuffer(b"".join(entries.values()), dtype=np.uint8)
+        return cls(slots, blob)
+
+    @classmethod
+    def from_datasets(cls, *datasets) -> "GoldAnswerIndex":
+        # Stage 1 datasets, whose answers get_gsm8k_questions already extracted.
+        return cls.build(
+            (q for d in datasets for q in d["question"]),
+            (a for d in datasets for a in d["answer"]),
+        )
+
+    @classmethod
+    def for_datasets(cls, cache_dir: str, *datasets) -> "GoldAnswerIndex":
+        """
+        Index of `datasets`, memory-mapped from <cache_dir>/gold_answers,
+        where it's built once per dataset fingerprint.
+        """
+        hash_fxn = hashlib.md5()
+        for d in datasets:
+            hash_fxn.update(f"{d._fingerprint}\x00".encode())
+        path = os.path.join(cache_dir, "gold_answers", hash_fxn.hexdigest())
+        if (index := cls.load(path)) is not None:
+            return index
+        index = cls.from_datasets(*datasets)
+        index.save(path)
+        return cls.load(path) or index
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            os.makedirs(tmp_path)
+            np.save(os.path.join(tmp_path, "slots.npy"), self.slots)
+            np.save(os.path.join(tmp_path, "answers.npy"), self.answers)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Best-effort, like the dataset caches.
+            logger.debug(f"Could not save gold answers at {path}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "GoldAnswerIndex | None":
+        try:
+            slots = np.load(os.path.join(path, "slots.npy"), mmap_mode="r")
+            answers = np.load(os.path.join(path, "answers.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            # Missing, or empty: numpy can't map a zero-length array.
+            return None
+        if slots.dtype != SLOT_DTYPE:
+            return None
+        return cls(slots, answers)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.slots["hi"] | self.slots["lo"]))
+
+    def lookup(self, q_hash: str) -> str | None:
+        hi, lo = _key(q_hash)
+        i = lo & self._mask
+        while True:
+            s_hi, s_lo, offset, length = self.slots[i].tolist()
+            if s_hi == hi and s_lo == lo:
+                return self.answers[offset : offset + length].tobytes().decode()
+            if not (s_hi or s_lo):
+                return None
+            i = (i + 1) & self._mask
+
+    def get(self, question: str) -> str | None:
+        return self.lookup(question_hash(question))
+
+    def __contains__(self, question: str) -> bool:
+        return self.get(question) is not None
@@ -0,0 +1,58 @@
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple
+
+
+class PromptAnalysis(NamedTuple):
+    """
+    The parts of a stage 2/3 prompt that reward functions look up. Every
+    completion of a GRPO group shares its prompt, so these are parsed once
+    per question rather than once per reward function per step. Fields are
+    immutable, since the same analysis is handed to every caller.
+    """
+
+    ids: tuple[str, ...]
+    answers: Mapping[str, str]
+    choices: tuple[str, ...]
+    majority: frozenset[str]
+    question: str
+
+
+def _analyze(
+    text: str,
+    extract_ids: Callable | None,
+    extract_answers: Callable | None,
+    extract_choices: Callable | None,
+    majority: Callable | None,
+    extract_question: Callable | None,
+) -> PromptAnalysis:
+    choices = extract_choices(text) if extract_choices else []
+    return PromptAnalysis(
+        ids=tuple(extract_ids(text)) if extract_ids else (),
+        answers=MappingProxyType(dict(extract_answers(text) if extract_answers else {})),
+        choices=tuple(choices),
+        majority=frozenset(majority(choices) if majority else ()),
+        question=extract_question(text) if extract_question else "",
+    )
+
+
+_cached_analyze = lru_cache(maxsize=1024)(_analyze)
+
+
+def analyze_prompt(
+    text: str,
+    extract_ids: Callable | None = None,
+    extract_answers: Callable | None = None,
+    extract_choices: Callable | None = None,
+    majority: Callable | None = None,
+    extract_question: Callable | None = None,
+) -> PromptAnalysis:
+    """
+    Cached analysis of `text` with the given extractors. The extractors are
+    part of the cache key, so a stage module that swaps one out (as tests do
+    with patch) gets a fresh analysis.
+    """
+    analyze = _cached_analyze if isinstance(text, str) else _analyze
+    return analyze(
+        text, extract_ids, extract_answers, extract_choices, majority, extract_question
+    )
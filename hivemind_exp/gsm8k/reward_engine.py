@@ -0,0 +1,291 @@
+import functools
+from typing import Callable, Collection, Mapping, Sequence
+
+import numpy as np
+
+from hivemind_exp.gsm8k.answer_normalizer import normalize_answer
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+from hivemind_exp.gsm8k.reward_pool import RewardPool
+from hivemind_exp.hivemind_utils import HivemindNode
+
+RewardFunc = Callable[..., list[float]]
+BatchRewardFunc = Callable[["RewardBatch"], np.ndarray]
+# Mask of the completions that can earn a nonzero reward.
+RewardGuard = Callable[["RewardBatch"], np.ndarray]
+
+
+class RewardBatch:
+    """
+    A GRPO batch as arrays: completion texts and gold answers, plus per-tag
+    extractions and format matches computed once and shared by every
+    batched reward function. `prompt` is the text of the batch's prompt and
+    `logging` the call's sample logging flag (None if it wasn't passed).
+
+    Token counts, digit checks and choice lookups are numpy string
+    operations over the whole batch. Tag extraction, answer normalization
+    and format validation are scans of each completion in Python, done once
+    per batch however many reward functions use them.
+    """
+
+    def __init__(
+        self,
+        texts: Sequence[str],
+        answer: Sequence,
+        prompt: str = "",
+        logging: bool | None = None,
+    ):
+        self.prompt = prompt
+        self.logging = logging
+        self.texts = np.array(texts, dtype=object)
+        self.answer = np.empty(len(answer), dtype=object)
+        self.answer[:] = answer
+        self.views = [parse_completion(t) for t in texts]
+        self._contents: dict[str, np.ndarray] = {}
+        self._normalized: dict[str, np.ndarray] = {}
+        self._checks: dict[Callable[[str], bool], np.ndarray] = {}
+        self._token_counts: dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def batch_texts(prompts=None, completions=None, answer=None, **kwargs):
+        """
+        Completion texts of a reward function call, or None if it is malformed
+        in a way only the list reward functions know how to handle.
+        """
+        if not completions or not isinstance(completions, list):
+            return None
+        if not isinstance(answer, list) or len(answer) != len(completions):
+            return None
+        try:
+            prompts[0][-1]["content"]
+            texts = [completion[0]["content"] for completion in completions]
+        except (IndexError, KeyError, TypeError):
+            return None
+        if not all(isinstance(t, str) for t in texts):
+            return None
+        return texts
+
+    @classmethod
+    def from_kwargs(cls, **kwargs):
+        texts = cls.batch_texts(**kwargs)
+        if texts is None:
+            return None
+        return cls(
+            texts,
+            kwargs["answer"],
+            kwargs["prompts"][0][-1]["content"],
+            kwargs.get("logging"),
+        )
+
+    @functools.cached_property
+    def strings(self) -> np.ndarray:
+        # Fixed-width copy of the texts for numpy string operations. Trailing
+        # NULs are dropped, which tokenizers don't emit.
+        return self.texts.astype(str)
+
+    def contents(self, tag: str) -> np.ndarray:
+        # Last <tag> section of each completion, as extracted by the stage modules.
+        if tag not in self._contents:
+            self._contents[tag] = np.array(
+                [v.tag_content(tag) for v in self.views], dtype=object
+            )
+        return self._contents[tag]
+
+    def normalized(self, tag: str) -> np.ndarray:
+        # contents(tag) in canonical answer form (see answer_normalizer).
+        if tag not in self._normalized:
+            self._normalized[tag] = _normalize(self.contents(tag))
+        return self._normalized[tag]
+
+    @functools.cached_property
+    def normalized_answer(self) -> np.ndarray:
+        return _normalize(self.answer)
+
+    def checks(self, validator: Callable[[str], bool]) -> np.ndarray:
+        if validator not in self._checks:
+            self._checks[validator] = np.array(
+                [v.check(validator) for v in self.views], dtype=bool
+            )
+        return self._checks[validator]
+
+    def token_counts(self, token: str) -> np.ndarray:
+        # text.count(token) of each completion.
+        if token not in self._token_counts:
+            self._token_counts[token] = np.char.count(self.strings, token)
+        return self._token_counts[token]
+
+    def tail_lens(self, token: str) -> np.ndarray:
+        # len(text.split(token)[-1]) of each completion.
+        ends = np.char.rfind(self.strings, token)
+        lens = np.char.str_len(self.strings)
+        return np.where(ends < 0, lens, lens - ends - len(token))
+
+    def xml_counts(self, tags: Sequence[str]) -> np.ndarray:
+        """
+        count_xml of the stage modules, for a format with sections `tags`:
+        0.125 for each tag found exactly once on its own line(s), less 0.001
+        per character after the last section.
+        """
+        count = np.zeros(len(self), dtype=np.float64)
+        for tag in tags[:-1]:
+            count += np.where(self.token_counts(f"<{tag}>\n") == 1, 0.125, 0.0)
+            count += np.where(self.token_counts(f"\n</{tag}>\n") == 1, 0.125, 0.0)
+        last = tags[-1]
+        found = self.token_counts(f"\n<{last}>\n") == 1
+        count += np.where(found, 0.125, 0.0)
+        count -= np.where(found, self.tail_lens(f"\n</{last}>\n") * 0.001, 0.0)
+        found = self.token_counts(f"\n</{last}>") == 1
+        count += np.where(found, 0.125, 0.0)
+        count -= np.where(found, (self.tail_lens(f"\n</{last}>") - 1) * 0.001, 0.0)
+        return count
+
+    def is_digit(self, tag: str) -> np.ndarray:
+        return np.char.isdigit(self.contents(tag).astype(str))
+
+    def is_in(self, tag: str, *choices: Collection[str]) -> np.ndarray:
+        # contents(tag) found in any of `choices`.
+        values = [c for choice in choices for c in choice]
+        return np.isin(self.contents(tag), np.array(values, dtype=object))
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    # Non-string values are compared as they are, like answers_match does.
+    out = np.empty(len(values), dtype=object)
+    out[:] = [normalize_answer(v) if isinstance(v, str) else v for v in values]
+    return out
+
+
+def indicator(mask: np.ndarray, weighting: float) -> np.ndarray:
+    return np.where(mask, weighting, 0.0).astype(np.float32)
+
+
+class RewardEngine:
+    """
+    Evaluates a stage's reward functions once per GRPO batch.
+
+    TRL calls every reward function of a stage with the same `completions`
+    list. The first call evaluates all of them into a float32 array per
+    function; the remaining calls, including the cumulative one that publishes
+    node outputs, read those results. Functions with an entry in `batch_funcs`
+    are evaluated on a shared `RewardBatch` instead of through their list
+    implementation, with identical results. With a `pool`, the list-based
+    `pooled_funcs` (which must be elementwise) run in worker processes while
+    the rest are evaluated here.
+
+    A function with an entry in `guards` is only called on the completions its
+    guard lets through; the rest score zero without being looked at. A guard
+    must only rule out completions the function gives exactly zero, and the
+    function's reward for a completion must not depend on the other
+    completions, so the results are unchanged.
+    """
+
+    def __init__(
+        self,
+        reward_funcs: Sequence[RewardFunc],
+        cumulative_funcs: Sequence[RewardFunc],
+        batch_funcs: Mapping[RewardFunc, BatchRewardFunc] | None = None,
+        weights: Sequence[float] | None = None,
+        pool: RewardPool | None = None,
+        pooled_funcs: Sequence[RewardFunc] = (),
+        guards: Mapping[RewardFunc, RewardGuard] | None = None,
+    ):
+        self.cumulative_funcs = tuple(cumulative_funcs)
+        self.funcs = tuple(dict.fromkeys((*reward_funcs, *cumulative_funcs)))
+        self.batch_funcs = dict(batch_funcs or {})
+        self.guards = dict(guards or {})
+        if weights is None:
+            weights = [1.0] * len(self.cumulative_funcs)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        assert self.weights.shape == (len(self.cumulative_funcs),)
+        self.pool = pool
+        # Vectorized and guarded functions are cheap enough to stay in-process.
+        self.pooled_funcs = [
+            fn
+            for fn in self.funcs
+            if fn in pooled_funcs and fn not in self.batch_funcs and fn not in self.guards
+        ]
+        self._batch = None
+        self._results: dict[RewardFunc, np.ndarray] = {}
+
+    def evaluate(self, **kwargs) -> dict[RewardFunc, np.ndarray]:
+        completions = kwargs.get("completions")
+        if completions is not self._batch:
+            futures = {}
+            if self.pool and self.pooled_funcs and RewardBatch.batch_texts(**kwargs):
+                for fn in self.pooled_funcs:
+                    futures[fn] = self.pool.submit(
+                        fn, kwargs["prompts"], completions, kwargs["answer"]
+                    )
+
+            batch = None
+            if self.batch_funcs or self.guards:
+                batch = RewardBatch.from_kwargs(**kwargs)
+            results = {}
+            for fn in self.funcs:
+                if fn in futures:
+                    continue
+                if batch is not None and fn in self.batch_funcs:
+                    results[fn] = self.batch_funcs[fn](batch)
+                elif batch is not None and fn in self.guards:
+                    results[fn] = self._evaluate_guarded(fn, batch, kwargs)
+                else:
+                    results[fn] = np.asarray(fn(**kwargs), dtype=np.float32)
+            if futures:
+                for fn, rewards in self.pool.collect(futures).items():
+                    if rewards is None:
+                        rewards = fn(**kwargs)
+                    results[fn] = np.asarray(rewards, dtype=np.float32)
+            self._results = results
+            self._batch = completions
+        return self._results
+
+    def _evaluate_guarded(self, fn: RewardFunc, batch: RewardBatch, kwargs) -> np.ndarray:
+        rows = np.flatnonzero(self.guards[fn](batch))
+        rewards = np.zeros(len(batch), dtype=np.float32)
+        if len(rows):
+            completions = kwargs["completions"]
+            rewards[rows] = fn(**{**kwargs, "completions": [completions[i] for i in rows]})
+        return rewards
+
+    def wrap(self, fn: RewardFunc) -> RewardFunc:
+        # List adapter for TRL; keeps __name__, which TRL uses to log each reward.
+        @functools.wraps(fn)
+        def wrapped(**kwargs):
+            return self.evaluate(**kwargs)[fn].tolist()
+
+        return wrapped
+
+    def total(self, **kwargs) -> np.ndarray:
+        results = self.evaluate(**kwargs)
+        rows = [results[fn] for fn in self.cumulative_funcs]
+        n = min(len(row) for row in rows)
+        return self.weights @ np.stack([row[:n] for row in rows])
+
+    def hivemind_cumulative_reward(
+        self,
+        node: HivemindNode,
+        outputs_fn: Callable[..., dict],
+        prompts,
+        completions,
+        answer,
+        **kwargs,
+    ) -> list[float]:
+        """
+        Cumulative reward for TRL: saves the total reward and the best output
+        (per `outputs_fn`) to the node, and returns zeros.
+        """
+        if node is None:
+            return [0.0]
+        if prompts is None or not prompts or not isinstance(prompts, list):
+            return [0.0]
+        if completions is None or not completions or not isinstance(completions, list):
+            return [0.0]
+
+        total_reward = self.total(
+            prompts=prompts, completions=completions, answer=answer, **kwargs
+        ).tolist()
+        node.outputs = outputs_fn(node, prompts, completions, answer, total_reward)
+        node.rewards = total_reward
+        return [0.0 for _ in total_reward]
@@ -0,0 +1,88 @@
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+RewardFunc = Callable[..., list[float]]
+
+
+def _evaluate_chunk(fn: RewardFunc, prompts, completions, answer) -> list[float]:
+    return fn(prompts=prompts, completions=completions, answer=answer)
+
+
+class RewardPool:
+    """
+    Persistent process pool for elementwise reward functions: ones where the
+    reward of completion i depends only on completions[i], answer[i] and
+    prompts[0]. Batches are split into chunks of `chunk_size` completions, so
+    results match the in-process call exactly.
+
+    Workers are spawned rather than forked, since the training process holds
+    CUDA and DHT state.
+    """
+
+    def __init__(self, num_workers: int, chunk_size: int = 16, timeout: float = 60.0):
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            self.num_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(self, fn: RewardFunc, prompts, completions, answer) -> list[Future]:
+        futures = []
+        for start in range(0, len(completions), self.chunk_size):
+            end = min(start + self.chunk_size, len(completions))
+            try:
+                futures.append(
+                    self._executor.submit(
+                        _evaluate_chunk,
+                        fn,
+                        [prompts[0]] * (end - start),
+                        completions[start:end],
+                        answer[start:end],
+                    )
+                )
+            except BrokenProcessPool:
+                self._executor = self._new_executor()
+                return []
+        return futures
+
+    def collect(self, futures: dict[RewardFunc, list[Future]]) -> dict:
+        """
+        Concatenated chunk results per function, waiting at most `timeout` for
+        the whole batch. Functions that timed out or whose worker failed map to
+        None; the caller then evaluates them in-process.
+        """
+        _, pending = wait(
+            [f for chunks in futures.values() for f in chunks], timeout=self.timeout
+        )
+        if pending:
+            logger.warning(f"Reward batch timed out after {self.timeout}s")
+            for f in pending:
+                f.cancel()
+
+        results, broken = {}, False
+        for fn, chunks in futures.items():
+            results[fn] = None
+            if not chunks or any(f in pending for f in chunks):
+                continue
+            try:
+                results[fn] = [r for f in chunks for r in f.result()]
+            except BrokenProcessPool:
+                broken = True
+            except Exception as e:
+                logger.warning(f"Reward worker failed on {fn.__name__}: {e!r}")
+        if broken:
+            logger.warning("Reward worker died; restarting pool")
+            self._executor = self._new_executor()
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
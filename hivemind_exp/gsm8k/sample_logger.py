@@ -0,0 +1,115 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Fraction of reward function calls that log a sample.
+SAMPLE_LOG_RATE = float(os.getenv("SAMPLE_LOG_RATE", "0.01"))
+
+
+class SampleLogger:
+    """
+    Writes reward function samples under `root` from a background thread.
+    Reward functions enqueue a record and return; the writer appends records
+    to `root/subdir/filename`, rotating a file to `.1`, `.2`, ... once it
+    exceeds `max_bytes`. Records are dropped, not waited on, when the buffer
+    is full, and a file that can't be written loses its records while the
+    others are still written.
+    """
+
+    def __init__(
+        self,
+        root: str = "model_output_samples",
+        rate: float = SAMPLE_LOG_RATE,
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 3,
+        max_records: int = 1024,
+    ):
+        self.root = root
+        self.rate = rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records: queue.Queue = queue.Queue(max_records)
+        self.dropped = 0
+        self._sizes: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def should_log(self) -> bool:
+        return random.random() < self.rate
+
+    def log(self, subdir: str, filename: str, text: str):
+        self._start()
+        try:
+            self.records.put_nowait((os.path.join(self.root, subdir, filename), text))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float | None = 10.0) -> bool:
+        # Waits up to `timeout` seconds for every queued record to be written;
+        # returns whether they were.
+        if not self._thread:
+            return True
+        with self.records.all_tasks_done:
+            return self.records.all_tasks_done.wait_for(
+                lambda: not self.records.unfinished_tasks, timeout
+            )
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="sample-logger", daemon=True
+                    )
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            by_path = defaultdict(list)
+            for path, text in batch:
+                by_path[path].append("-" * 20 + text)
+            for path, texts in by_path.items():
+                # Anything escaping here would kill the writer and hang flush.
+                try:
+                    self._write(path, "".join(texts))
+                except Exception as e:
+                    logger.warning(f"Couldn't write reward samples to {path}: {e}")
+            for _ in batch:
+                self.records.task_done()
+
+    def _write(self, path: str, data: str):
+        size = len(data.encode())
+        if path not in self._sizes:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+        if self._sizes[path] and self._sizes[path] + size > self.max_bytes:
+            self._rotate(path)
+        with open(path, "a") as f:
+            f.write(data)
+        self._sizes[path] += size
+
+    def _rotate(self, path: str):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backups:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        self._sizes[path] = 0
+
+
+SAMPLE_LOGGER = SampleLogger()
@@ -0,0 +1,47 @@
+import hashlib
+from typing import Callable, Sequence
+
+
+def score_key(kind: str, prompt, answer, text) -> str:
+    hash_fxn = hashlib.md5()
+    hash_fxn.update(f"{kind}\x00{prompt}\x00{answer}\x00{text}".encode())
+    return hash_fxn.hexdigest()
+
+
+class ScoreCache:
+    """
+    Reward scores keyed by content hash, shared across stages (and round winner
+    selection) within a round. `kind` names the scoring function, so answers
+    scored by different reward sets never collide.
+    """
+
+    def __init__(self):
+        self.round_num = None
+        self.scores: dict[str, float] = {}
+
+    def start_round(self, r: int):
+        if r != self.round_num:
+            self.round_num = r
+            self.scores.clear()
+
+    def get_scores(
+        self,
+        kind: str,
+        prompt,
+        answer,
+        texts: Sequence[str],
+        score_fn: Callable[[list[str]], list[float]],
+    ) -> list[float]:
+        """
+        Scores of `texts` for the given prompt/answer. Texts not seen before are
+        scored with a single batched `score_fn` call.
+        """
+        keys = [score_key(kind, prompt, answer, t) for t in texts]
+        missing = {k: t for k, t in zip(keys, texts) if k not in self.scores}
+        if missing:
+            scores = score_fn(list(missing.values()))
+            self.scores.update(zip(missing, scores))
+        return [self.scores[k] for k in keys]
+
+
+SCORE_CACHE = ScoreCache()
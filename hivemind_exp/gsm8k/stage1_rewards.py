@@ -1,20 +1,26 @@
 import os
-import random
-import re
 
 import numpy as np
 
+from hivemind_exp.gsm8k.answer_normalizer import answers_match
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+from hivemind_exp.gsm8k.format_validators import FormatGrammar
+from hivemind_exp.gsm8k.reward_engine import RewardBatch, RewardEngine, indicator
+from hivemind_exp.gsm8k.sample_logger import SAMPLE_LOGGER
 from hivemind_exp.hivemind_utils import HivemindNode
 
+# Completion format; checked by linear scans, with equivalent regexes.
+FORMAT = FormatGrammar(("think", "answer"))
+STRICT_FORMAT_PATTERN = FORMAT.strict_pattern
+SOFT_FORMAT_PATTERN = FORMAT.soft_pattern
+
 
 def extract_xml_answer(text: str) -> str:
     if text is None:
         return ""
     if not isinstance(text, str):
         return ""
-    answer = text.split("<answer>")[-1]
-    answer = answer.split("</answer>")[0]
-    return answer.strip()
+    return parse_completion(text).tag_content("answer")
 
 
 def count_xml(text) -> float:
@@ -22,17 +28,18 @@ def count_xml(text) -> float:
         return 0.0
     if not isinstance(text, str):
         return 0.0
+    view = parse_completion(text)
     count = 0.0
-    if text.count("<think>\n") == 1:
+    if view.count("<think>\n") == 1:
         count += 0.125
-    if text.count("\n</think>\n") == 1:
+    if view.count("\n</think>\n") == 1:
         count += 0.125
-    if text.count("\n<answer>\n") == 1:
+    if view.count("\n<answer>\n") == 1:
         count += 0.125
-        count -= len(text.split("\n</answer>\n")[-1]) * 0.001
-    if text.count("\n</answer>") == 1:
+        count -= view.tail_len("\n</answer>\n") * 0.001
+    if view.count("\n</answer>") == 1:
         count += 0.125
-        count -= (len(text.split("\n</answer>")[-1]) - 1) * 0.001
+        count -= (view.tail_len("\n</answer>") - 1) * 0.001
     return count
 
 
@@ -53,22 +60,15 @@ def correctness_reward_func(
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "correctness_samples.txt",
+            f"Question:\n{q}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"Question:\n{q}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
-            f.write(out_line)
     return [
-        1.0 * weighting if r == a else 0.0 for r, a in zip(extracted_responses, answer)
+        1.0 * weighting if answers_match(r, a) else 0.0
+        for r, a in zip(extracted_responses, answer)
     ]
 
 
@@ -84,11 +84,9 @@ def strict_format_reward_func(completions, weighting=0.5, **kwargs) -> list[floa
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.strict) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
@@ -101,11 +99,9 @@ def soft_format_reward_func(completions, weighting=0.5, **kwargs) -> list[float]
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.soft) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
@@ -125,41 +121,86 @@ def xmlcount_reward_func(completions, weighting=1.0, **kwargs) -> list[float]:
     return [count_xml(c) * weighting for c in contents]
 
 
-def top_k_cumulative_reward(
-    prompts,
-    completions,
-    answer,
-    logging=False,
-    **kwargs,
-) -> list[float]:
+# Summation order of the cumulative rewards.
+CUMULATIVE_REWARD_FUNCS = (
+    correctness_reward_func,
+    int_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+# Array versions of the reward functions above, for RewardEngine.
+def batch_correctness_reward(batch: RewardBatch, weighting=2.0) -> np.ndarray:
+    return indicator(batch.normalized("answer") == batch.normalized_answer, weighting)
+
+
+def batch_int_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    return indicator(batch.is_digit("answer"), weighting)
+
+
+def batch_strict_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    return indicator(batch.checks(FORMAT.strict), weighting)
+
+
+def batch_soft_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    return indicator(batch.checks(FORMAT.soft), weighting)
+
+
+def batch_xmlcount_reward(batch: RewardBatch, weighting=1.0) -> np.ndarray:
+    return (batch.xml_counts(FORMAT.tags) * weighting).astype(np.float32)
+
+
+BATCH_REWARD_FUNCS = {
+    correctness_reward_func: batch_correctness_reward,
+    int_reward_func: batch_int_reward,
+    strict_format_reward_func: batch_strict_format_reward,
+    soft_format_reward_func: batch_soft_format_reward,
+    xmlcount_reward_func: batch_xmlcount_reward,
+}
+
+
+# Every stage 1 reward, in the order TRL logs them.
+REWARD_FUNCS = (
+    xmlcount_reward_func,
+    soft_format_reward_func,
+    strict_format_reward_func,
+    int_reward_func,
+    correctness_reward_func,
+)
+
+
+def reward_engine() -> RewardEngine:
+    # The one place stage 1 rewards are combined; training, top-k selection
+    # and the functions below all sum them through it.
+    return RewardEngine(REWARD_FUNCS, CUMULATIVE_REWARD_FUNCS, BATCH_REWARD_FUNCS)
+
+
+def cumulative_reward(prompts, completions, answer, logging=False) -> list[float]:
     """
-    Dummy reward function that accumulates all rewards into one for prompt generation's top_k selector
+    Sums all stage 1 rewards per completion without touching any node state.
     """
-    # Validate inputs
-    if prompts is None or not prompts or not isinstance(prompts, list):
-        return [0.0]
-    if completions is None or not completions or not isinstance(completions, list):
-        return [0.0]
+    return (
+        reward_engine()
+        .total(prompts=prompts, completions=completions, answer=answer, logging=logging)
+        .tolist()
+    )
+
 
-    # Calculate individual rewards
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
+def hivemind_outputs(node, prompts, completions, answer, total_reward) -> dict:
+    """
+    Output saved to node.outputs: the batch's best completion.
+    """
+    maximal_reward_idx, responses = (
+        np.argmax(total_reward),
+        [completion[0]["content"] for completion in completions],
     )
-    int_reward = int_reward_func(completions)
-    strict_format_reward = strict_format_reward_func(completions)
-    soft_format_reward = soft_format_reward_func(completions)
-    xmlcount_reward = xmlcount_reward_func(completions)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            correctness_reward,
-            int_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-    return total_reward
+    return {
+        "question": prompts[0][-1]["content"],
+        "answer": answer[0],
+        "agent_answers": {node.key: responses[maximal_reward_idx]},
+    }
 
 
 def hivemind_cumulative_reward(
@@ -168,53 +209,11 @@ def hivemind_cumulative_reward(
     completions,
     answer,
     logging=False,
-    output_signal_selector="max",
     **kwargs,
 ) -> list[float]:
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    # Validate inputs
-    if node is None:
-        return [0.0]
-    if prompts is None or not prompts or not isinstance(prompts, list):
-        return [0.0]
-    if completions is None or not completions or not isinstance(completions, list):
-        return [0.0]
-
-    # Calculate individual rewards
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
+    return reward_engine().hivemind_cumulative_reward(
+        node, hivemind_outputs, prompts, completions, answer, logging=logging
     )
-    int_reward = int_reward_func(completions)
-    strict_format_reward = strict_format_reward_func(completions)
-    soft_format_reward = soft_format_reward_func(completions)
-    xmlcount_reward = xmlcount_reward_func(completions)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            correctness_reward,
-            int_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-
-    if output_signal_selector == "max":
-        # Generate output line
-        maximal_reward_idx, responses = (
-            np.argmax(total_reward),
-            [completion[0]["content"] for completion in completions],
-        )
-        output_data = {
-            "question": prompts[0][-1]["content"],
-            "answer": answer[0],
-            "agent_answers": {node.key: responses[maximal_reward_idx]},
-        }
-
-    if output_signal_selector != None:
-        node.outputs = output_data
-        node.rewards = total_reward
-
-    return [0.0 for _ in total_reward]
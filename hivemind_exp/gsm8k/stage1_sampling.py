@@ -0,0 +1,125 @@
+import hashlib
+from typing import Sequence
+
+import numpy as np
+from datasets import Dataset
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.answer_normalizer import answers_match
+
+
+def question_hashes(dataset: Dataset) -> list[str]:
+    # Same hash the DHT uses to key outputs per question.
+    return [hashlib.md5(q.encode()).hexdigest() for q in dataset["question"]]
+
+
+def _hash_int(s: str) -> int:
+    return int(hashlib.md5(s.encode()).hexdigest(), 16)
+
+
+def peer_shards(
+    peer_key: str, r: int, num_shards: int, overlap: int, peers: Sequence[str] = ()
+) -> list[int]:
+    """
+    Shards a peer draws from in round `r`: a window of `overlap` consecutive
+    shards. If the swarm's `peers` are known, windows start evenly spaced by
+    rank, so together they cover every shard once overlap * len(peers) >=
+    num_shards. Otherwise the window starts at a position derived from the
+    key. Either way, windows rotate every round.
+    """
+    overlap = min(overlap, num_shards)
+    if peer_key in peers:
+        ranked = sorted(peers)
+        start = ranked.index(peer_key) * num_shards // len(ranked) + r
+    else:
+        start = _hash_int(peer_key) + r * overlap
+    return sorted({(start + i) % num_shards for i in range(overlap)})
+
+
+def shard_indices(
+    q_hashes: list[str],
+    peer_key: str,
+    r: int,
+    num_shards: int,
+    overlap: int = 2,
+    peers: Sequence[str] = (),
+) -> np.ndarray:
+    """
+    Row indices of the questions `peer_key` should answer in round `r`.
+    Questions are re-bucketed every round, so shards cover different questions
+    over time.
+    """
+    buckets = np.fromiter(
+        (_hash_int(f"{r}:{q}") % num_shards for q in q_hashes),
+        dtype=np.int64,
+        count=len(q_hashes),
+    )
+    shards = peer_shards(peer_key, r, num_shards, overlap, peers)
+    return np.flatnonzero(np.isin(buckets, shards))
+
+
+class CurriculumSampler:
+    """
+    Compact per-question difficulty index (attempts / correct counts by row),
+    fed from this node's stage 1 groups and the swarm's merged stage 1
+    outputs. Sampling favours questions in the learning zone, where GRPO
+    groups have non-zero advantage, and skips ones the swarm has mastered.
+    """
+
+    def __init__(
+        self, q_hashes: list[str], min_attempts: int = 4, mastered: float = 0.95
+    ):
+        self.rows = {q: i for i, q in enumerate(q_hashes)}
+        self.attempts = np.zeros(len(q_hashes), dtype=np.float32)
+        self.correct = np.zeros(len(q_hashes), dtype=np.float32)
+        self.min_attempts = min_attempts
+        self.mastered = mastered
+
+    def observe(self, q_hash: str, attempts: int, correct: int):
+        row = self.rows.get(q_hash)
+        if row is not None:
+            self.attempts[row] += attempts
+            self.correct[row] += correct
+
+    def observe_answers(self, question: str, answer, texts):
+        q_hash = hashlib.md5(question.encode()).hexdigest()
+        extracted = [stage1_rewards.extract_xml_answer(t) for t in texts]
+        self.observe(q_hash, len(extracted), sum(answers_match(e, answer) for e in extracted))
+
+    def observe_completions(self, prompts, completions, answer):
+        # A stage 1 reward batch; may hold groups for several questions.
+        groups = {}
+        for p, c, a in zip(prompts, completions, answer):
+            groups.setdefault((p[-1]["content"], a), []).append(c[0]["content"])
+        for (question, a), texts in groups.items():
+            self.observe_answers(question, a, texts)
+
+    def observe_merged(self, merged: list[dict]):
+        # Merged stage 1 outputs: every peer's best answer per question.
+        for m in merged:
+            if m.get("question") and m.get("agent_answers"):
+                self.observe_answers(
+                    m["question"], m["answer"], m["agent_answers"].values()
+                )
+
+    def weights(self, indices: np.ndarray) -> np.ndarray:
+        # Success rate with a uniform prior; unseen questions sit at p=0.5.
+        attempts, correct = self.attempts[indices], self.correct[indices]
+        p = (correct + 1) / (attempts + 2)
+        weights = p * (1 - p)
+        mastered = (attempts >= self.min_attempts) & (
+            correct >= self.mastered * attempts
+        )
+        weights[mastered] = 0
+        return weights
+
+    def sample(self, indices: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        Resamples `indices` (same count, with replacement) by learning-zone
+        weight. Falls back to `indices` if everything is mastered.
+        """
+        weights = self.weights(indices)
+        total = weights.sum()
+        if not len(indices) or total <= 0:
+            return indices
+        return np.sort(rng.choice(indices, size=len(indices), p=weights / total))
@@ -1,21 +1,42 @@
 import os
-import random
-import re
 
 import numpy as np
 
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.answer_normalizer import answers_match
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+from hivemind_exp.gsm8k.format_validators import FormatGrammar
+from hivemind_exp.gsm8k.prompt_analysis import PromptAnalysis, analyze_prompt
+from hivemind_exp.gsm8k.reward_engine import RewardBatch, RewardEngine, indicator
+from hivemind_exp.gsm8k.reward_pool import RewardPool
+from hivemind_exp.gsm8k.sample_logger import SAMPLE_LOGGER
 from hivemind_exp.hivemind_utils import HivemindNode
 
+# Completion format; checked by linear scans, with equivalent regexes.
+FORMAT = FormatGrammar(("compare", "explain", "identify"))
+STRICT_FORMAT_PATTERN = FORMAT.strict_pattern
+SOFT_FORMAT_PATTERN = FORMAT.soft_pattern
+
+# Choices that claim no student answered correctly.
+NO_CORRECT_ANSWER_CHOICES = (
+    "None",
+    "No one",
+    "All answers are wrong",
+    "All answers were wrong",
+    "All are wrong",
+    "All were wrong",
+    "None are correct",
+    "None were correct",
+    "No one is correct",
+)
+
 
 def extract_xml_identity(text: str) -> str:
     if text is None:
         return ""
     if not isinstance(text, str):
         return ""
-    id = text.split("<identify>")[-1]
-    id = id.split("</identify>")[0]
-    return id.strip()
+    return parse_completion(text).tag_content("identify")
 
 
 def extract_xml_ids(text: str) -> list:
@@ -23,11 +44,7 @@ def extract_xml_ids(text: str) -> list:
         return []
     if not isinstance(text, str):
         return []
-    ids = []
-    ids_raw = text.split("<student>")[1:]
-    for id in ids_raw:
-        ids += [id.split("</student>")[0].strip()]
-    return ids
+    return parse_completion(text).tag_contents("student")
 
 
 def extract_original_question(text: str) -> str:
@@ -58,26 +75,37 @@ def extract_answers(text: str) -> dict:
     return answers
 
 
+def prompt_analysis(text: str) -> PromptAnalysis:
+    # Student IDs, answers and question of a stage 2 prompt, parsed once.
+    return analyze_prompt(
+        text,
+        extract_ids=extract_xml_ids,
+        extract_answers=extract_answers,
+        extract_question=extract_original_question,
+    )
+
+
 def count_xml(text) -> float:
     if text is None:
         return 0.0
     if not isinstance(text, str):
         return 0.0
+    view = parse_completion(text)
     count = 0.0
-    if text.count("<compare>\n") == 1:
+    if view.count("<compare>\n") == 1:
         count += 0.125
-    if text.count("\n</compare>\n") == 1:
+    if view.count("\n</compare>\n") == 1:
         count += 0.125
-    if text.count("<explain>\n") == 1:
+    if view.count("<explain>\n") == 1:
         count += 0.125
-    if text.count("\n</explain>\n") == 1:
+    if view.count("\n</explain>\n") == 1:
         count += 0.125
-    if text.count("\n<identify>\n") == 1:
+    if view.count("\n<identify>\n") == 1:
         count += 0.125
-        count -= len(text.split("\n</identify>\n")[-1]) * 0.001
-    if text.count("\n</identify>") == 1:
+        count -= view.tail_len("\n</identify>\n") * 0.001
+    if view.count("\n</identify>") == 1:
         count += 0.125
-        count -= (len(text.split("\n</identify>")[-1]) - 1) * 0.001
+        count -= (view.tail_len("\n</identify>") - 1) * 0.001
     return count
 
 
@@ -94,25 +122,17 @@ def proper_id_reward_func(
     try:
         responses = [completion[0]["content"] for completion in completions]
         p = prompts[0][-1]["content"]
-        agent_ids = extract_xml_ids(p)
+        agent_ids = prompt_analysis(p).ids
         extracted_responses = [extract_xml_identity(r) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "id_extact_samps.txt",
+            f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nValid IDs:\n{agent_ids}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in agent_ids}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nValid IDs:\n{agent_ids}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in agent_ids}"
-            f.write(out_line)
     return [1.0 * weighting if r in agent_ids else 0.0 for r in extracted_responses]
 
 
@@ -128,7 +148,7 @@ def correctness_reward_func(
     try:
         responses = [completion[0]["content"] for completion in completions]
         p = prompts[0][-1]["content"]
-        agent_answers = extract_answers(p)
+        agent_answers = prompt_analysis(p).answers
         extracted_responses = [extract_xml_identity(r) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
@@ -137,53 +157,36 @@ def correctness_reward_func(
     for r in extracted_responses:
         cur_reward = 0
         if r in agent_answers:
-            if stage1_rewards.extract_xml_answer(agent_answers[r]) == answer[0]:
+            if answers_match(
+                stage1_rewards.extract_xml_answer(agent_answers[r]), answer[0]
+            ):
                 cur_reward += 1.0
             if stage1_rewards.extract_xml_answer(agent_answers[r]).isdigit():
                 cur_reward += 0.5
-            pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-            if re.match(pattern, agent_answers[r]):
+            view = parse_completion(agent_answers[r])
+            if view.check(stage1_rewards.FORMAT.strict):
                 cur_reward += 0.5
-            pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-            if re.match(pattern, agent_answers[r]):
+            if view.check(stage1_rewards.FORMAT.soft):
                 cur_reward += 0.5
             cur_reward += stage1_rewards.count_xml(agent_answers[r])
-        elif r in [
-            "None",
-            "No one",
-            "All answers are wrong",
-            "All answers were wrong",
-            "All are wrong",
-            "All were wrong",
-            "None are correct",
-            "None were correct",
-            "No one is correct",
-        ]:
+        elif r in NO_CORRECT_ANSWER_CHOICES:
             agent_as = [
                 stage1_rewards.extract_xml_answer(agent_answers[id])
                 for id in agent_answers
             ]
             check_submissions = [
-                True if r == a else False for r, a in zip(agent_as, answer)
+                answers_match(r, a) for r, a in zip(agent_as, answer)
             ]
             if all(check_submissions):
                 cur_reward += 10
         chosen_rewards += [cur_reward]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
+    if logging and SAMPLE_LOGGER.should_log():
         if extracted_responses[0] in agent_answers:
-            os.makedirs(
-                f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                exist_ok=True,
-            )
-            log_file = os.path.join(
-                "model_output_samples",
+            SAMPLE_LOGGER.log(
                 f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
                 "correctness_samps.txt",
+                f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}",
             )
-            with open(log_file, "a") as f:
-                f.write("-" * 20)
-                out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}"
-                f.write(out_line)
     return [r * weighting for r in chosen_rewards]
 
 
@@ -195,28 +198,18 @@ def strict_format_reward_func(
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = r"^<compare>\n.*?\n</compare>\n<explain>\n.*?\n</explain>\n<identify>\n.*?\n</identify>\n$"
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.strict) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "s2_strict_format_samps.txt",
+            f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
@@ -228,30 +221,18 @@ def soft_format_reward_func(
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = (
-        r"<compare>.*?</compare>\s*<explain>.*?</explain>\s*<identify>.*?</identify>"
-    )
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.soft) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "s2_soft_format_samps.txt",
+            f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
@@ -267,55 +248,157 @@ def xmlcount_reward_func(
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "strict_format_samps.txt",
+            f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = (
-                f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}"
-            )
-            f.write(out_line)
     return [count_xml(c) * weighting for c in contents]
 
 
-def top_k_cumulative_reward(
-    prompts,
-    completions,
-    answer,
-    logging=False,
-    **kwargs,
-) -> list[float]:
+# Summation order of the cumulative rewards.
+CUMULATIVE_REWARD_FUNCS = (
+    proper_id_reward_func,
+    correctness_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+# Rewards where completion i's value depends only on completions[i], answer[i]
+# and prompts[0], so they can be evaluated in chunks (see RewardPool).
+# correctness_reward_func compares agent answers against the whole `answer` list.
+ELEMENTWISE_REWARD_FUNCS = (
+    proper_id_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+# Array versions of the ID and format rewards, for RewardEngine. Like the
+# list functions, they log the batch's first completion unless called with
+# logging=False. The correctness reward compares agent answers against the
+# whole `answer` list and stays list-based, behind its guard.
+def _log_sample(batch: RewardBatch, filename: str, text: str):
+    if batch.logging is not False and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
+            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}", filename, text
+        )
+
+
+def batch_proper_id_reward(batch: RewardBatch, weighting=2.0) -> np.ndarray:
+    agent_ids = prompt_analysis(batch.prompt).ids
+    valid = batch.is_in("identify", agent_ids)
+    _log_sample(
+        batch,
+        "id_extact_samps.txt",
+        f"\nPrompt:\n{batch.prompt}\n\nResponse:\n{batch.texts[0]}\n\nValid IDs:\n{agent_ids}\n\nExtracted:\n{batch.contents('identify')[0]}\n\nGot reward? {valid[0]}",
+    )
+    return indicator(valid, weighting)
+
+
+def batch_strict_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    matches = batch.checks(FORMAT.strict)
+    _log_sample(
+        batch,
+        "s2_strict_format_samps.txt",
+        f"\nResponse:\n{batch.texts[0]}\n\nMatches? {matches[0]}",
+    )
+    return indicator(matches, weighting)
+
+
+def batch_soft_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    matches = batch.checks(FORMAT.soft)
+    _log_sample(
+        batch,
+        "s2_soft_format_samps.txt",
+        f"\nResponse:\n{batch.texts[0]}\n\nMatches? {matches[0]}",
+    )
+    return indicator(matches, weighting)
+
+
+def batch_xmlcount_reward(batch: RewardBatch, weighting=1.0) -> np.ndarray:
+    counts = batch.xml_counts(FORMAT.tags)
+    _log_sample(
+        batch,
+        "strict_format_samps.txt",
+        f"\nResponse:\n{batch.texts[0]}\n\nCount reward: {counts[0]}",
+    )
+    return (counts * weighting).astype(np.float32)
+
+
+BATCH_REWARD_FUNCS = {
+    proper_id_reward_func: batch_proper_id_reward,
+    strict_format_reward_func: batch_strict_format_reward,
+    soft_format_reward_func: batch_soft_format_reward,
+    xmlcount_reward_func: batch_xmlcount_reward,
+}
+
+
+# Completions the correctness reward can score nonzero, for RewardEngine: an
+# identify choice that names one of the prompt's students (or no one).
+# Malformed completions are ruled out without running the reward.
+def correctness_guard(batch: RewardBatch) -> np.ndarray:
+    answers = prompt_analysis(batch.prompt).answers
+    return batch.is_in("identify", answers, NO_CORRECT_ANSWER_CHOICES)
+
+
+REWARD_GUARDS = {
+    correctness_reward_func: correctness_guard,
+}
+
+
+# Every stage 2 reward, in the order TRL logs them.
+REWARD_FUNCS = (
+    proper_id_reward_func,
+    correctness_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+def reward_engine(pool: RewardPool | None = None) -> RewardEngine:
+    # The one place stage 2 rewards are combined; training, top-k selection
+    # and the functions below all sum them through it.
+    return RewardEngine(
+        REWARD_FUNCS,
+        CUMULATIVE_REWARD_FUNCS,
+        BATCH_REWARD_FUNCS,
+        pool=pool,
+        pooled_funcs=ELEMENTWISE_REWARD_FUNCS,
+        guards=REWARD_GUARDS,
+    )
+
+
+def cumulative_reward(prompts, completions, answer, logging=False) -> list[float]:
     """
-    Dummy reward function that accumulates all rewards into one for prompt generation's top_k selector
+    Sums all stage 2 rewards per completion without touching any node state.
     """
-    proper_id_reward = proper_id_reward_func(
-        prompts, completions, answer, logging=logging
+    return (
+        reward_engine()
+        .total(prompts=prompts, completions=completions, answer=answer, logging=logging)
+        .tolist()
     )
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
+
+
+def hivemind_outputs(node, prompts, completions, answer, total_reward) -> dict:
+    """
+    Output saved to node.outputs: the batch's best completion.
+    """
+    maximal_reward_idx, responses = (
+        np.argmax(total_reward),
+        [completion[0]["content"] for completion in completions],
     )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            proper_id_reward,
-            correctness_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-    return total_reward
+    return {
+        "question": prompt_analysis(prompts[0][-1]["content"]).question,
+        "answer": answer[0],
+        "stage2_prompt": prompts[0][-1]["content"],
+        "agent_opinion": {node.key: responses[maximal_reward_idx]},
+    }
 
 
 def hivemind_cumulative_reward(
@@ -324,57 +407,11 @@ def hivemind_cumulative_reward(
     completions,
     answer,
     logging=False,
-    output_signal_selector="max",
     **kwargs,
 ) -> list[float]:
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    # Validate inputs
-    if node is None:
-        return [0.0]
-    if prompts is None or not prompts or not isinstance(prompts, list):
-        return [0.0]
-    if completions is None or not completions or not isinstance(completions, list):
-        return [0.0]
-
-    # Calculate individual rewards
-    proper_id_reward = proper_id_reward_func(
-        prompts, completions, answer, logging=logging
+    return reward_engine().hivemind_cumulative_reward(
+        node, hivemind_outputs, prompts, completions, answer, logging=logging
     )
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            proper_id_reward,
-            correctness_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-
-    question = extract_original_question(prompts[0][-1]["content"])
-    if output_signal_selector == "max":
-        # Generate output line
-        maximal_reward_idx, responses = (
-            np.argmax(total_reward),
-            [completion[0]["content"] for completion in completions],
-        )
-        output_data = {
-            "question": question,
-            "answer": answer[0],
-            "stage2_prompt": prompts[0][-1]["content"],
-            "agent_opinion": {node.key: responses[maximal_reward_idx]},
-        }
-
-    if output_signal_selector != None:
-        node.outputs = output_data
-        node.rewards = total_reward
-
-    return [0.0 for _ in total_reward]
@@ -1,22 +1,48 @@
 import os
-import random
-import re
-from difflib import SequenceMatcher
+from collections import Counter
 
 import numpy as np
 
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.answer_normalizer import answers_match
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+from hivemind_exp.gsm8k.format_validators import FormatGrammar
+from hivemind_exp.gsm8k.prompt_analysis import PromptAnalysis, analyze_prompt
+from hivemind_exp.gsm8k.reward_engine import RewardBatch, RewardEngine, indicator
+from hivemind_exp.gsm8k.reward_pool import RewardPool
+from hivemind_exp.gsm8k.sample_logger import SAMPLE_LOGGER
 from hivemind_exp.hivemind_utils import HivemindNode
 
+# Completion format; checked by linear scans, with equivalent regexes.
+FORMAT = FormatGrammar(
+    ("summarize_feedback", "majority", "question", "think", "answer")
+)
+STRICT_FORMAT_PATTERN = FORMAT.strict_pattern
+SOFT_FORMAT_PATTERN = FORMAT.soft_pattern
+
+# Choices that claim no student answered correctly.
+NO_CORRECT_ANSWER_CHOICES = (
+    "None",
+    "No one",
+    "All answers are wrong",
+    "All answers were wrong",
+    "All are wrong",
+    "All were wrong",
+    "None are correct",
+    "None were correct",
+    "No one is correct",
+)
+
+# Characters of each text that question_similarity looks at.
+MAX_SIMILARITY_CHARS = 4096
+
 
 def extract_xml_identity(text: str) -> str:
     if text is None:
         return ""
     if not isinstance(text, str):
         return ""
-    id = text.split("<majority>")[-1]
-    id = id.split("</majority>")[0]
-    return id.strip()
+    return parse_completion(text).tag_content("majority")
 
 
 def extract_xml_final_answer(text: str) -> str:
@@ -24,9 +50,7 @@ def extract_xml_final_answer(text: str) -> str:
         return ""
     if not isinstance(text, str):
         return ""
-    answer = text.split("<answer>")[-1]
-    answer = answer.split("</answer>")[0]
-    return answer.strip()
+    return parse_completion(text).tag_content("answer")
 
 
 def extract_xml_question(text: str) -> str:
@@ -34,9 +58,7 @@ def extract_xml_question(text: str) -> str:
         return ""
     if not isinstance(text, str):
         return ""
-    question = text.split("<question>")[-1]
-    question = question.split("</question>")[0]
-    return question.strip()
+    return parse_completion(text).tag_content("question")
 
 
 def extract_xml_ids(text: str) -> list:
@@ -44,11 +66,7 @@ def extract_xml_ids(text: str) -> list:
         return []
     if not isinstance(text, str):
         return []
-    ids = []
-    ids_raw = text.split("<student>")[1:]
-    for id in ids_raw:
-        ids += [id.split("</student>")[0].strip()]
-    return ids
+    return parse_completion(text).tag_contents("student")
 
 
 # TODO: Rethink how we add this reward in general setting with delayed rewards. Agents might learn to reward hack by "spamming" identify tags of their choice...
@@ -57,11 +75,7 @@ def extract_xml_choices(text: str) -> list:
         return []
     if not isinstance(text, str):
         return []
-    ids = []
-    ids_raw = text.split("<identify>")[1:]
-    for id in ids_raw:
-        ids += [id.split("</identify>")[0].strip()]
-    return ids
+    return parse_completion(text).tag_contents("identify")
 
 
 def extract_original_question(text: str) -> str:
@@ -103,32 +117,55 @@ def count_xml(text) -> float:
     if not isinstance(text, str):
         return 0.0
 
+    view = parse_completion(text)
     count = 0.0
-    if text.count("<summarize_feedback>\n") == 1:
+    if view.count("<summarize_feedback>\n") == 1:
         count += 0.125
-    if text.count("\n</summarize_feedback>\n") == 1:
+    if view.count("\n</summarize_feedback>\n") == 1:
         count += 0.125
-    if text.count("<majority>\n") == 1:
+    if view.count("<majority>\n") == 1:
         count += 0.125
-    if text.count("\n</majority>\n") == 1:
+    if view.count("\n</majority>\n") == 1:
         count += 0.125
-    if text.count("<question>\n") == 1:
+    if view.count("<question>\n") == 1:
         count += 0.125
-    if text.count("\n</question>\n") == 1:
+    if view.count("\n</question>\n") == 1:
         count += 0.125
-    if text.count("<think>\n") == 1:
+    if view.count("<think>\n") == 1:
         count += 0.125
-    if text.count("\n</think>\n") == 1:
+    if view.count("\n</think>\n") == 1:
         count += 0.125
-    if text.count("\n<answer>\n") == 1:
+    if view.count("\n<answer>\n") == 1:
         count += 0.125
-        count -= len(text.split("\n</answer>\n")[-1]) * 0.001
-    if text.count("\n</answer>") == 1:
+        count -= view.tail_len("\n</answer>\n") * 0.001
+    if view.count("\n</answer>") == 1:
         count += 0.125
-        count -= (len(text.split("\n</answer>")[-1]) - 1) * 0.001
+        count -= (view.tail_len("\n</answer>") - 1) * 0.001
     return count
 
 
+def char_ngrams(text: str, n: int) -> Counter:
+    capped = text[:MAX_SIMILARITY_CHARS]
+    return Counter(capped[i : i + n] for i in range(len(capped) - n + 1))
+
+
+def question_similarity(a: str, b: str, n: int = 3) -> float:
+    """
+    Dice coefficient of the character n-gram multisets of `a` and `b`: a
+    linear-time stand-in for difflib's SequenceMatcher.ratio(), which it
+    tracks closely (see hivemind_exp/benchmarks/similarity_benchmark.py).
+    Only the first MAX_SIMILARITY_CHARS characters are compared, but the
+    full lengths count, so padding a text only lowers its score.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    n = min(n, len(a), len(b))
+    common = sum((char_ngrams(a, n) & char_ngrams(b, n)).values())
+    return 2 * common / (len(a) + len(b) - 2 * (n - 1))
+
+
 def swarm_majority(choices):
     if choices is None:
         return []
@@ -154,6 +191,17 @@ def swarm_majority(choices):
     return majority
 
 
+def prompt_analysis(text: str) -> PromptAnalysis:
+    # Student answers, critic choices and question of a stage 3 prompt, parsed once.
+    return analyze_prompt(
+        text,
+        extract_answers=extract_answers,
+        extract_choices=extract_xml_choices,
+        majority=swarm_majority,
+        extract_question=extract_original_question,
+    )
+
+
 # Reward functions
 def consensus_reward_func(
     prompts, completions, weighting=2.0, logging=False, **kwargs
@@ -167,26 +215,18 @@ def consensus_reward_func(
     try:
         responses = [completion[0]["content"] for completion in completions]
         p = prompts[0][-1]["content"]
-        critic_choices = extract_xml_choices(p)
-        majority_choices = swarm_majority(critic_choices)
+        analysis = prompt_analysis(p)
+        critic_choices, majority_choices = analysis.choices, analysis.majority
         extracted_responses = [extract_xml_identity(r) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "consensus_samps.txt",
+            f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nCritic Choice Distribution:\n{critic_choices}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in majority_choices}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nCritic Choice Distribution:\n{critic_choices}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in majority_choices}"
-            f.write(out_line)
     return [
         1.0 * weighting if r in majority_choices else 0.0 for r in extracted_responses
     ]
@@ -204,26 +244,19 @@ def question_recreation_reward_func(
     try:
         responses = [completion[0]["content"] for completion in completions]
         p = prompts[0][-1]["content"]
-        q = extract_original_question(p)
+        q = prompt_analysis(p).question
         recreated_qs = [extract_xml_question(r) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    similarities = [question_similarity(r, q) for r in recreated_qs]
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "question_recreation_samps.txt",
+            f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nOriginal Question:\n{q}\n\nExtracted recreation:\n{recreated_qs[0]}\n\nGot reward? {similarities[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nOriginal Question:\n{q}\n\nExtracted recreation:\n{recreated_qs[0]}\n\nGot reward? {SequenceMatcher(None, recreated_qs[0], q).ratio()}"
-            f.write(out_line)
-    return [SequenceMatcher(None, r, q).ratio() * weighting for r in recreated_qs]
+    return [sim * weighting for sim in similarities]
 
 
 def concensus_correctness_reward_func(
@@ -238,7 +271,7 @@ def concensus_correctness_reward_func(
     try:
         responses = [completion[0]["content"] for completion in completions]
         p = prompts[0][-1]["content"]
-        agent_answers = extract_answers(p)
+        agent_answers = prompt_analysis(p).answers
         extracted_responses = [extract_xml_identity(r) for r in responses]
         chosen_rewards = []
 
@@ -252,32 +285,19 @@ def concensus_correctness_reward_func(
         cur_reward = 0
         if r in agent_answers:
             # Compare only when there is a correct answer
-            if (
-                correct_answer is not None
-                and stage1_rewards.extract_xml_answer(agent_answers[r])
-                == correct_answer
+            if correct_answer is not None and answers_match(
+                stage1_rewards.extract_xml_answer(agent_answers[r]), correct_answer
             ):
                 cur_reward += 1.0
             if stage1_rewards.extract_xml_answer(agent_answers[r]).isdigit():
                 cur_reward += 0.5
-            pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-            if re.match(pattern, agent_answers[r]):
+            view = parse_completion(agent_answers[r])
+            if view.check(stage1_rewards.FORMAT.strict):
                 cur_reward += 0.5
-            pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-            if re.match(pattern, agent_answers[r]):
+            if view.check(stage1_rewards.FORMAT.soft):
                 cur_reward += 0.5
             cur_reward += stage1_rewards.count_xml(agent_answers[r])
-        elif r in [
-            "None",
-            "No one",
-            "All answers are wrong",
-            "All answers were wrong",
-            "All are wrong",
-            "All were wrong",
-            "None are correct",
-            "None were correct",
-            "No one is correct",
-        ]:
+        elif r in NO_CORRECT_ANSWER_CHOICES:
             agent_as = [
                 stage1_rewards.extract_xml_answer(agent_answers[id])
                 for id in agent_answers
@@ -285,26 +305,18 @@ def concensus_correctness_reward_func(
             # Only perform this check when the answer is valid
             if correct_answer is not None:
                 check_submissions = [
-                    True if r == a else False for r, a in zip(agent_as, answer)
+                    answers_match(r, a) for r, a in zip(agent_as, answer)
                 ]
                 if all(check_submissions):
                     cur_reward += 10
         chosen_rewards += [cur_reward]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
+    if logging and SAMPLE_LOGGER.should_log():
         if extracted_responses[0] in agent_answers:
-            os.makedirs(
-                f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                exist_ok=True,
-            )
-            log_file = os.path.join(
-                "model_output_samples",
+            SAMPLE_LOGGER.log(
                 f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
                 "correctness_samps.txt",
+                f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}",
             )
-            with open(log_file, "a") as f:
-                f.write("-" * 20)
-                out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}"
-                f.write(out_line)
     return [r * weighting for r in chosen_rewards]
 
 
@@ -329,22 +341,15 @@ def final_correctness_reward_func(
     # If answer is None, we don't have a correct answer to compare to
     if answer is None:
         return [0.0] * len(extracted_responses)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "final_answer_correctness_samples.txt",
+            f"Prompt:\n{p}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"Prompt:\n{p}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
-            f.write(out_line)
     return [
-        1.0 * weighting if r == a else 0.0 for r, a in zip(extracted_responses, answer)
+        1.0 * weighting if answers_match(r, a) else 0.0
+        for r, a in zip(extracted_responses, answer)
     ]
 
 
@@ -356,28 +361,18 @@ def strict_format_reward_func(
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = r"^<summarize_feedback>\n.*?\n</summarize_feedback>\n<majority>\n.*?\n</majority>\n<question>\n.*?\n</question>\n<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.strict) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "s3_strict_format_samps.txt",
+            f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
@@ -389,28 +384,18 @@ def soft_format_reward_func(
     if completions is None or not completions or not isinstance(completions, list):
         return [0.0]
 
-    pattern = r"<summarize_feedback>.*?</summarize_feedback>\s*<majority>.*?</majority>\s*<question>.*?</question>\s*<think>.*?</think>\s*<answer>.*?</answer>"
-
     try:
         responses = [completion[0]["content"] for completion in completions]
-        matches = [re.match(pattern, r) for r in responses]
+        matches = [parse_completion(r).check(FORMAT.soft) for r in responses]
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "s3_soft_format_samps.txt",
+            f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
@@ -426,90 +411,152 @@ def xmlcount_reward_func(
     except (IndexError, KeyError, TypeError):
         # Return default rewards if we can't extract the necessary data
         return [0.0] * len(completions)
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
+    if logging and SAMPLE_LOGGER.should_log():
+        SAMPLE_LOGGER.log(
             f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
             "count_xml_samps.txt",
+            f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}",
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = (
-                f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}"
-            )
-            f.write(out_line)
     return [count_xml(c) * weighting for c in contents]
 
 
+# Summation order of the cumulative rewards.
+CUMULATIVE_REWARD_FUNCS = (
+    consensus_reward_func,
+    concensus_correctness_reward_func,
+    question_recreation_reward_func,
+    final_correctness_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+# Rewards where completion i's value depends only on completions[i], answer[i]
+# and prompts[0], so they can be evaluated in chunks (see RewardPool).
+# concensus_correctness_reward_func compares agent answers against the whole
+# `answer` list.
+ELEMENTWISE_REWARD_FUNCS = (
+    consensus_reward_func,
+    question_recreation_reward_func,
+    final_correctness_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+# Array versions of the answer and format rewards, for RewardEngine. The
+# consensus and question rewards depend on the prompt and stay list-based.
+def batch_final_correctness_reward(batch: RewardBatch, weighting=2.0) -> np.ndarray:
+    return indicator(batch.normalized("answer") == batch.normalized_answer, weighting)
+
+
+def batch_strict_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    return indicator(batch.checks(FORMAT.strict), weighting)
+
+
+def batch_soft_format_reward(batch: RewardBatch, weighting=0.5) -> np.ndarray:
+    return indicator(batch.checks(FORMAT.soft), weighting)
+
+
+def batch_xmlcount_reward(batch: RewardBatch, weighting=1.0) -> np.ndarray:
+    return (batch.xml_counts(FORMAT.tags) * weighting).astype(np.float32)
+
+
+BATCH_REWARD_FUNCS = {
+    final_correctness_reward_func: batch_final_correctness_reward,
+    strict_format_reward_func: batch_strict_format_reward,
+    soft_format_reward_func: batch_soft_format_reward,
+    xmlcount_reward_func: batch_xmlcount_reward,
+}
+
+
+# Completions these rewards can score nonzero, for RewardEngine: a majority
+# choice that names one of the prompt's students (or no one). Malformed
+# completions are ruled out without running the reward. The question
+# reward has no guard: without a <question> block, the whole completion is
+# compared to the question.
+def consensus_guard(batch: RewardBatch) -> np.ndarray:
+    return batch.is_in("majority", prompt_analysis(batch.prompt).majority)
+
+
+def concensus_correctness_guard(batch: RewardBatch) -> np.ndarray:
+    answers = prompt_analysis(batch.prompt).answers
+    return batch.is_in("majority", answers, NO_CORRECT_ANSWER_CHOICES)
+
+
+REWARD_GUARDS = {
+    consensus_reward_func: consensus_guard,
+    concensus_correctness_reward_func: concensus_correctness_guard,
+}
+
+
+# Every stage 3 reward, in the order TRL logs them.
+REWARD_FUNCS = (
+    consensus_reward_func,
+    concensus_correctness_reward_func,
+    question_recreation_reward_func,
+    final_correctness_reward_func,
+    strict_format_reward_func,
+    soft_format_reward_func,
+    xmlcount_reward_func,
+)
+
+
+def reward_engine(pool: RewardPool | None = None) -> RewardEngine:
+    # The one place stage 3 rewards are combined; training, round winners
+    # and the functions below all sum them through it.
+    return RewardEngine(
+        REWARD_FUNCS,
+        CUMULATIVE_REWARD_FUNCS,
+        BATCH_REWARD_FUNCS,
+        pool=pool,
+        pooled_funcs=ELEMENTWISE_REWARD_FUNCS,
+        guards=REWARD_GUARDS,
+    )
+
+
+def cumulative_reward(prompts, completions, answer, logging=False) -> list[float]:
+    """
+    Sums all stage 3 rewards per completion without touching any node state.
+    """
+    return (
+        reward_engine()
+        .total(prompts=prompts, completions=completions, answer=answer, logging=logging)
+        .tolist()
+    )
+
+
+def hivemind_outputs(node, prompts, completions, answer, total_reward) -> dict:
+    """
+    Output saved to node.outputs: the batch's best completion.
+    """
+    prompt = prompts[0][-1]["content"]
+    maximal_reward_idx, responses = (
+        np.argmax(total_reward),
+        [completion[0]["content"] for completion in completions],
+    )
+    return {
+        "question": prompt_analysis(prompt).question,
+        # Safely obtain answers, use default values if answer is empty or None
+        "answer": answer[0] if answer and len(answer) > 0 else "Unknown",
+        "stage3_prompt": prompt,
+        "final_agent_decision": {node.key: responses[maximal_reward_idx]},
+    }
+
+
 def hivemind_cumulative_reward(
     node: HivemindNode,
     prompts,
     completions,
     answer,
     logging=False,
-    output_signal_selector="max",
     **kwargs,
 ) -> list[float]:
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    # Validate inputs
-    if node is None:
-        return [0.0]
-    if prompts is None or not prompts or not isinstance(prompts, list):
-        return [0.0]
-    if completions is None or not completions or not isinstance(completions, list):
-        return [0.0]
-
-    # Calculate individual rewards
-    consensus_reward = consensus_reward_func(prompts, completions, logging=logging)
-    concensus_correctness = concensus_correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    question_recreation_reward = question_recreation_reward_func(
-        prompts, completions, logging=logging
+    return reward_engine().hivemind_cumulative_reward(
+        node, hivemind_outputs, prompts, completions, answer, logging=logging
     )
-    final_correctness = final_correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            consensus_reward,
-            concensus_correctness,
-            question_recreation_reward,
-            final_correctness,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-
-    prompt = prompts[0][-1]["content"]
-    question = extract_original_question(prompt)
-    if output_signal_selector == "max":
-        # Generate output line
-        maximal_reward_idx, responses = (
-            np.argmax(total_reward),
-            [completion[0]["content"] for completion in completions],
-        )
-        output_data = {
-            "question": question,
-            # Safely obtain answers, use default values if answer is empty or None
-            "answer": answer[0] if answer and len(answer) > 0 else "Unknown",
-            "stage3_prompt": prompt,
-            "final_agent_decision": {node.key: responses[maximal_reward_idx]},
-        }
-
-    if output_signal_selector != None:
-        node.outputs = output_data
-        node.rewards = total_reward
-
-    return [0.0 for _ in total_reward]
@@ -2,6 +2,9 @@ import logging
 import time
 from collections import defaultdict
 
+from datasets import Dataset
+
+from hivemind_exp.dataset_cache import MergedDatasetCache, keyed_items_digest
 from hivemind_exp.dht_utils import (
     DHT,
     HivemindNode,
@@ -26,14 +29,15 @@ def merged_prev_stage_datasets(
     check_interval: float = 5,
     wait_timeout: float = 10,
     log_tag=None,
+    dataset_cache: MergedDatasetCache | None = None,
+    cache_config: str = "",
+    observe_fn=None,
 ):
     if not log_tag:
         log_tag = get_name_from_peer_id(node.key)
 
     logger = logging.getLogger(f"{__name__}:{log_tag}")
 
-    merged_qs = []
-
     # Retrieves and merges last stage samples locally and from DHT.
     def get_prev_rewards():
         return get_dht_value(dht, key=rewards_key(r, s - 1), beam_size=100)
@@ -82,16 +86,33 @@ def merged_prev_stage_datasets(
                     f"Found rewards published for node: {node_key} but no outputs!"
                 )
 
-    # Group samples by question hash.
-    q_to_keyed_items: dict[str, dict[str, Any]] = defaultdict(dict)
-    for node_key, items in prev_items.items():
-        for item in items:
-            q_hash, (_, outputs) = item
-            q_to_keyed_items[q_hash][node_key] = outputs
+    def merge_questions():
+        # Group samples by question hash.
+        q_to_keyed_items: dict[str, dict[str, Any]] = defaultdict(dict)
+        for node_key, items in prev_items.items():
+            for item in items:
+                q_hash, (_, outputs) = item
+                q_to_keyed_items[q_hash][node_key] = outputs
+
+        # Merge sample lists.
+        return [merge_fn(outputs) for outputs in q_to_keyed_items.values()]
+
+    # Reuse a previous merge of exactly the same outputs and settings, e.g. on
+    # retries.
+    digest = None
+    if dataset_cache:
+        digest = keyed_items_digest(node.key, prev_items, cache_config)
+        if cached := dataset_cache.load(r, s, digest):
+            logger.info(f"Loaded cached merged datasets for round {r} stage {s}")
+            if observe_fn:
+                observe_fn(merge_questions())
+            return cached
 
-    # Merge sample lists.
-    for outputs in q_to_keyed_items.values():
-        merged = merge_fn(outputs)
-        merged_qs.append(merged)
+    merged_qs = merge_questions()
+    if observe_fn:
+        observe_fn(merged_qs)
 
-    return samples_fn(merged_qs)
+    samples = samples_fn(merged_qs)
+    if digest and all(isinstance(d, Dataset) for d in samples):
+        dataset_cache.save(r, s, digest, *samples)  # type: ignore
+    return samples
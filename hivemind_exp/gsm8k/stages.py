@@ -1,16 +1,35 @@
+import hashlib
 import logging
 from collections import defaultdict
+from functools import partial
 from typing import Sequence
 
+import numpy as np
 
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
 import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
 import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.dataset_cache import MergedDatasetCache
 from hivemind_exp.dht_utils import (
     DHT,
     HivemindNode,
+    get_dht_value,
+    rewards_key,
+)
+from hivemind_exp.gsm8k.generate_prompts import (
+    PromptBudget,
+    get_stage2_samples,
+    get_stage3_samples,
+)
+from hivemind_exp.gsm8k.gold_answers import GoldAnswerIndex
+from hivemind_exp.gsm8k.reward_engine import RewardEngine
+from hivemind_exp.gsm8k.reward_pool import RewardPool
+from hivemind_exp.gsm8k.score_cache import SCORE_CACHE
+from hivemind_exp.gsm8k.stage1_sampling import (
+    CurriculumSampler,
+    question_hashes,
+    shard_indices,
 )
-from hivemind_exp.gsm8k.generate_prompts import get_stage2_samples, get_stage3_samples
 from hivemind_exp.gsm8k.stage_merger import (
     merge_stage1_question,
     merge_stage2_question,
@@ -18,6 +37,21 @@ from hivemind_exp.gsm8k.stage_merger import (
 from hivemind_exp.gsm8k.stage_utils import merged_prev_stage_datasets
 from hivemind_exp.hivemind_utils import SingleStageData, StageData
 
+
+def stage_reward_engines(
+    reward_pool: RewardPool | None = None,
+) -> tuple[RewardEngine, RewardEngine, RewardEngine]:
+    # Each stage's rewards are evaluated once per batch and shared with the
+    # cumulative reward. Guarded rewards skip completions that can't score.
+    # Only stage 3 gets the reward pool: its question recreation reward is the
+    # one elementwise reward without a batch version.
+    return (
+        stage1_rewards.reward_engine(),
+        stage2_rewards.reward_engine(),
+        stage3_rewards.reward_engine(reward_pool),
+    )
+
+
 def gsm8k_stage_data(
     dht: DHT,
     node: HivemindNode,
@@ -25,134 +59,189 @@ def gsm8k_stage_data(
     initial_test_dataset,
     check_interval: float = 5,
     log_tag=None,
+    dataset_cache: MergedDatasetCache | None = None,
+    num_proc: int | None = None,
+    prompt_budget: PromptBudget | None = None,
+    num_shards: int = 0,
+    shard_overlap: int = 2,
+    curriculum: bool = False,
+    reward_pool: RewardPool | None = None,
+    gold_answers: GoldAnswerIndex | None = None,
 ):
+    # Stage 1 sharding: each peer trains on its own deterministic slice of the
+    # questions per round (num_shards=0 trains everyone on everything).
+    train_q_hashes = []
+    if num_shards or curriculum:
+        train_q_hashes = question_hashes(initial_train_dataset)
+    sampler = CurriculumSampler(train_q_hashes) if curriculum else None
+
+    def round_peers(r) -> list[str]:
+        # Peers that published stage 1 rewards last round. All peers read the
+        # same list, so they can lay their shards out by rank.
+        if r <= 0:
+            return []
+        rewards = get_dht_value(dht, key=rewards_key(r - 1, 0), beam_size=100)
+        return list(rewards or ())
+
+    def stage1_datasets_fn(r, s):
+        if not (num_shards or sampler):
+            return initial_train_dataset, initial_test_dataset
+
+        indices = np.arange(len(train_q_hashes))
+        if num_shards:
+            sharded = shard_indices(
+                train_q_hashes,
+                node.key,
+                r,
+                num_shards,
+                shard_overlap,
+                round_peers(r),
+            )
+            if len(sharded):
+                indices = sharded
+        if sampler:
+            seed = int(hashlib.md5(f"{node.key}:{r}".encode()).hexdigest(), 16)
+            indices = sampler.sample(indices, np.random.default_rng(seed))
+        train = initial_train_dataset.select(indices, keep_in_memory=True)
+        return train, initial_test_dataset
+
     def cumulative_reward_0(**kwargs):
-        return stage1_rewards.hivemind_cumulative_reward(node, **kwargs)
+        if sampler:
+            sampler.observe_completions(
+                kwargs["prompts"], kwargs["completions"], kwargs["answer"]
+            )
+        return engine_0.hivemind_cumulative_reward(
+            node, stage1_rewards.hivemind_outputs, **kwargs
+        )
 
     def cumulative_reward_1(**kwargs):
-        return stage2_rewards.hivemind_cumulative_reward(node, **kwargs)
+        return engine_1.hivemind_cumulative_reward(
+            node, stage2_rewards.hivemind_outputs, **kwargs
+        )
 
     def cumulative_reward_2(**kwargs):
-        return stage3_rewards.hivemind_cumulative_reward(node, **kwargs)
+        return engine_2.hivemind_cumulative_reward(
+            node, stage3_rewards.hivemind_outputs, **kwargs
+        )
+
+    # Settings that shape merged datasets besides the outputs themselves, so
+    # cached merges built with other settings aren't reused.
+    budget_fingerprint = prompt_budget.fingerprint if prompt_budget else None
+    cache_config = f"{num_proc}:{budget_fingerprint}:{gold_answers is not None}"
 
     def stage2_datasets_fn(r, s):
+        SCORE_CACHE.start_round(r)
         return merged_prev_stage_datasets(
             dht,
             node,
             r,
             s,
-            merge_stage1_question,
-            get_stage2_samples,
+            partial(merge_stage1_question, gold_answers=gold_answers),
+            partial(get_stage2_samples, num_proc=num_proc, budget=prompt_budget),
             check_interval=check_interval,
             log_tag=log_tag,
+            dataset_cache=dataset_cache,
+            cache_config=cache_config,
+            # Also on cache hits, so the curriculum sees every round.
+            observe_fn=sampler.observe_merged if sampler else None,
         )
 
     def stage3_datasets_fn(r, s):
+        SCORE_CACHE.start_round(r)
         return merged_prev_stage_datasets(
             dht,
             node,
             r,
             s,
-            merge_stage2_question,
-            get_stage3_samples,
+            partial(merge_stage2_question, gold_answers=gold_answers),
+            partial(get_stage3_samples, num_proc=num_proc, budget=prompt_budget),
             check_interval=check_interval,
             log_tag=log_tag,
+            dataset_cache=dataset_cache,
+            cache_config=cache_config,
         )
 
+    # Final stage outputs for the current round, so repeated winner
+    # submissions don't sweep the DHT again.
+    final_outputs: dict[int, list] = {}
+
+    def fetch_final_stage_outputs(r):
+        if r not in final_outputs:
+            final_outputs.clear()
+            final_outputs[r], _ = merged_prev_stage_datasets(
+                dht,
+                node,
+                r,
+                3,
+                lambda x: x,
+                lambda v: (v, v),
+                check_interval=check_interval,
+                log_tag=log_tag,
+            )
+        return final_outputs[r]
+
     def round_winners(limit=10) -> Sequence[str]:
-        final_stage_outputs, _ = merged_prev_stage_datasets(
-            dht,
-            node,
-            node.round_num,
-            3,
-            lambda x: x,
-            lambda v: (v, v),
-            check_interval=check_interval,
-            log_tag=log_tag,
-        )
         logger = logging.getLogger(f"{__name__}:{log_tag}")
 
+        # Group valid outputs by prompt; stage 3 rewards are computed against a
+        # single prompt, so each group is scored with one batched call.
         rewards = defaultdict(float)
-        for outputs in final_stage_outputs:
+        groups = defaultdict(list)
+        for outputs in fetch_final_stage_outputs(node.round_num):
             for node_key, output in outputs.items():
-                question = output.get("question")
-                faulty_completion = False
-                if question is None:
-                    logger.warning(f"Missing 'question' key in output: {output}")
-                    output["question"] = "<no question available>"
-                    faulty_completion = True
-                stage3_prompt = output.get("stage3_prompt")
-                if stage3_prompt is None:
-                    logger.warning(f"Missing 'stage3_prompt' key in output: {output}")
-                    output["stage3_prompt"] = "<no stage3 prompt available>"
-                    faulty_completion = True
-                final_answer = output.get("final_agent_decision")
-                if final_answer is None:
-                    logger.warning(
-                        f"Missing 'final_agent_decision' key in output: {output}"
-                    )
-                    output["final_agent_decision"] = (
-                        "<no final agent decision available>"
-                    )
-                    faulty_completion = True
-                prompts = [
-                    [
-                        {"role": "system", "content": output["question"]},
-                        {"role": "system", "content": output["stage3_prompt"]},
-                    ],
+                rewards[node_key] += 0.0
+                missing = [
+                    k
+                    for k in ("question", "stage3_prompt", "final_agent_decision")
+                    if output.get(k) is None
                 ]
-                if faulty_completion:
-                    rewards[node_key] += 0.0
-                else:
-                    final_answer = next(iter(output["final_agent_decision"].items()))[1]
-                    completions = [[{"role": "assistant", "content": final_answer}]]
-                    cumulative_reward_2(
-                        prompts=prompts, completions=completions, **output
-                    )
-                    rewards[node_key] += sum(node.rewards)
+                if missing:
+                    logger.warning(f"Missing {missing} key(s) in output: {output}")
+                    continue
+
+                prompt, answer = output["stage3_prompt"], output.get("answer")
+                if answer is None and gold_answers:
+                    answer = gold_answers.get(output["question"])
+                completion = next(iter(output["final_agent_decision"].values()))
+                groups[(prompt, answer)].append((node_key, completion))
+
+        SCORE_CACHE.start_round(node.round_num)
+        for (prompt, answer), entries in groups.items():
+
+            def score_fn(batch):
+                return stage3_rewards.cumulative_reward(
+                    [[{"role": "system", "content": prompt}]] * len(batch),
+                    [[{"role": "assistant", "content": c}] for c in batch],
+                    [answer] * len(batch),
+                )
+
+            scores = SCORE_CACHE.get_scores(
+                "stage3", prompt, answer, [c for _, c in entries], score_fn
+            )
+            for (node_key, _), score in zip(entries, scores):
+                rewards[node_key] += score
 
         rewards = sorted(list(rewards.items()), key=lambda x: x[1], reverse=True)
         return [n for n, _ in rewards][:limit]
 
+    engine_0, engine_1, engine_2 = stage_reward_engines(reward_pool)
+
     return StageData(
         round_winner_fn=round_winners,
         stages=[
             SingleStageData(
                 name="0",
-                reward_funcs=[
-                    stage1_rewards.xmlcount_reward_func,
-                    stage1_rewards.soft_format_reward_func,
-                    stage1_rewards.strict_format_reward_func,
-                    stage1_rewards.int_reward_func,
-                    stage1_rewards.correctness_reward_func,
-                    cumulative_reward_0,
-                ],
-                datasets_fn=lambda r, s: (initial_train_dataset, initial_test_dataset),  # type: ignore
+                reward_funcs=[*map(engine_0.wrap, engine_0.funcs), cumulative_reward_0],
+                datasets_fn=stage1_datasets_fn,  # type: ignore
             ),
             SingleStageData(
                 name="1",
-                reward_funcs=[
-                    stage2_rewards.proper_id_reward_func,
-                    stage2_rewards.correctness_reward_func,
-                    stage2_rewards.strict_format_reward_func,
-                    stage2_rewards.soft_format_reward_func,
-                    stage2_rewards.xmlcount_reward_func,
-                    cumulative_reward_1,
-                ],
+                reward_funcs=[*map(engine_1.wrap, engine_1.funcs), cumulative_reward_1],
                 datasets_fn=stage2_datasets_fn,  # type: ignore
             ),
             SingleStageData(
                 name="2",
-                reward_funcs=[
-                    stage3_rewards.consensus_reward_func,
-                    stage3_rewards.concensus_correctness_reward_func,
-                    stage3_rewards.question_recreation_reward_func,
-                    stage3_rewards.final_correctness_reward_func,
-                    stage3_rewards.strict_format_reward_func,
-                    stage3_rewards.soft_format_reward_func,
-                    stage3_rewards.xmlcount_reward_func,
-                    cumulative_reward_2,
-                ],
+                reward_funcs=[*map(engine_2.wrap, engine_2.funcs), cumulative_reward_2],
                 datasets_fn=stage3_datasets_fn,  # type: ignore
             ),
         ],
@@ -1,4 +1,5 @@
 import logging
+from functools import partial
 
 # Needs to be before trl!
 from hivemind_exp.runner.grpo_runner import GRPOArguments, GRPORunner
@@ -50,7 +51,12 @@ def main():
     game = grpo_args.game
     match game:
         case "gsm8k":
-            runner.run(model_args, grpo_args, training_args, gsm8k_stage1_samples)
+            runner.run(
+                model_args,
+                grpo_args,
+                training_args,
+                partial(gsm8k_stage1_samples, cache_dir=grpo_args.cache_dir),
+            )
         case "dapo":
             runner.run(model_args, grpo_args, training_args, dapo_stage1_samples)
         case _:
@@ -26,6 +26,10 @@ from huggingface_hub import login
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from trl import GRPOConfig, ModelConfig
 
+from hivemind_exp.dataset_cache import DEFAULT_CACHE_DIR, MergedDatasetCache
+from hivemind_exp.gsm8k.generate_prompts import PromptBudget
+from hivemind_exp.gsm8k.gold_answers import GoldAnswerIndex
+from hivemind_exp.gsm8k.reward_pool import RewardPool
 from hivemind_exp.gsm8k.stages import gsm8k_stage_data
 from hivemind_exp.hivemind_utils import HivemindNode
 from hivemind_exp.name_utils import get_name_from_peer_id
@@ -56,6 +60,15 @@ class GRPOArguments:
     number_of_data_samples: int = 50000
     public_maddr: str | None = None
     game: str = "gsm8k"
+    cache_dir: str = DEFAULT_CACHE_DIR  # Local cache for stage datasets.
+    prompt_num_proc: int | None = None  # Workers for stage 2/3 prompt building.
+    prompt_budget: bool = False  # Fit stage 2/3 answers into max_prompt_length.
+    stage1_num_shards: int = 0  # Per-peer stage 1 question shards (0 disables).
+    stage1_shard_overlap: int = 2  # Shards each peer draws from per round.
+    stage1_curriculum: bool = False  # Sample stage 1 by observed difficulty.
+    reward_num_workers: int = 0  # Reward worker processes (0 evaluates in-process).
+    reward_chunk_size: int = 16  # Completions per reward worker task.
+    reward_timeout: float = 60.0  # Seconds per batch before evaluating in-process.
 
     # Hugging Face Hub arguments
     hf_token: str | None = None
@@ -213,24 +226,66 @@ class GRPORunner:
         else:
             node = HivemindNode.coordinator(model_name_or_path, str(dht.peer_id))
 
-        # TODO: Extract this and generalize.
-        stage_data = gsm8k_stage_data(dht, node, train_dataset, test_dataset)
-        stage_data.max_rounds = grpo_args.max_rounds
-
-        trainer = trainer_factory_fn(
-            dht=dht,
-            node=node,
-            model=model,
-            tokenizer=tokenizer,
-            config=training_args,
-            stage_data=stage_data,
-            log_tag=self.name,
-        )
+        # Optionally keep stage 2/3 prompts within what the trainer will accept
+        # untruncated, instead of a fixed top-k of answers.
+        prompt_budget = None
+        if grpo_args.prompt_budget and training_args.max_prompt_length:
+            prompt_budget = PromptBudget(tokenizer, training_args.max_prompt_length)
+
+        reward_pool = None
+        if grpo_args.reward_num_workers:
+            reward_pool = RewardPool(
+                grpo_args.reward_num_workers,
+                grpo_args.reward_chunk_size,
+                grpo_args.reward_timeout,
+            )
 
-        ###############
-        # Training loop
-        ###############
-        logger.info(
-            f"Starting training {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} for {training_args.num_train_epochs} epochs"
-        )
-        trainer.train()
+        try:
+            # Gold answers by question hash, for stage outputs that don't carry
+            # them. Only datasets of questions and answers (gsm8k) are indexed;
+            # DAPO's only have prompts.
+            gold_answers = None
+            datasets = (train_dataset, test_dataset)
+            if all({"question", "answer"} <= set(d.column_names) for d in datasets):
+                gold_answers = GoldAnswerIndex.for_datasets(
+                    grpo_args.cache_dir, *datasets
+                )
+
+            # TODO: Extract this and generalize.
+            stage_data = gsm8k_stage_data(
+                dht,
+                node,
+                train_dataset,
+                test_dataset,
+                dataset_cache=MergedDatasetCache(grpo_args.cache_dir),
+                num_proc=grpo_args.prompt_num_proc,
+                prompt_budget=prompt_budget,
+                num_shards=grpo_args.stage1_num_shards,
+                shard_overlap=grpo_args.stage1_shard_overlap,
+                curriculum=grpo_args.stage1_curriculum,
+                reward_pool=reward_pool,
+                gold_answers=gold_answers,
+            )
+            stage_data.max_rounds = grpo_args.max_rounds
+
+            trainer = trainer_factory_fn(
+                dht=dht,
+                node=node,
+                model=model,
+                tokenizer=tokenizer,
+                config=training_args,
+                stage_data=stage_data,
+                log_tag=self.name,
+            )
+
+            ###############
+            # Training loop
+            ###############
+            logger.info(
+                f"Starting training {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} for {training_args.num_train_epochs} epochs"
+            )
+            trainer.train()
+        finally:
+            # Don't leave reward workers behind when training ends or fails.
+            if reward_pool:
+                reward_pool.shutdown()
@@ -0,0 +1,24 @@
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.sample_logger import SampleLogger
+
+
+@pytest.fixture(autouse=True, scope="session")
+def quiet_reward_workers():
+    # Spawned RewardPool workers import their own SAMPLE_LOGGER.
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SAMPLE_LOG_RATE", "0")
+        yield
+
+
+@pytest.fixture(autouse=True)
+def sample_logger(tmp_path, monkeypatch):
+    # Reward functions log samples by default; keep them out of the tree.
+    sample_logger = SampleLogger(str(tmp_path / "samples"))
+    for module in (stage1_rewards, stage2_rewards, stage3_rewards):
+        monkeypatch.setattr(module, "SAMPLE_LOGGER", sample_logger)
+    yield sample_logger
+    sample_logger.flush()
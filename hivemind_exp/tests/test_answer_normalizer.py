@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.answer_normalizer as answer_normalizer
+from hivemind_exp.gsm8k.answer_normalizer import answers_match, normalize_answer
+from hivemind_exp.gsm8k.reward_engine import RewardBatch
+
+
+@pytest.mark.parametrize(
+    "response, answer",
+    [
+        ("1,000", "1000"),
+        ("1 000 000", "1000000"),
+        ("12 345.5", "12345.5"),
+        ("50%", "50"),
+        ("50\\%", "50"),
+        ("1 / 2", "0.5"),
+        ("1000.0", "1000"),
+        ("$1000", "1000"),
+        ("\\$1,000.00", "1000"),
+        ("\\boxed{1000}", "1000"),
+        ("18 dollars", "18"),
+        ("5\\text{ cm}", "5"),
+        ("x = 5", "5"),
+        ("007", "7"),
+        ("0.5", "1/2"),
+        ("\\frac{1}{2}", "1/2"),
+        ("$\\dfrac{1}{2}$", "0.5"),
+        ("-0.25", "\\frac{-1}{4}"),
+        ("\\boxed{\\dfrac{\\sqrt{3}}{2}}", "\\frac{\\sqrt{3}}{2}"),
+        ("2^\\circ", "2"),
+        ("5 ft.", "5"),
+        ("1e3", "1000"),
+        ("", ""),
+    ],
+)
+def test_answers_match(response, answer):
+    assert answers_match(response, answer)
+
+
+@pytest.mark.parametrize(
+    "response, answer",
+    [
+        ("1001", "1000"),
+        ("12,34", "1234"),
+        ("1/3", "0.33"),
+        ("\\sqrt{2}", "2"),
+        ("", "0"),
+        ("42", None),
+        ("42 is wrong", "42"),
+        ("1 2", "12"),
+        ("1234 567", "1234567"),
+        ("0.5", "50%"),
+        ("1e5000", "1e5001"),
+    ],
+)
+def test_answers_differ(response, answer):
+    assert not answers_match(response, answer)
+
+
+def test_normalize_answer_is_cached():
+    cache = answer_normalizer._cached_normalize
+    cache.cache_clear()
+    for _ in range(3):
+        normalize_answer("1,000")
+    assert cache.cache_info().hits == 2
+
+    # Long answers, such as whole completions, aren't kept.
+    long_answer = "x" * (answer_normalizer.MAX_CACHED_CHARS + 1)
+    assert normalize_answer(long_answer) == long_answer
+    assert cache.cache_info().currsize == 1
+
+
+@pytest.mark.parametrize("text", ["1e99999999", "1e-5000", "1E5_000\t", "2/1e999"])
+def test_normalize_answer_refuses_huge_numbers(text):
+    # Neither built nor printed: returned as text, quickly.
+    start = time.perf_counter()
+    assert normalize_answer(text) == "".join(text.split())
+    assert time.perf_counter() - start < 0.1
+
+
+def test_correctness_survives_huge_numbers():
+    kwargs = dict(
+        prompts=[[{"content": "How many?"}]],
+        completions=[[{"content": "<answer>\n1e5000\n</answer>"}]],
+        answer=["42"],
+    )
+    assert stage1_rewards.correctness_reward_func(**kwargs) == [0.0]
+
+
+def test_correctness_uses_normalized_answers():
+    texts = ["<answer>\n1,000\n</answer>", "<answer>\n$1000.00\n</answer>", "<answer>\n100\n</answer>"]
+    kwargs = dict(
+        prompts=[[{"content": "How many?"}]] * 3,
+        completions=[[{"content": t}] for t in texts],
+        answer=["1000"] * 3,
+    )
+    rewards = stage1_rewards.correctness_reward_func(**kwargs)
+    assert rewards == [2.0, 2.0, 0.0]
+    np.testing.assert_array_equal(
+        stage1_rewards.batch_correctness_reward(RewardBatch.from_kwargs(**kwargs)),
+        np.float32(rewards),
+    )
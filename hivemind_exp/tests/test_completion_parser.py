@@ -0,0 +1,85 @@
+import random
+import re
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.completion_parser import CompletionView
+
+TAGS = ["think", "answer", "identify", "student", "majority", "question"]
+PIECES = [f"<{t}>" for t in TAGS] + [f"</{t}>" for t in TAGS] + [
+    "\n",
+    "\n\n",
+    " ",
+    "42",
+    "abc",
+    "<",
+    ">",
+    "</",
+    "<ans",
+]
+
+
+def random_texts(n=2000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 20)))
+
+
+def test_count_and_tail_len():
+    tokens = [
+        "<think>\n",
+        "\n</think>\n",
+        "\n<answer>\n",
+        "\n</answer>\n",
+        "\n</answer>",
+        "\n<identify>\n",
+    ]
+    for text in random_texts():
+        view = CompletionView(text)
+        for token in tokens:
+            assert view.count(token) == text.count(token), (text, token)
+            assert view.tail_len(token) == len(text.split(token)[-1]), (text, token)
+
+
+def test_tag_contents():
+    for text in random_texts():
+        view = CompletionView(text)
+        for tag in TAGS:
+            o, c = f"<{tag}>", f"</{tag}>"
+            assert view.tag_content(tag) == text.split(o)[-1].split(c)[0].strip()
+            assert view.tag_contents(tag) == [
+                s.split(c)[0].strip() for s in text.split(o)[1:]
+            ]
+
+
+def test_match():
+    pattern = re.compile(r"<think>.*?</think>\s*<answer>.*?</answer>")
+    for text in random_texts(200):
+        assert CompletionView(text).match(pattern) == bool(pattern.match(text))
+
+
+def reference_count_xml(text) -> float:
+    # stage1_rewards.count_xml before the parser.
+    count = 0.0
+    if text.count("<think>\n") == 1:
+        count += 0.125
+    if text.count("\n</think>\n") == 1:
+        count += 0.125
+    if text.count("\n<answer>\n") == 1:
+        count += 0.125
+        count -= len(text.split("\n</answer>\n")[-1]) * 0.001
+    if text.count("\n</answer>") == 1:
+        count += 0.125
+        count -= (len(text.split("\n</answer>")[-1]) - 1) * 0.001
+    return count
+
+
+def test_reward_helpers():
+    for text in random_texts(500, seed=1):
+        assert stage1_rewards.count_xml(text) == reference_count_xml(text)
+        assert stage1_rewards.extract_xml_answer(text) == (
+            text.split("<answer>")[-1].split("</answer>")[0].strip()
+        )
+        assert stage3_rewards.extract_xml_choices(text) == [
+            s.split("</identify>")[0].strip() for s in text.split("<identify>")[1:]
+        ]
@@ -0,0 +1,27 @@
+from datasets import Dataset, DatasetDict
+
+import hivemind_exp.dapo.generate_prompts as generate_prompts
+
+
+def test_sample_indices():
+    indices = generate_prompts.sample_indices(1000, 10)
+    assert indices == generate_prompts.sample_indices(1000, 10)
+    assert len(set(indices)) == 10 and all(0 <= i < 1000 for i in indices)
+    assert sorted(generate_prompts.sample_indices(5, 10)) == list(range(5))
+
+
+def test_get_stage1_samples(monkeypatch):
+    dataset = Dataset.from_dict(
+        {"prompt": [f"q{i}" for i in range(50)], "solution": [str(i) for i in range(50)]}
+    )
+    monkeypatch.setattr(
+        generate_prompts, "load_dataset", lambda *_: DatasetDict({"train": dataset})
+    )
+
+    train, test = generate_prompts.get_stage1_samples(num_samples=10)
+    assert len(train) == len(test) == 5
+    assert not set(train["answer"]) & set(test["answer"])
+    assert train[0]["prompt"][-1]["content"] == f"q{train[0]['answer']}"
+
+    again, _ = generate_prompts.get_stage1_samples(num_samples=10)
+    assert again["answer"] == train["answer"]
@@ -0,0 +1,72 @@
+import os
+
+from datasets import Dataset
+
+from hivemind_exp.dataset_cache import (
+    MergedDatasetCache,
+    cleanup_cache_files,
+    keyed_items_digest,
+)
+from hivemind_exp.tests.fake_data import CK, QUESTION_HASH
+
+
+def test_keyed_items_digest():
+    items = {
+        CK: [(QUESTION_HASH, (1.0, {})), ("abc", (2.0, {}))],
+        "0": [(QUESTION_HASH, (3.0, {}))],
+    }
+    reordered = {
+        "0": [(QUESTION_HASH, (3.0, {}))],
+        CK: [("abc", (2.0, {})), (QUESTION_HASH, (1.0, {}))],
+    }
+    digest = keyed_items_digest(CK, items)
+    assert digest == keyed_items_digest(CK, reordered)
+
+    # Merging node, newer outputs and peer sets all change the key.
+    assert digest != keyed_items_digest("0", items)
+    assert digest != keyed_items_digest(
+        CK, {**items, "0": [(QUESTION_HASH, (4.0, {}))]}
+    )
+    assert digest != keyed_items_digest(CK, {CK: items[CK]})
+    # So do the settings the datasets are built with.
+    assert digest == keyed_items_digest(CK, items, "")
+    assert digest != keyed_items_digest(CK, items, "4:None:False")
+
+
+def test_merged_dataset_cache(tmp_path):
+    cache = MergedDatasetCache(str(tmp_path))
+    assert cache.load(0, 1, "digest") is None
+
+    dataset = Dataset.from_dict({"question": ["q0", "q1"], "answer": ["1", "2"]})
+    cache.save(0, 1, "digest", dataset, dataset)
+    train, test = cache.load(0, 1, "digest")  # type: ignore
+    assert train.to_dict() == dataset.to_dict()
+    assert test.to_dict() == dataset.to_dict()
+    assert cache.load(0, 2, "digest") is None
+
+
+def test_merged_dataset_cache_eviction(tmp_path):
+    cache = MergedDatasetCache(str(tmp_path), keep_rounds=2)
+    dataset = Dataset.from_dict({"question": ["q0"]})
+    for r in (5, 0, 1, 2):
+        cache.save(r, 1, "digest", dataset, dataset)
+
+    assert sorted(os.listdir(cache.root)) == ["round_1", "round_2"]
+    assert cache.load(1, 1, "digest") is not None
+
+
+def test_cleanup_cache_files(tmp_path):
+    Dataset.from_dict({"question": ["q0", "q1"]}).save_to_disk(str(tmp_path / "d"))
+    dataset = Dataset.load_from_disk(str(tmp_path / "d")).map(lambda x: {"n": 1})
+    stale = tmp_path / "d" / "cache-stale.arrow"
+    stale.write_bytes(b"")
+
+    # Datasets outside the cache dir (e.g. in the shared HF cache) are left alone.
+    assert cleanup_cache_files(dataset, cache_dir=str(tmp_path / "other")) == 0
+    assert stale.exists()
+
+    assert cleanup_cache_files(dataset, cache_dir=str(tmp_path)) == 1
+    assert not stale.exists()
+    assert dataset.cache_files and all(
+        os.path.exists(f["filename"]) for f in dataset.cache_files
+    )
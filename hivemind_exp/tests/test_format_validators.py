@@ -0,0 +1,105 @@
+import re
+import time
+
+import pytest
+from hypothesis import example, given, settings
+from hypothesis import strategies as st
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+
+# The format regexes as the reward functions used to match them.
+REFERENCE_PATTERNS = {
+    stage1_rewards: (
+        r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$",
+        r"<think>.*?</think>\s*<answer>.*?</answer>",
+    ),
+    stage2_rewards: (
+        r"^<compare>\n.*?\n</compare>\n<explain>\n.*?\n</explain>\n<identify>\n.*?\n</identify>\n$",
+        r"<compare>.*?</compare>\s*<explain>.*?</explain>\s*<identify>.*?</identify>",
+    ),
+    stage3_rewards: (
+        r"^<summarize_feedback>\n.*?\n</summarize_feedback>\n<majority>\n.*?\n</majority>\n<question>\n.*?\n</question>\n<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$",
+        r"<summarize_feedback>.*?</summarize_feedback>\s*<majority>.*?</majority>\s*<question>.*?</question>\s*<think>.*?</think>\s*<answer>.*?</answer>",
+    ),
+}
+MODULES = list(REFERENCE_PATTERNS)
+WHITESPACE = ["\n", "\n\n", " ", "\t", "\r", "\x1c", "\u2003"]
+
+
+@st.composite
+def completions(draw, tags):
+    """
+    Mostly near-valid completions in the strict (newline-separated) or soft
+    (inline) layout: up to two pieces replaced by runs of tag and whitespace
+    atoms, whitespace or text after the last section, and up to two atoms
+    inserted or characters deleted. Otherwise a short run of atoms alone.
+    """
+    atoms = [f"<{t}>" for t in tags] + [f"</{t}>" for t in tags]
+    atoms += [*WHITESPACE, "x", "<", ">"]
+    runs = st.lists(st.sampled_from(atoms), max_size=3).map("".join)
+    spaces = st.lists(st.sampled_from(WHITESPACE), max_size=3).map("".join)
+    # Half of the near-valid completions have no replaced pieces or edits.
+    counts = st.sampled_from([0, 0, 1, 2])
+    if draw(st.integers(0, 4)) == 0:
+        return draw(st.lists(st.sampled_from(atoms), max_size=12).map("".join))
+
+    inner = draw(st.sampled_from(["\n", ""]))
+    pieces = []
+    for t in tags:
+        content = st.sampled_from(["", "a\nb", f"x</{t}>y", f"<{t}>"]) | runs
+        pieces += [
+            (f"<{t}>", runs),
+            (inner, runs),
+            ("Some text.", content),
+            (inner, runs),
+            (f"</{t}>", runs),
+            ("\n", runs | st.just("z")),
+        ]
+    positions = st.integers(0, len(pieces) - 1)
+    n = draw(counts)
+    bad = draw(st.lists(positions, min_size=n, max_size=n))
+    text = "".join(draw(b) if i in bad else good for i, (good, b) in enumerate(pieces))
+    chars = list(text + draw(spaces | st.just("trailing")))
+
+    edit = st.tuples(st.integers(0, len(chars)), st.none() | st.sampled_from(atoms))
+    n = draw(counts)
+    for i, atom in draw(st.lists(edit, min_size=n, max_size=n)):
+        if atom is None and i < len(chars):
+            del chars[i]
+        else:
+            chars.insert(i, atom or "")
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("module", MODULES, ids=lambda m: m.__name__.split(".")[-1])
+def test_validators_match_reference_regexes(module):
+    strict, soft = (re.compile(p) for p in REFERENCE_PATTERNS[module])
+    assert module.STRICT_FORMAT_PATTERN.pattern == strict.pattern
+    assert module.SOFT_FORMAT_PATTERN.pattern == soft.pattern
+
+    # Both outcomes are exercised.
+    tags = module.FORMAT.tags
+    strict_text = "".join(f"<{t}>\nSome text.\n</{t}>\n" for t in tags)
+    soft_text = " ".join(f"<{t}>Some text.</{t}>" for t in tags)
+    assert module.FORMAT.strict(strict_text) and module.FORMAT.soft(soft_text)
+
+    @settings(max_examples=500, deadline=None, database=None)
+    @given(completions(tags))
+    @example(strict_text)
+    @example(soft_text)
+    def check(text):
+        assert module.FORMAT.strict(text) == bool(strict.match(text))
+        assert module.FORMAT.soft(text) == bool(soft.match(text))
+
+    check()
+
+
+def test_soft_validator_is_linear():
+    # Every </think> is followed by an <answer> that never closes: the lazy
+    # regex retries the rest of the line from each one (about a minute here).
+    text = "<think>" + "x</think> <answer>" * 20000
+    start = time.perf_counter()
+    assert not stage1_rewards.FORMAT.soft(text)
+    assert time.perf_counter() - start < 0.5
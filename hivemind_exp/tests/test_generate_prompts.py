@@ -1,4 +1,5 @@
 import copy
+import os
 
 import pytest
 
@@ -28,3 +29,157 @@ def test_get_stage3_samples_missing_agents():
     del s1["agent_opinion"][CK]
     del s2["agent_opinion"]["0"]
     get_stage3_samples([s1, s2])
+
+
+def test_get_stage2_samples_in_memory():
+    dataset, _ = get_stage2_samples([copy.deepcopy(STAGE_1_MERGED)])
+    assert dataset.cache_files == []
+
+
+def test_get_stage2_samples_empty():
+    with pytest.raises(DatasetGenerationError):
+        get_stage2_samples([])
+
+
+def test_get_stage2_samples_agent_layout():
+    dataset, _ = get_stage2_samples([copy.deepcopy(STAGE_1_MERGED)])
+    assert "agent_answers" in dataset.column_names
+    assert not any(c.startswith("agent_answers_") for c in dataset.column_names)
+    assert agent_texts(dataset[0], "agent_answers") == STAGE_1_MERGED["agent_answers"]
+
+    prompt = dataset[0]["prompt"][-1]["content"]
+    for i in range(len(STAGE_1_MERGED["agent_answers"])):
+        assert f"<student>Student #{i}</student> said" in prompt
+
+
+def test_get_stage2_samples_sparse():
+    s1 = copy.deepcopy(STAGE_1_MERGED)
+    s2 = copy.deepcopy(s1)
+    s2["question"] = "What is 6 times 7?"
+    s2["agent_answers"] = {"0": s1["agent_answers"]["0"]}
+    s3 = copy.deepcopy(s2)
+    s3["agent_answers"] = {}
+
+    dataset, _ = get_stage2_samples([s1, s2, s3])
+    assert len(dataset) == 2  # No answers, no row.
+    assert agent_texts(dataset[1], "agent_answers") == s2["agent_answers"]
+    assert "Student #1" not in dataset[1]["prompt"][-1]["content"]
+
+
+def test_get_stage2_samples_num_proc():
+    values = []
+    for i in range(4):
+        value = copy.deepcopy(STAGE_1_MERGED)
+        value["question"] = f"{value['question']} ({i})"
+        values.append(value)
+
+    dataset, _ = get_stage2_samples(copy.deepcopy(values))
+    parallel, _ = get_stage2_samples(copy.deepcopy(values), num_proc=2)
+    assert parallel["prompt"] == dataset["prompt"]
+    assert parallel["answer"] == dataset["answer"]
+    # Stable builders give stable fingerprints.
+    again, _ = get_stage2_samples(copy.deepcopy(values))
+    assert again._fingerprint == dataset._fingerprint
+
+
+class WhitespaceTokenizer:
+    # Stand-in for a HF tokenizer: one token per whitespace-separated word.
+    def encode(self, text, add_special_tokens=True):
+        return text.split()
+
+    def apply_chat_template(self, messages, tokenize=True, add_generation_prompt=False):
+        return [t for m in messages for t in (m["role"], *m["content"].split())]
+
+
+@pytest.mark.parametrize("max_prompt_length", [400, 500, 100000])
+def test_get_stage2_samples_prompt_budget(max_prompt_length):
+    tokenizer = WhitespaceTokenizer()
+    budget = PromptBudget(tokenizer, max_prompt_length)
+    dataset, _ = get_stage2_samples([copy.deepcopy(STAGE_1_MERGED)], budget=budget)
+
+    prompt = dataset[0]["prompt"]
+    n_students = prompt[-1]["content"].count("<student>")
+    assert len(tokenizer.apply_chat_template(prompt)) <= max_prompt_length
+    assert 1 <= n_students <= len(STAGE_1_MERGED["agent_answers"])
+    if max_prompt_length == 100000:
+        # No fixed k when everything fits.
+        assert n_students == len(STAGE_1_MERGED["agent_answers"])
+    # Answer lengths are cached by content.
+    assert len(budget.lengths) <= len(set(STAGE_1_MERGED["agent_answers"].values())) + 1
+
+
+def test_get_stage3_samples_prompt_budget():
+    tokenizer = WhitespaceTokenizer()
+    budget = PromptBudget(tokenizer, 100000)
+    dataset, _ = get_stage3_samples([copy.deepcopy(STAGE_2_MERGED)], budget=budget)
+    content = dataset[0]["prompt"][-1]["content"]
+    assert content.count("<criticism>") == len(STAGE_2_MERGED["agent_opinion"])
+
+
+def test_get_stage2_samples_prompt_budget_overflow(caplog):
+    # Even the bare prompt is too long: keep the default top-k answers.
+    budget = PromptBudget(WhitespaceTokenizer(), 10)
+    dataset, _ = get_stage2_samples([copy.deepcopy(STAGE_1_MERGED)], budget=budget)
+    expected, _ = get_stage2_samples([copy.deepcopy(STAGE_1_MERGED)])
+    assert dataset[0]["prompt"] == expected[0]["prompt"]
+    assert budget.overflows == 1
+    assert "don't fit" in caplog.text
+
+
+def test_get_stage1_samples_cache(tmp_path, monkeypatch):
+    import hivemind_exp.gsm8k.generate_prompts as generate_prompts
+    from datasets import Dataset, DatasetDict
+
+    calls = []
+    hub = {"main": "sha1", "abc": "sha3"}
+
+    def fake_load_dataset(dataset_id, name, revision=None):
+        calls.append(revision)
+        split = Dataset.from_dict(
+            {"question": [QUESTION], "answer": ["Because.\n#### 42"]}
+        )
+        return DatasetDict({"train": split, "test": split})
+
+    monkeypatch.setattr(generate_prompts, "load_dataset", fake_load_dataset)
+    monkeypatch.setattr(
+        generate_prompts,
+        "resolve_dataset_revision",
+        lambda dataset_id, revision=None: hub.get(revision or "main"),
+    )
+    monkeypatch.delenv("PROMPT_GENERATOR_ROLE", raising=False)
+
+    train, test = get_stage1_samples(str(tmp_path))
+    assert train[0]["answer"] == "42"
+    assert train[0]["prompt"][-1]["content"] == QUESTION
+
+    # Served from the memory-mapped cache, minus stale cache files.
+    train_files = get_stage1_samples(str(tmp_path))[0].cache_files
+    stale = os.path.join(os.path.dirname(train_files[0]["filename"]), "cache-stale.arrow")
+    open(stale, "wb").close()
+    cached_train, cached_test = get_stage1_samples(str(tmp_path))
+    assert calls == ["sha1"]
+    assert cached_train.cache_files and cached_test.cache_files
+    assert cached_train.to_dict() == train.to_dict()
+    assert not os.path.exists(stale)
+
+    # Other system prompts / revisions get their own entries.
+    monkeypatch.setenv("PROMPT_GENERATOR_ROLE", "PIRATE")
+    get_stage1_samples(str(tmp_path))
+    get_stage1_samples(str(tmp_path), revision="abc")
+    assert calls == ["sha1", "sha1", "sha3"]
+
+    # So do Hub updates to the same revision.
+    monkeypatch.delenv("PROMPT_GENERATOR_ROLE")
+    hub["main"] = "sha2"
+    get_stage1_samples(str(tmp_path))
+    assert calls[-1] == "sha2"
+
+    # Offline, the last resolved commit is served from the cache.
+    hub.clear()
+    get_stage1_samples(str(tmp_path))
+    assert len(calls) == 4
+
+    # With nothing recorded, the splits aren't cached.
+    get_stage1_samples(str(tmp_path / "empty"))
+    get_stage1_samples(str(tmp_path / "empty"))
+    assert calls[-2:] == [None, None]
@@ -0,0 +1,54 @@
+import numpy as np
+from datasets import Dataset
+
+from hivemind_exp.gsm8k.gold_answers import GoldAnswerIndex, question_hash
+
+QUESTIONS = [f"What is {i} plus {i}?" for i in range(1000)]
+ANSWERS = [f"{2 * i:,}" for i in range(1000)]
+
+
+def test_lookup():
+    index = GoldAnswerIndex.build(QUESTIONS, ANSWERS)
+    assert len(index) == len(QUESTIONS)
+    assert len(index.slots) >= 2 * len(QUESTIONS)
+    for i, q in enumerate(QUESTIONS):
+        # Answers are stored normalized: "1,998" -> "1998".
+        assert index.get(q) == str(2 * i)
+        assert index.lookup(question_hash(q)) == str(2 * i)
+    assert index.get("What is the meaning of life?") is None
+    assert "What is 1 plus 1?" in index
+
+
+def test_missing_answers_are_skipped():
+    index = GoldAnswerIndex.build(["a", "b", "c"], ["1", None, "\\boxed{3}"])
+    assert len(index) == 2
+    assert index.get("a") == "1"
+    assert index.get("b") is None
+    assert index.get("c") == "3"
+
+    empty = GoldAnswerIndex.build([], [])
+    assert len(empty) == 0 and empty.get("a") is None
+
+
+def test_save_and_mmap(tmp_path):
+    index = GoldAnswerIndex.build(QUESTIONS, ANSWERS)
+    index.save(str(tmp_path / "gold"))
+
+    loaded = GoldAnswerIndex.load(str(tmp_path / "gold"))
+    assert isinstance(loaded.slots, np.memmap)
+    assert [loaded.get(q) for q in QUESTIONS] == [index.get(q) for q in QUESTIONS]
+    assert GoldAnswerIndex.load(str(tmp_path / "missing")) is None
+
+
+def test_for_datasets(tmp_path):
+    train = Dataset.from_dict({"question": QUESTIONS[:600], "answer": ANSWERS[:600]})
+    test = Dataset.from_dict({"question": QUESTIONS[600:], "answer": ANSWERS[600:]})
+
+    index = GoldAnswerIndex.for_datasets(str(tmp_path), train, test)
+    assert index.get(QUESTIONS[700]) == "1400"
+    assert len(list((tmp_path / "gold_answers").iterdir())) == 1
+
+    # Later startups map the saved table.
+    again = GoldAnswerIndex.for_datasets(str(tmp_path), train, test)
+    assert isinstance(again.slots, np.memmap)
+    assert again.get(QUESTIONS[0]) == "0"
@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock
+
+import pytest
+from datasets import Dataset, DatasetDict
+from trl import GRPOConfig
+
+import hivemind_exp.dapo.generate_prompts as dapo_generate_prompts
+import hivemind_exp.runner.grpo_runner as grpo_runner
+from hivemind_exp.gsm8k.generate_prompts import get_gsm8k_questions
+from hivemind_exp.runner.grpo_runner import GRPOArguments, GRPORunner
+
+
+def dapo_datasets(monkeypatch):
+    dataset = Dataset.from_dict(
+        {"prompt": [f"q{i}" for i in range(8)], "solution": [str(i) for i in range(8)]}
+    )
+    monkeypatch.setattr(
+        dapo_generate_prompts, "load_dataset", lambda *_: DatasetDict({"train": dataset})
+    )
+    return dapo_generate_prompts.get_stage1_samples(num_samples=8)
+
+
+def gsm8k_datasets():
+    dataset = Dataset.from_dict(
+        {
+            "question": [f"What is {i} plus {i}?" for i in range(4)],
+            "answer": [f"Because.\n#### {2 * i}" for i in range(4)],
+        }
+    )
+    return get_gsm8k_questions(dataset), get_gsm8k_questions(dataset)
+
+
+@pytest.mark.parametrize("game", ["gsm8k", "dapo"])
+def test_run_builds_stage_data(game, tmp_path, monkeypatch):
+    datasets = dapo_datasets(monkeypatch) if game == "dapo" else gsm8k_datasets()
+
+    def setup_dht(self, grpo_args):
+        self.name = "tester"
+        return MagicMock(peer_id="peer")
+
+    monkeypatch.setattr(grpo_runner, "AutoTokenizer", MagicMock())
+    monkeypatch.setattr(GRPORunner, "setup_dht", setup_dht)
+    monkeypatch.setattr(GRPORunner, "get_model", lambda *args: MagicMock())
+    stage_data_kwargs = {}
+    build_stage_data = grpo_runner.gsm8k_stage_data
+
+    def gsm8k_stage_data(*args, **kwargs):
+        stage_data_kwargs.update(kwargs)
+        return build_stage_data(*args, **kwargs)
+
+    monkeypatch.setattr(grpo_runner, "gsm8k_stage_data", gsm8k_stage_data)
+    trainer_factory = MagicMock()
+
+    GRPORunner().run(
+        MagicMock(model_name_or_path="model"),
+        GRPOArguments(game=game, cache_dir=str(tmp_path)),
+        GRPOConfig(output_dir=str(tmp_path), bf16=False),
+        lambda: datasets,
+        trainer_factory,
+    )
+    trainer_factory.return_value.train.assert_called_once()
+    gold_answers = stage_data_kwargs["gold_answers"]
+    if game == "dapo":
+        assert gold_answers is None
+    else:
+        assert gold_answers.get("What is 2 plus 2?") == "4"
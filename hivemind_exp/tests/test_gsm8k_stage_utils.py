@@ -12,18 +12,20 @@ from hivemind.utils import get_dht_time
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from trl import GRPOConfig
 
-from hivemind_exp.dht_utils import ROUND_STAGE_NUMBER_KEY, outputs_key
-from hivemind_exp.gsm8k.stage_utils import (
-    HivemindNode,
+from hivemind_exp.dataset_cache import MergedDatasetCache
+from hivemind_exp.dht_utils import ROUND_STAGE_NUMBER_KEY, outputs_key, rewards_key
+from hivemind_exp.gsm8k.generate_prompts import (
+    agent_texts,
     get_stage2_samples,
     get_stage3_samples,
-    gsm8k_stage_data,
+)
+from hivemind_exp.gsm8k.stage_merger import (
     merge_stage1_question,
     merge_stage2_question,
-    merged_prev_stage_datasets,
-    rewards_key,
 )
-from hivemind_exp.hivemind_utils import SingleStageData
+from hivemind_exp.gsm8k.stage_utils import merged_prev_stage_datasets
+from hivemind_exp.gsm8k.stages import gsm8k_stage_data
+from hivemind_exp.hivemind_utils import HivemindNode, SingleStageData
 from hivemind_exp.tests.fake_data import (
     CK,
     QUESTION,
@@ -63,12 +65,11 @@ def wrap_datasets_fn(stage: SingleStageData, check):
     stage.datasets_fn = wrapped
 
 
-def check_dataset(prefix: str, min_count: int, dataset: Dataset):
-    c = 0
-    for feature in dataset.features:
-        if feature.startswith(prefix):
-            c += 1
-    assert c >= min_count
+def check_dataset(field: str, min_count: int, dataset: Dataset):
+    agent_ids = set()
+    for datum in dataset:
+        agent_ids |= agent_texts(datum, field).keys()
+    assert len(agent_ids) >= min_count
 
 
 def create_dht_and_trainer(tmp_path, node, min_peers=1, initial_peers=[]):
@@ -133,6 +134,9 @@ def store_stage_outputs(
         node.put_stage_outputs(r, s, QUESTION, (0, value))
 
 
+# Stage 1 outputs don't carry the prompt.
+STAGE_1_SAMPLES = [{k: v for k, v in s.items() if k != "prompt"} for s in SAMPLES]
+
 STAGE_2_SAMPLES = [
     STAGE_2_OUTPUTS[CK],
     STAGE_2_OUTPUTS["0"],
@@ -148,7 +152,7 @@ STAGE_2_MERGED_OPINIONS = STAGE_2_MERGED["agent_opinion"]
             merge_stage1_question,
             get_stage2_samples,
             0,
-            SAMPLES,
+            STAGE_1_SAMPLES,
             "agent_answers",
             lambda: ("The meaning of life is to sleep.", "The meaning of life is 42."),
         ),
@@ -192,28 +196,71 @@ def test_merged_prev_stage_datasets(
     )  # Local only.
 
     ## Rewards not visible on DHT!
+    def merged_texts():
+        cf, nf = merge_coord()[0][0], merge_node()[0][0]
+        return agent_texts(cf, group_field), agent_texts(nf, group_field)
+
     coord_expected, node_expected = get_expected_fn()
-    cf, nf = merge_coord()[0][0], merge_node()[0][0]
+    cf, nf = merged_texts()
 
     # Local.
-    assert cf[f"{group_field}_{CK}"] == coord_expected
-    assert f"{group_field}_{node.key}" not in cf
+    assert cf[CK] == coord_expected
+    assert node.key not in cf
 
     # Local.
-    assert f"{group_field}_{CK}" not in nf
-    assert nf[f"{group_field}_{node.key}"] == node_expected
+    assert CK not in nf
+    assert nf[node.key] == node_expected
 
     ## Check merged outputs with visible rewards!
     store_dummy_rewards(dht, [coord.key, node.key], 0, stage)
-    cf, nf = merge_coord()[0][0], merge_node()[0][0]
+    cf, nf = merged_texts()
 
     # Local.
-    assert cf[f"{group_field}_{CK}"] == coord_expected
-    assert f"{group_field}_{node.key}" not in cf
+    assert cf[CK] == coord_expected
+    assert node.key not in cf
 
     # Local + DHT.
-    assert nf[f"{group_field}_{CK}"] == node_expected
-    assert nf[f"{group_field}_{node.key}"] == node_expected
+    assert nf[CK] == node_expected
+    assert nf[node.key] == node_expected
+
+
+def test_merged_prev_stage_datasets_cache(tmp_path):
+    dht = hivemind.DHT(start=True)
+    coord = HivemindNode.coordinator("test", CK)
+    coord_samples = samples_with_key(CK, STAGE_1_SAMPLES, "agent_answers")
+    store_stage_outputs(dht, coord, 0, 0, coord_samples[0], StorageMode.NODE)
+
+    cache = MergedDatasetCache(str(tmp_path))
+    observed = []
+    calls = []
+
+    def samples_fn(values):
+        calls.append(values)
+        return get_stage2_samples(values)
+
+    def merge(cache_config=""):
+        return merged_prev_stage_datasets(
+            dht,
+            coord,
+            0,
+            1,
+            merge_stage1_question,
+            samples_fn,
+            wait_timeout=0,
+            dataset_cache=cache,
+            cache_config=cache_config,
+            observe_fn=observed.append,
+        )
+
+    first = merge()
+    assert merge()[0].to_dict() == first[0].to_dict()
+    # Hits skip building the datasets, but are still observed.
+    assert len(calls) == 1
+    assert len(observed) == 2 and observed[0] == observed[1] == calls[0]
+
+    # Other settings don't reuse the cached datasets.
+    merge("other")
+    assert len(calls) == 2
 
 
 def test_gsm8k_stage_data(tmp_path):
@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.prompt_analysis import analyze_prompt
+
+STAGE3_PROMPT = (
+    "The question we were given is: What is 6 times 7?  \n\n"
+    "The following answers to this question were suggested:\n"
+    "<student>Alice</student> said \n<answer>\n42\n</answer>\n"
+    "<student>Bob</student> said \n<answer>\n41\n</answer>"
+    "  \nAfter comparing these answers, the following feedback was given about "
+    "which answer is best: \n"
+    "<identify>\nAlice\n</identify>\n<identify>\nAlice\n</identify>\n"
+    "<identify>\nBob\n</identify>\n"
+)
+
+
+def test_stage3_analysis_matches_extractors():
+    analysis = stage3_rewards.prompt_analysis(STAGE3_PROMPT)
+    assert dict(analysis.answers) == stage3_rewards.extract_answers(STAGE3_PROMPT)
+    assert list(analysis.choices) == stage3_rewards.extract_xml_choices(STAGE3_PROMPT)
+    assert analysis.majority == {"Alice"}
+    assert analysis.question == "What is 6 times 7?"
+
+
+def test_stage2_analysis_matches_extractors():
+    analysis = stage2_rewards.prompt_analysis(STAGE3_PROMPT)
+    assert list(analysis.ids) == stage2_rewards.extract_xml_ids(STAGE3_PROMPT)
+    assert dict(analysis.answers) == stage2_rewards.extract_answers(STAGE3_PROMPT)
+    assert analysis.choices == ()
+    assert analysis.majority == frozenset()
+
+
+def test_prompt_parsed_once():
+    extract = MagicMock(return_value={"Alice": "42"})
+    first = analyze_prompt(STAGE3_PROMPT, extract_answers=extract)
+    second = analyze_prompt(STAGE3_PROMPT, extract_answers=extract)
+    assert first is second
+    extract.assert_called_once_with(STAGE3_PROMPT)
+
+    # Cached answers can't be changed by a caller.
+    with pytest.raises(TypeError):
+        first.answers["Alice"] = "0"
+
+
+def test_non_string_prompt():
+    analysis = analyze_prompt(["not", "a", "prompt"], stage3_rewards.extract_xml_ids)
+    assert analysis.ids == ()
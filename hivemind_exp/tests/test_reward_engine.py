@@ -0,0 +1,226 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.reward_engine import RewardBatch, RewardEngine
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.tests.fake_data import STAGE_2_MERGED
+
+GOOD = "<think>\nLet me solve this step by step.\n</think>\n<answer>\n42\n</answer>\n"
+PROMPTS = [[{"content": "What is 6 times 7?"}]] * 3
+COMPLETIONS = [[{"content": c}] for c in (GOOD, "The answer is 42", "<answer>\n7")]
+ANSWER = ["42"] * 3
+
+
+def make_node():
+    node = MagicMock(spec=HivemindNode)
+    node.key = "test_node"
+    return node
+
+
+def test_reward_engine_evaluates_once():
+    calls = []
+
+    def counted(fn):
+        def wrapped(**kwargs):
+            calls.append(fn.__name__)
+            return fn(**kwargs)
+
+        wrapped.__name__ = fn.__name__
+        return wrapped
+
+    funcs = [counted(fn) for fn in stage1_rewards.CUMULATIVE_REWARD_FUNCS]
+    engine = RewardEngine(funcs, funcs)
+    reward_funcs = [engine.wrap(fn) for fn in funcs]
+    assert [fn.__name__ for fn in reward_funcs] == [
+        fn.__name__ for fn in stage1_rewards.CUMULATIVE_REWARD_FUNCS
+    ]
+
+    kwargs = dict(prompts=PROMPTS, completions=COMPLETIONS, answer=ANSWER)
+    per_func = [fn(**kwargs) for fn in reward_funcs]
+    node = make_node()
+    assert engine.hivemind_cumulative_reward(
+        node, stage1_rewards.hivemind_outputs, **kwargs
+    ) == [0.0] * 3
+    assert len(calls) == len(funcs)
+
+    # Same values as the standalone functions, as float32.
+    for got, fn in zip(per_func, stage1_rewards.CUMULATIVE_REWARD_FUNCS):
+        np.testing.assert_array_equal(np.float32(got), np.float32(fn(**kwargs)))
+
+    # A new batch is evaluated again.
+    engine.evaluate(**{**kwargs, "completions": list(COMPLETIONS)})
+    assert len(calls) == 2 * len(funcs)
+
+
+def test_reward_engine_matches_hivemind_cumulative_reward():
+    kwargs = dict(prompts=PROMPTS, completions=COMPLETIONS, answer=ANSWER)
+    expected = make_node()
+    stage1_rewards.hivemind_cumulative_reward(expected, **kwargs)
+
+    engine = RewardEngine(
+        stage1_rewards.CUMULATIVE_REWARD_FUNCS[::-1],
+        stage1_rewards.CUMULATIVE_REWARD_FUNCS,
+    )
+    node = make_node()
+    engine.hivemind_cumulative_reward(node, stage1_rewards.hivemind_outputs, **kwargs)
+    assert node.rewards == pytest.approx(expected.rewards, rel=1e-6)
+    assert node.outputs == expected.outputs
+    assert node.outputs["agent_answers"]["test_node"] == GOOD
+
+
+STAGE_3_TEXTS = [
+    "<summarize_feedback>\nAll agree.\n</summarize_feedback>\n<majority>\nStudent #0\n</majority>\n"
+    "<question>\nWhat is 6 times 7?\n</question>\n<think>\n6*7\n</think>\n<answer>\n42\n</answer>\n",
+    "<majority>Student #1</majority><answer>41</answer>",
+    "",
+]
+
+
+CRITIQUE_PROMPT = (
+    "The question we were given is: What is 6 times 7?  \n\n"
+    "The following answers to this question were suggested:\n"
+    "<student>Alice</student> said \n<think>\n6*7\n</think>\n<answer>\n42\n</answer>\n"
+    "<student>Bob</student> said \n<answer>\n41\n</answer>"
+    "  \nAfter comparing these answers, the following feedback was given about "
+    "which answer is best: \n"
+    "<identify>\nAlice\n</identify>\n<identify>\nAlice\n</identify>\n"
+)
+
+
+STAGE_2_TEXTS = [
+    "<compare>\nBoth add up.\n</compare>\n<explain>\n6*7=42\n</explain>\n<identify>\nAlice\n</identify>\n",
+    "<compare>\nx\n</compare>\n<explain>\ny\n</explain>\n<identify>\nBob\n</identify>\ntrailing",
+    "<compare>a</compare> <explain>b</explain>\n<identify>Carol</identify>",
+    "<identify>\nNone\n</identify>",
+    "",
+]
+
+
+@pytest.mark.parametrize(
+    "module, prompt, texts",
+    [
+        (
+            stage1_rewards,
+            STAGE_2_MERGED["question"],
+            [GOOD, "The answer is 42", "<answer>\n7", "", "<answer>42"],
+        ),
+        (stage2_rewards, CRITIQUE_PROMPT, STAGE_2_TEXTS),
+        (stage3_rewards, STAGE_2_MERGED["question"], STAGE_3_TEXTS),
+    ],
+)
+def test_batch_reward_funcs_match_list_funcs(module, prompt, texts):
+    kwargs = dict(
+        prompts=[[{"content": prompt}]] * len(texts),
+        completions=[[{"content": t}] for t in texts],
+        answer=["42"] * len(texts),
+        logging=False,
+    )
+    batch = RewardBatch.from_kwargs(**kwargs)
+    for fn, batch_fn in module.BATCH_REWARD_FUNCS.items():
+        got = batch_fn(batch)
+        assert got.dtype == np.float32
+        np.testing.assert_array_equal(got, np.float32(fn(**kwargs)))
+
+    engine = RewardEngine(
+        module.CUMULATIVE_REWARD_FUNCS,
+        module.CUMULATIVE_REWARD_FUNCS,
+        module.BATCH_REWARD_FUNCS,
+    )
+    list_engine = RewardEngine(
+        module.CUMULATIVE_REWARD_FUNCS, module.CUMULATIVE_REWARD_FUNCS
+    )
+    np.testing.assert_array_equal(engine.total(**kwargs), list_engine.total(**kwargs))
+
+
+def test_stage2_batch_reward_funcs_log_samples(monkeypatch):
+    logged = []
+    monkeypatch.setattr(stage2_rewards.SAMPLE_LOGGER, "should_log", lambda: True)
+    monkeypatch.setattr(
+        stage2_rewards.SAMPLE_LOGGER, "log", lambda *args: logged.append(args)
+    )
+    kwargs = dict(
+        prompts=[[{"content": CRITIQUE_PROMPT}]] * len(STAGE_2_TEXTS),
+        completions=[[{"content": t}] for t in STAGE_2_TEXTS],
+        answer=["42"] * len(STAGE_2_TEXTS),
+    )
+    for fn, batch_fn in stage2_rewards.BATCH_REWARD_FUNCS.items():
+        fn(**kwargs)
+        batch_fn(RewardBatch.from_kwargs(**kwargs))
+        assert len(logged) % 2 == 0 and logged[-1] == logged[-2]
+        batch_fn(RewardBatch.from_kwargs(**kwargs, logging=False))
+        assert len(logged) % 2 == 0
+
+
+@pytest.mark.parametrize(
+    "module, tag",
+    [(stage2_rewards, "identify"), (stage3_rewards, "majority")],
+)
+def test_guarded_rewards_match_list_funcs(module, tag):
+    texts = [
+        f"<{tag}>\nAlice\n</{tag}>\n",
+        f"<{tag}>Bob</{tag}>",
+        f"<{tag}>\nNone\n</{tag}>",
+        f"<{tag}>\nCarol\n</{tag}>",
+        "Alice",
+        "no tags at all",
+        "",
+    ]
+    kwargs = dict(
+        prompts=[[{"content": CRITIQUE_PROMPT}]] * len(texts),
+        completions=[[{"content": t}] for t in texts],
+        answer=["42"] * len(texts),
+        logging=False,
+    )
+    seen = {}
+
+    def recorded(fn):
+        def wrapped(**kwargs):
+            seen[fn] = [c[0]["content"] for c in kwargs["completions"]]
+            return fn(**kwargs)
+
+        return wrapped
+
+    wrapped = {fn: recorded(fn) for fn in module.REWARD_GUARDS}
+    funcs = list(wrapped.values())
+    engine = RewardEngine(
+        funcs,
+        funcs,
+        guards={wrapped[fn]: guard for fn, guard in module.REWARD_GUARDS.items()},
+    )
+    results = engine.evaluate(**kwargs)
+    for fn in module.REWARD_GUARDS:
+        np.testing.assert_array_equal(results[wrapped[fn]], np.float32(fn(**kwargs)))
+        # Completions naming no one in the prompt are never scored.
+        assert "no tags at all" not in seen[fn] and "" not in seen[fn]
+        assert f"<{tag}>\nCarol\n</{tag}>" not in seen[fn]
+
+
+def test_reward_batch_falls_back_on_malformed_input():
+    kwargs = dict(prompts=PROMPTS, completions=COMPLETIONS, answer=ANSWER)
+    assert RewardBatch.from_kwargs(**{**kwargs, "answer": ANSWER[:1]}) is None
+    assert RewardBatch.from_kwargs(**{**kwargs, "prompts": None}) is None
+
+    # The list implementations decide what those batches are worth.
+    funcs = stage1_rewards.CUMULATIVE_REWARD_FUNCS[2:]
+    engine = RewardEngine(funcs, funcs, stage1_rewards.BATCH_REWARD_FUNCS)
+    kwargs["completions"] = [[{"content": None}], [{"content": GOOD}], [{}]]
+    assert RewardBatch.from_kwargs(**kwargs) is None
+    np.testing.assert_array_equal(
+        engine.total(**kwargs), RewardEngine(funcs, funcs).total(**kwargs)
+    )
+
+
+def test_reward_engine_weights():
+    kwargs = dict(prompts=PROMPTS, completions=COMPLETIONS, answer=ANSWER)
+    funcs = stage1_rewards.CUMULATIVE_REWARD_FUNCS
+    weights = [1.0, 0.0, 0.0, 0.0, 2.0]
+    engine = RewardEngine(funcs, funcs, stage1_rewards.BATCH_REWARD_FUNCS, weights)
+    expected = np.float32(
+        stage1_rewards.correctness_reward_func(**kwargs)
+    ) + 2 * np.float32(stage1_rewards.xmlcount_reward_func(**kwargs))
+    np.testing.assert_allclose(engine.total(**kwargs), expected, rtol=1e-6)
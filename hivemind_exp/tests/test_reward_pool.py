@@ -0,0 +1,83 @@
+import copy
+import multiprocessing
+import time
+
+import numpy as np
+import pytest
+
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.generate_prompts import get_stage3_samples
+from hivemind_exp.gsm8k.reward_engine import RewardEngine
+from hivemind_exp.gsm8k.reward_pool import RewardPool
+from hivemind_exp.tests.fake_data import STAGE_2_MERGED
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = RewardPool(2, chunk_size=2, timeout=60.0)
+    yield pool
+    pool.shutdown()
+
+
+def stage3_kwargs(n=7):
+    dataset, _ = get_stage3_samples([copy.deepcopy(STAGE_2_MERGED)])
+    row = dataset[0]
+    texts = [
+        "<summarize_feedback>\nOk.\n</summarize_feedback>\n<majority>\nStudent #0\n</majority>\n"
+        f"<question>\n{row['question'][: 10 * i]}\n</question>\n<think>\nHm.\n</think>\n<answer>\n{i}\n</answer>\n"
+        for i in range(n)
+    ]
+    return dict(
+        prompts=[row["prompt"]] * n,
+        completions=[[{"role": "assistant", "content": t}] for t in texts],
+        answer=[str(i % 2) for i in range(n)],
+    )
+
+
+def test_pooled_rewards_match_in_process(pool):
+    kwargs = stage3_kwargs()
+    funcs = stage3_rewards.CUMULATIVE_REWARD_FUNCS
+    local = RewardEngine(funcs, funcs, stage3_rewards.BATCH_REWARD_FUNCS)
+    pooled = RewardEngine(
+        funcs,
+        funcs,
+        stage3_rewards.BATCH_REWARD_FUNCS,
+        pool=pool,
+        pooled_funcs=stage3_rewards.ELEMENTWISE_REWARD_FUNCS,
+    )
+    assert stage3_rewards.question_recreation_reward_func in pooled.pooled_funcs
+    assert stage3_rewards.xmlcount_reward_func not in pooled.pooled_funcs
+
+    expected, got = local.evaluate(**kwargs), pooled.evaluate(**kwargs)
+    for fn in funcs:
+        np.testing.assert_array_equal(got[fn], expected[fn])
+
+
+def test_pool_chunks_stage2_rewards(pool):
+    kwargs = stage3_kwargs(5)
+    for fn in stage2_rewards.ELEMENTWISE_REWARD_FUNCS:
+        futures = {fn: pool.submit(fn, **kwargs)}
+        assert len(futures[fn]) == 3
+        assert pool.collect(futures)[fn] == fn(**kwargs, logging=False)
+
+
+def slow_in_worker_reward_func(completions, **kwargs):
+    if multiprocessing.parent_process() is not None:
+        time.sleep(5)
+    return [float(len(c[0]["content"])) for c in completions]
+
+
+def test_pool_timeout_falls_back_to_in_process():
+    pool = RewardPool(1, chunk_size=4, timeout=0.5)
+    try:
+        kwargs = stage3_kwargs()
+        engine = RewardEngine(
+            [slow_in_worker_reward_func],
+            [slow_in_worker_reward_func],
+            pool=pool,
+            pooled_funcs=[slow_in_worker_reward_func],
+        )
+        assert engine.total(**kwargs).tolist() == slow_in_worker_reward_func(**kwargs)
+    finally:
+        pool.shutdown()
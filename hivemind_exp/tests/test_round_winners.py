@@ -2,7 +2,8 @@ import pytest
 from unittest.mock import MagicMock, patch
 from collections import defaultdict
 
-from hivemind_exp.gsm8k.stage_utils import gsm8k_stage_data
+from hivemind_exp.gsm8k.score_cache import SCORE_CACHE
+from hivemind_exp.gsm8k.stages import gsm8k_stage_data
 from hivemind_exp.dht_utils import HivemindNode
 from hivemind_exp.tests.fake_data import CK, QUESTION, SAMPLES
 
@@ -25,7 +26,7 @@ def mock_dht():
 def mock_merged_prev_stage_datasets():
     # Create a mock for the merged_prev_stage_datasets function
     # This will be used to inject test data for the round_winners function
-    with patch("hivemind_exp.gsm8k.stage_utils.merged_prev_stage_datasets") as mock:
+    with patch("hivemind_exp.gsm8k.stages.merged_prev_stage_datasets") as mock:
         # Define what the mock should return
         final_stage_outputs = [
             {
@@ -106,7 +107,7 @@ def test_round_winners_empty_outputs(mock_dht, mock_node):
     """Test round_winners function when there are no outputs."""
 
     # Create a mock that returns empty outputs
-    with patch("hivemind_exp.gsm8k.stage_utils.merged_prev_stage_datasets") as mock:
+    with patch("hivemind_exp.gsm8k.stages.merged_prev_stage_datasets") as mock:
         mock.return_value = ([], [])
 
         # Create the stage data with our mocked objects
@@ -145,3 +146,52 @@ def test_round_winners_with_custom_limit(
 
     # Verify the limit is respected
     assert len(winners) <= 3
+
+
+def test_round_winners_scores_once_per_round(
+    mock_dht, mock_node, mock_merged_prev_stage_datasets
+):
+    """Repeated calls within a round reuse fetched outputs and scores."""
+    SCORE_CACHE.scores.clear()
+    stage_data = gsm8k_stage_data(
+        mock_dht, mock_node, SAMPLES, SAMPLES, check_interval=0.1
+    )
+
+    with patch(
+        "hivemind_exp.gsm8k.stage3_rewards.cumulative_reward",
+        side_effect=lambda prompts, completions, answer: [1.0] * len(completions),
+    ) as mock_reward:
+        winners = stage_data.round_winner_fn()
+        assert stage_data.round_winner_fn() == winners
+        assert set(winners[:2]) == {"node1", "node2"}
+
+        mock_merged_prev_stage_datasets.assert_called_once()
+        # One batched call per distinct prompt.
+        assert mock_reward.call_count == 2
+
+        # A new round triggers a new fetch.
+        mock_node.round_num = 1
+        stage_data.round_winner_fn()
+        assert mock_merged_prev_stage_datasets.call_count == 2
+        assert mock_reward.call_count == 4
+
+
+def test_round_winners_gold_answers(mock_dht, mock_node):
+    from hivemind_exp.gsm8k.gold_answers import GoldAnswerIndex
+
+    # Neither output carries an answer; only node2's final answer is right.
+    outputs = {
+        key: {
+            "question": QUESTION,
+            "stage3_prompt": "Test prompt for stage 3",
+            "final_agent_decision": {key: f"<answer>\n{a}\n</answer>"},
+        }
+        for key, a in (("node1", "41"), ("node2", "42"))
+    }
+    gold = GoldAnswerIndex.build([QUESTION], ["42"])
+    with patch("hivemind_exp.gsm8k.stages.merged_prev_stage_datasets") as mock:
+        mock.return_value = ([outputs], [outputs])
+        stage_data = gsm8k_stage_data(
+            mock_dht, mock_node, SAMPLES, SAMPLES, gold_answers=gold
+        )
+        assert stage_data.round_winner_fn(limit=1) == ["node2"]
@@ -0,0 +1,71 @@
+import os
+import threading
+
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+from hivemind_exp.gsm8k.sample_logger import SampleLogger
+
+
+def test_sample_logger_writes_in_background(tmp_path):
+    sample_logger = SampleLogger(str(tmp_path), rate=1.0)
+    assert sample_logger.should_log()
+    for i in range(3):
+        sample_logger.log("samples", "a.txt", f"\nrecord {i}")
+    sample_logger.log("samples", "b.txt", "\nother")
+    sample_logger.flush()
+
+    with open(tmp_path / "samples" / "a.txt") as f:
+        assert f.read() == "".join(f"{'-' * 20}\nrecord {i}" for i in range(3))
+    assert (tmp_path / "samples" / "b.txt").exists()
+    assert not SampleLogger(str(tmp_path), rate=0.0).should_log()
+
+
+def test_sample_logger_rotates(tmp_path):
+    sample_logger = SampleLogger(str(tmp_path), rate=1.0, max_bytes=100, backups=2)
+    for i in range(10):
+        sample_logger.log("samples", "a.txt", "x" * 30)
+        sample_logger.flush()
+
+    path = tmp_path / "samples" / "a.txt"
+    assert sorted(os.listdir(path.parent)) == ["a.txt", "a.txt.1", "a.txt.2"]
+    for p in (path, f"{path}.1", f"{path}.2"):
+        assert os.path.getsize(p) <= 100
+
+
+def test_reward_func_enqueues_sample(tmp_path, monkeypatch):
+    sample_logger = SampleLogger(str(tmp_path), rate=1.0)
+    monkeypatch.setattr(stage2_rewards, "SAMPLE_LOGGER", sample_logger)
+    completions = [[{"content": "<compare>\nx\n</compare>\n"}]]
+    assert stage2_rewards.strict_format_reward_func(completions) == [0.0]
+    sample_logger.flush()
+
+    (subdir,) = os.listdir(tmp_path)
+    with open(tmp_path / subdir / "s2_strict_format_samps.txt") as f:
+        assert "Matches? False" in f.read()
+
+
+def test_sample_logger_survives_write_errors(tmp_path, monkeypatch):
+    sample_logger = SampleLogger(str(tmp_path), rate=1.0)
+    write = sample_logger._write
+
+    def failing_write(path, data):
+        if "bad" in data:
+            raise ValueError("unencodable")
+        write(path, data)
+
+    monkeypatch.setattr(sample_logger, "_write", failing_write)
+    sample_logger.log("samples", "bad.txt", "\nbad")
+    assert sample_logger.flush()
+    sample_logger.log("samples", "a.txt", "\ngood")
+    assert sample_logger.flush()
+    assert sample_logger._thread.is_alive()
+    assert (tmp_path / "samples" / "a.txt").read_text() == "-" * 20 + "\ngood"
+
+
+def test_sample_logger_flush_times_out(tmp_path, monkeypatch):
+    sample_logger = SampleLogger(str(tmp_path), rate=1.0)
+    release = threading.Event()
+    monkeypatch.setattr(sample_logger, "_write", lambda path, data: release.wait())
+    sample_logger.log("samples", "a.txt", "\nstuck")
+    assert not sample_logger.flush(timeout=0.1)
+    release.set()
+    assert sample_logger.flush()
@@ -0,0 +1,48 @@
+import copy
+
+from hivemind_exp.gsm8k.generate_prompts import agent_entries, pick_k_answers
+from hivemind_exp.gsm8k.score_cache import ScoreCache, SCORE_CACHE
+from hivemind_exp.tests.fake_data import STAGE_1_MERGED
+
+
+def test_score_cache():
+    cache = ScoreCache()
+    calls = []
+
+    def score_fn(batch):
+        calls.append(batch)
+        return [float(len(t)) for t in batch]
+
+    cache.start_round(0)
+    assert cache.get_scores("s", "q", "a", ["x", "yy", "x"], score_fn) == [1, 2, 1]
+    assert cache.get_scores("s", "q", "a", ["yy", "zzz"], score_fn) == [2, 3]
+    assert calls == [["x", "yy"], ["zzz"]]
+
+    # Different scoring kinds / prompts don't share entries.
+    cache.get_scores("t", "q", "a", ["x"], score_fn)
+    cache.get_scores("s", "q2", "a", ["x"], score_fn)
+    assert len(calls) == 4
+
+    cache.start_round(0)
+    cache.get_scores("s", "q", "a", ["x"], score_fn)
+    assert len(calls) == 4
+
+    cache.start_round(1)
+    cache.get_scores("s", "q", "a", ["x"], score_fn)
+    assert len(calls) == 5
+
+
+def test_pick_k_answers_top_k():
+    SCORE_CACHE.scores.clear()
+    datum = copy.deepcopy(STAGE_1_MERGED)
+    answers = datum["agent_answers"]
+    datum["agent_answers"] = agent_entries(answers)
+
+    picked = pick_k_answers(datum, 2, default_k=2)
+    assert len(picked) == 2
+    assert all(answers[a] == t for a, t in picked.items())
+    assert len(SCORE_CACHE.scores) == len(set(answers.values()))
+
+    # Scores are reused, selection is unchanged.
+    assert pick_k_answers(datum, 2, default_k=2) == picked
+    assert pick_k_answers(datum, 2, default_k=len(answers)).keys() == answers.keys()
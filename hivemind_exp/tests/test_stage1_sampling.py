@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+from datasets import Dataset
+
+from hivemind_exp.gsm8k.stage1_sampling import (
+    peer_shards,
+    question_hashes,
+    shard_indices,
+)
+
+
+def make_q_hashes(n=2000):
+    return question_hashes(Dataset.from_dict({"question": [f"q{i}" for i in range(n)]}))
+
+
+def test_peer_shards():
+    assert peer_shards("peer0", 0, 8, 2) == peer_shards("peer0", 0, 8, 2)
+    assert len(peer_shards("peer0", 0, 8, 2)) == 2
+    assert peer_shards("peer0", 0, 2, 5) == [0, 1]
+    # Windows rotate every round, so a peer sweeps every shard over time.
+    assert set().union(*(peer_shards("peer0", r, 8, 2) for r in range(4))) == set(
+        range(8)
+    )
+
+
+@pytest.mark.parametrize(
+    "num_peers,num_shards,overlap",
+    [(4, 8, 2), (3, 8, 3), (8, 8, 1), (5, 16, 4), (20, 8, 2)],
+)
+def test_peer_shards_coverage(num_peers, num_shards, overlap):
+    peers = [f"peer{i}" for i in range(num_peers)]
+    for r in range(3):
+        shards = [peer_shards(p, r, num_shards, overlap, peers) for p in peers]
+        # Every shard is covered every round, about equally often.
+        counts = np.bincount(sum(shards, []), minlength=num_shards)
+        assert counts.min() >= 1
+        assert counts.max() - counts.min() <= max(1, overlap * num_peers // num_shards)
+
+    # Peers missing from the list fall back to key-derived windows.
+    assert peer_shards("other", 0, num_shards, overlap, peers) == peer_shards(
+        "other", 0, num_shards, overlap
+    )
+
+
+def test_shard_indices():
+    q_hashes = make_q_hashes()
+    indices = shard_indices(q_hashes, "peer0", 0, num_shards=8, overlap=2)
+    assert np.array_equal(indices, shard_indices(q_hashes, "peer0", 0, 8, 2))
+    # ~2/8 of the questions.
+    assert 0.15 < len(indices) / len(q_hashes) < 0.35
+
+    # Questions move between rounds.
+    assert not np.array_equal(indices, shard_indices(q_hashes, "peer0", 1, 8, 2))
+
+
+def test_shard_indices_coverage():
+    q_hashes = make_q_hashes()
+    counts = np.zeros(len(q_hashes), dtype=int)
+    for peer in (f"peer{i}" for i in range(8)):
+        counts[shard_indices(q_hashes, peer, 0, num_shards=8, overlap=3)] += 1
+
+    # Each peer only sees 3/8 of the data, yet most questions get several answers.
+    assert counts.sum() < 0.5 * 8 * len(q_hashes)
+    assert (counts >= 2).mean() > 0.5
+
+
+def test_gsm8k_stage_data_sharding():
+    from unittest.mock import MagicMock
+
+    from hivemind_exp.gsm8k.stages import gsm8k_stage_data
+
+    node = MagicMock()
+    node.key = "peer0"
+    dataset = Dataset.from_dict({"question": [f"q{i}" for i in range(200)]})
+    stage = gsm8k_stage_data(MagicMock(), node, dataset, dataset, num_shards=4).stages[0]
+
+    train, test = stage.datasets_fn(0, 0)
+    assert 0 < len(train) < len(dataset)
+    assert test is dataset
+
+    unsharded = gsm8k_stage_data(MagicMock(), node, dataset, dataset).stages[0]
+    assert unsharded.datasets_fn(0, 0)[0] is dataset
+
+    curriculum = gsm8k_stage_data(
+        MagicMock(), node, dataset, dataset, num_shards=4, curriculum=True
+    ).stages[0]
+    assert len(curriculum.datasets_fn(0, 0)[0]) == len(train)
+
+
+def test_gsm8k_stage_data_sharding_coverage():
+    from unittest.mock import MagicMock, patch
+
+    from hivemind_exp.gsm8k.stages import gsm8k_stage_data
+
+    # Last round's stage 1 rewards name the swarm's peers.
+    peers = [f"peer{i}" for i in range(4)]
+    dataset = Dataset.from_dict({"question": [f"q{i}" for i in range(200)]})
+    questions = set()
+    with patch(
+        "hivemind_exp.gsm8k.stages.get_dht_value",
+        return_value={p: 1.0 for p in peers},
+    ):
+        for peer in peers:
+            node = MagicMock()
+            node.key = peer
+            stage = gsm8k_stage_data(
+                MagicMock(), node, dataset, dataset, num_shards=8, shard_overlap=2
+            ).stages[0]
+            questions |= set(stage.datasets_fn(1, 0)[0]["question"])
+    assert questions == set(dataset["question"])
+
+
+def completion(text):
+    return [{"role": "assistant", "content": text}]
+
+
+def test_curriculum_sampler():
+    from hivemind_exp.gsm8k.stage1_sampling import CurriculumSampler
+
+    questions = ["easy", "hard", "zone", "new"]
+    sampler = CurriculumSampler(
+        question_hashes(Dataset.from_dict({"question": questions}))
+    )
+    right, wrong = "<answer>\n1\n</answer>", "<answer>\n2\n</answer>"
+
+    # Own stage 1 groups.
+    prompts = [[{"role": "user", "content": "easy"}]] * 4 + [
+        [{"role": "user", "content": "hard"}]
+    ] * 4
+    completions = [completion(right)] * 4 + [completion(wrong)] * 4
+    sampler.observe_completions(prompts, completions, ["1"] * 8)
+
+    # Merged swarm outputs.
+    sampler.observe_merged(
+        [
+            {"question": "zone", "answer": "1", "agent_answers": {"a": right, "b": wrong}},
+            {"question": "hard", "answer": "1", "agent_answers": {"a": wrong}},
+            {"question": None, "answer": None, "agent_answers": {}},
+        ]
+    )
+    assert sampler.attempts.tolist() == [4, 5, 2, 0]
+    assert sampler.correct.tolist() == [4, 0, 1, 0]
+
+    indices = np.arange(4)
+    weights = sampler.weights(indices)
+    assert weights[0] == 0  # Mastered.
+    assert weights[2] == weights[3] > weights[1] > 0
+
+    sampled = sampler.sample(indices, np.random.default_rng(0))
+    assert len(sampled) == 4 and 0 not in sampled
+
+    # Everything mastered: keep the original rows.
+    assert np.array_equal(sampler.sample(np.array([0]), np.random.default_rng(0)), [0])
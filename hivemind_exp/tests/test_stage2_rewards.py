@@ -3,6 +3,7 @@ import re
 import numpy as np
 from unittest.mock import patch, MagicMock
 
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
 from hivemind_exp.gsm8k.stage2_rewards import (
     extract_xml_identity,
     extract_xml_ids,
@@ -14,7 +15,7 @@ from hivemind_exp.gsm8k.stage2_rewards import (
     strict_format_reward_func,
     soft_format_reward_func,
     xmlcount_reward_func,
-    top_k_cumulative_reward,
+    cumulative_reward,
     hivemind_cumulative_reward,
 )
 from hivemind_exp.hivemind_utils import HivemindNode
@@ -357,116 +358,52 @@ Which student's answer is correct? Analyze each answer carefully."""
             self.assertGreater(rewards[2], 0.0)
             self.assertLess(rewards[2], rewards[0])
 
-    def test_top_k_cumulative_reward(self):
-        """Test the top_k_cumulative_reward function"""
-        # Patch individual reward functions to return known values
-        with (
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.proper_id_reward_func"
-            ) as mock_proper_id,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.correctness_reward_func"
-            ) as mock_correctness,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.strict_format_reward_func"
-            ) as mock_strict,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.soft_format_reward_func"
-            ) as mock_soft,
-            patch("hivemind_exp.gsm8k.stage2_rewards.xmlcount_reward_func") as mock_xml,
-        ):
-            # Set return values for mocked functions
-            mock_proper_id.return_value = [2.0, 0.0, 2.0]
-            mock_correctness.return_value = [2.5, 0.0, 0.0]
-            mock_strict.return_value = [0.5, 0.0, 0.0]
-            mock_soft.return_value = [0.0, 0.5, 0.0]
-            mock_xml.return_value = [0.5, 0.0, 0.3]
-
-            # Calculate cumulative rewards
-            rewards = top_k_cumulative_reward(
-                self.mock_prompts,
-                self.mock_completions,
-                self.mock_answer,
-                logging=False,
+    def known_rewards(self):
+        """Stand in reward functions with known values for the engine to sum"""
+        self.reward_funcs = tuple(
+            MagicMock(return_value=rewards)
+            for rewards in (
+            [2.0, 0.0, 2.0],  # proper id
+            [2.5, 0.0, 0.0],  # correctness
+            [0.5, 0.0, 0.0],  # strict format
+            [0.0, 0.5, 0.0],  # soft format
+            [0.5, 0.0, 0.3],  # xmlcount
             )
+        )
+        return patch.multiple(
+            stage2_rewards,
+            REWARD_FUNCS=self.reward_funcs,
+            CUMULATIVE_REWARD_FUNCS=self.reward_funcs,
+            BATCH_REWARD_FUNCS={},
+            REWARD_GUARDS={},
+        )
 
-            # Check that rewards are summed correctly
-            self.assertEqual(rewards[0], 5.5)  # 2.0 + 2.5 + 0.5 + 0.0 + 0.5
-            self.assertEqual(rewards[1], 0.5)  # 0.0 + 0.0 + 0.0 + 0.5 + 0.0
-            self.assertEqual(rewards[2], 2.3)  # 2.0 + 0.0 + 0.0 + 0.0 + 0.3
+    def test_cumulative_reward(self):
+        """Test that cumulative_reward sums every reward function"""
+        with self.known_rewards():
+            rewards = cumulative_reward(
+                self.mock_prompts, self.mock_completions, self.mock_answer
+            )
+        np.testing.assert_allclose(rewards, [5.5, 0.5, 2.3], rtol=1e-6)
+        # A single-element answer list reaches every function as is.
+        for fn in self.reward_funcs:
+            self.assertEqual(fn.call_args.kwargs["answer"], ["42"])
 
     def test_hivemind_cumulative_reward(self):
         """Test the hivemind_cumulative_reward function"""
-        # Create mock node
-        mock_node = MagicMock(spec=HivemindNode)
-        mock_node.key = "test_node"
-
-        # Patch individual reward functions to return known values
-        with (
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.proper_id_reward_func"
-            ) as mock_proper_id,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.correctness_reward_func"
-            ) as mock_correctness,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.strict_format_reward_func"
-            ) as mock_strict,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.soft_format_reward_func"
-            ) as mock_soft,
-            patch("hivemind_exp.gsm8k.stage2_rewards.xmlcount_reward_func") as mock_xml,
-            patch(
-                "hivemind_exp.gsm8k.stage2_rewards.extract_original_question"
-            ) as mock_extract,
-        ):
-            # Set return values for mocked functions
-            mock_proper_id.return_value = [2.0, 0.0, 2.0]
-            mock_correctness.return_value = [2.5, 0.0, 0.0]
-            mock_strict.return_value = [0.5, 0.0, 0.0]
-            mock_soft.return_value = [0.0, 0.5, 0.0]
-            mock_xml.return_value = [0.5, 0.0, 0.3]
-            mock_extract.return_value = "What is 6 times 7?"
-
-            # Test with max selector
+        node = MagicMock(spec=HivemindNode)
+        node.key = "test_node"
+        with self.known_rewards():
             rewards = hivemind_cumulative_reward(
-                mock_node,
-                self.mock_prompts,
-                self.mock_completions,
-                self.mock_answer,
-                output_signal_selector="max",
-                logging=False,
-            )
-
-            # Check that the function returns zeros (as expected)
-            self.assertEqual(rewards, [0.0, 0.0, 0.0])
-
-            # Check that node.outputs and node.rewards are set correctly
-            self.assertEqual(mock_node.rewards, [5.5, 0.5, 2.3])
-            self.assertIsNotNone(mock_node.outputs)
-            self.assertEqual(
-                mock_node.outputs["agent_opinion"][mock_node.key], self.sample_text_good
-            )
-            self.assertEqual(mock_node.outputs["question"], "What is 6 times 7?")
-            self.assertEqual(mock_node.outputs["answer"], "42")
-
-            # Test with None selector
-            # The implementation only sets node.outputs and node.rewards when output_signal_selector is not None
-            mock_node = MagicMock(spec=HivemindNode)
-            mock_node.key = "test_node"
-
-            rewards = hivemind_cumulative_reward(
-                mock_node,
-                self.mock_prompts,
-                self.mock_completions,
-                self.mock_answer,
-                output_signal_selector=None,
-                logging=False,
+                node, self.mock_prompts, self.mock_completions, self.mock_answer
             )
 
-            # Check that node.outputs and node.rewards are not set when output_signal_selector is None
-            self.assertFalse(hasattr(mock_node, "outputs"))
-            self.assertFalse(hasattr(mock_node, "rewards"))
+        # Returns zeros; the total reward and best output are saved to the node.
+        self.assertEqual(rewards, [0.0, 0.0, 0.0])
+        np.testing.assert_allclose(node.rewards, [5.5, 0.5, 2.3], rtol=1e-6)
+        self.assertEqual(node.outputs["agent_opinion"][node.key], self.sample_text_good)
+        self.assertEqual(node.outputs["question"], "What is 6 times 7?")
+        self.assertEqual(node.outputs["answer"], "42")
 
 
 if __name__ == "__main__":
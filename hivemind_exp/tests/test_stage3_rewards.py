@@ -3,6 +3,7 @@ import re
 import numpy as np
 from unittest.mock import patch, MagicMock
 
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
 from hivemind_exp.gsm8k.stage3_rewards import (
     extract_xml_identity,
     extract_xml_final_answer,
@@ -13,6 +14,8 @@ from hivemind_exp.gsm8k.stage3_rewards import (
     extract_answers,
     count_xml,
     swarm_majority,
+    question_similarity,
+    MAX_SIMILARITY_CHARS,
     consensus_reward_func,
     question_recreation_reward_func,
     concensus_correctness_reward_func,
@@ -20,6 +23,7 @@ from hivemind_exp.gsm8k.stage3_rewards import (
     strict_format_reward_func,
     soft_format_reward_func,
     xmlcount_reward_func,
+    cumulative_reward,
     hivemind_cumulative_reward,
 )
 from hivemind_exp.hivemind_utils import HivemindNode
@@ -335,12 +339,36 @@ Please summarize the feedback, identify the majority opinion, restate the origin
             self.assertGreater(rewards2[0], 0.0)
             self.assertLess(rewards2[0], 1.0)
 
-            # Different question might still get a moderate reward due to SequenceMatcher behavior
-            # The actual implementation uses SequenceMatcher(None, r, q).ratio() which can give
-            # higher scores than expected for short strings
+            # Different question might still get a moderate reward, since short
+            # questions share many character n-grams
             # So we just check that it's less than the exact match
             self.assertLess(rewards3[0], rewards1[0])
 
+    def test_question_similarity(self):
+        """Test question_similarity against difflib's ratio"""
+        from difflib import SequenceMatcher
+
+        q = "Weng earns $12 an hour for babysitting. Yesterday, she just did 50 minutes of babysitting. How much did she earn?"
+        self.assertEqual(question_similarity(q, q), 1.0)
+        self.assertEqual(question_similarity("", ""), 1.0)
+        self.assertEqual(question_similarity("", q), 0.0)
+        self.assertEqual(question_similarity("a", "b"), 0.0)
+
+        for r in [
+            q.lower(),
+            q.replace("Yesterday, she", "She"),
+            q[: len(q) // 2],
+            "How many pages does he write a year?",
+        ]:
+            self.assertAlmostEqual(
+                question_similarity(r, q), SequenceMatcher(None, r, q).ratio(), delta=0.15
+            )
+
+        # Long recreations are capped but still scored against their full length.
+        runaway = q * 1000
+        self.assertGreater(len(runaway), MAX_SIMILARITY_CHARS)
+        self.assertLess(question_similarity(runaway, q), 2 * len(q) / len(runaway))
+
     def test_concensus_correctness_reward_func(self):
         """Test the concensus_correctness_reward_func function"""
         # Simplify the test to focus on basic functionality without comparing exact reward values
@@ -531,104 +559,63 @@ Please summarize the feedback, identify the majority opinion, restate the origin
             self.assertGreater(rewards[2], 0.0)
             self.assertLess(rewards[2], rewards[0])
 
-    def test_hivemind_cumulative_reward(self):
-        """Test the hivemind_cumulative_reward function"""
-        # Create mock node
-        mock_node = MagicMock(spec=HivemindNode)
-        mock_node.key = "test_node"
-
-        # Patch individual reward functions to return known values
-        with (
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.consensus_reward_func"
-            ) as mock_consensus,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.concensus_correctness_reward_func"
-            ) as mock_correctness,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.question_recreation_reward_func"
-            ) as mock_question,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.final_correctness_reward_func"
-            ) as mock_final,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.strict_format_reward_func"
-            ) as mock_strict,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.soft_format_reward_func"
-            ) as mock_soft,
-            patch("hivemind_exp.gsm8k.stage3_rewards.xmlcount_reward_func") as mock_xml,
-            patch(
-                "hivemind_exp.gsm8k.stage3_rewards.extract_original_question"
-            ) as mock_extract,
-        ):
-            # Set return values for mocked functions
-            mock_consensus.return_value = [2.0, 0.0, 2.0]
-            mock_correctness.return_value = [2.5, 0.0, 0.0]
-            mock_question.return_value = [1.0, 0.5, 0.8]
-            mock_final.return_value = [2.0, 0.0, 0.0]
-            mock_strict.return_value = [0.5, 0.0, 0.0]
-            mock_soft.return_value = [0.0, 0.5, 0.0]
-            mock_xml.return_value = [1.0, 0.0, 0.7]
-            mock_extract.return_value = "What is 6 times 7?"
-
-            # Test with max selector
-            rewards = hivemind_cumulative_reward(
-                mock_node,
-                self.mock_prompts,
-                self.mock_completions,
-                self.mock_answer,
-                output_signal_selector="max",
-                logging=False,
+    def known_rewards(self):
+        """Stand in reward functions with known values for the engine to sum"""
+        self.reward_funcs = tuple(
+            MagicMock(return_value=rewards)
+            for rewards in (
+            [2.0, 0.0, 2.0],  # consensus
+            [2.5, 0.0, 0.0],  # consensus correctness
+            [1.0, 0.5, 0.8],  # question recreation
+            [2.0, 0.0, 0.0],  # final correctness
+            [0.5, 0.0, 0.0],  # strict format
+            [0.0, 0.5, 0.0],  # soft format
+            [1.0, 0.0, 0.7],  # xmlcount
             )
+        )
+        return patch.multiple(
+            stage3_rewards,
+            REWARD_FUNCS=self.reward_funcs,
+            CUMULATIVE_REWARD_FUNCS=self.reward_funcs,
+            BATCH_REWARD_FUNCS={},
+            REWARD_GUARDS={},
+        )
 
-            # Check that the function returns zeros (as expected)
-            self.assertEqual(rewards, [0.0, 0.0, 0.0])
-
-            # Check that node.outputs and node.rewards are set correctly
-            self.assertEqual(mock_node.rewards, [9.0, 1.0, 3.5])
-            self.assertIsNotNone(mock_node.outputs)
-            self.assertEqual(
-                mock_node.outputs["final_agent_decision"][mock_node.key],
-                self.sample_text_good,
+    def test_cumulative_reward(self):
+        """Test that cumulative_reward sums every reward function"""
+        with self.known_rewards():
+            rewards = cumulative_reward(
+                self.mock_prompts, self.mock_completions, self.mock_answer
             )
-            self.assertEqual(mock_node.outputs["question"], "What is 6 times 7?")
-            self.assertEqual(mock_node.outputs["answer"], "42")
-
-            # Test with None selector
-            # The implementation only sets node.outputs and node.rewards when output_signal_selector is not None
-            mock_node = MagicMock(spec=HivemindNode)
-            mock_node.key = "test_node"
+        np.testing.assert_allclose(rewards, [9.0, 1.0, 3.5], rtol=1e-6)
+        # A single-element answer list reaches every function as is.
+        for fn in self.reward_funcs:
+            self.assertEqual(fn.call_args.kwargs["answer"], ["42"])
 
+    def test_hivemind_cumulative_reward(self):
+        """Test the hivemind_cumulative_reward function"""
+        node = MagicMock(spec=HivemindNode)
+        node.key = "test_node"
+        with self.known_rewards():
             rewards = hivemind_cumulative_reward(
-                mock_node,
-                self.mock_prompts,
-                self.mock_completions,
-                self.mock_answer,
-                output_signal_selector=None,
-                logging=False,
+                node, self.mock_prompts, self.mock_completions, self.mock_answer
             )
 
-            # Check that node.outputs and node.rewards are not set when output_signal_selector is None
-            self.assertFalse(hasattr(mock_node, "outputs"))
-            self.assertFalse(hasattr(mock_node, "rewards"))
-
-            # Test with empty answer
-            mock_node = MagicMock(spec=HivemindNode)
-            mock_node.key = "test_node"
-
-            rewards_empty = hivemind_cumulative_reward(
-                mock_node,
-                self.mock_prompts,
-                self.mock_completions,
-                [],
-                output_signal_selector="max",
-                logging=False,
-            )
-
-            # Check that the function handles empty answer gracefully
-            self.assertEqual(rewards_empty, [0.0, 0.0, 0.0])
-            self.assertEqual(mock_node.outputs["answer"], "Unknown")
+        # Returns zeros; the total reward and best output are saved to the node.
+        self.assertEqual(rewards, [0.0, 0.0, 0.0])
+        np.testing.assert_allclose(node.rewards, [9.0, 1.0, 3.5], rtol=1e-6)
+        self.assertEqual(
+            node.outputs["final_agent_decision"][node.key], self.sample_text_good
+        )
+        self.assertEqual(node.outputs["question"], "What is 6 times 7?")
+        self.assertEqual(node.outputs["answer"], "42")
+
+        # Missing answers are reported as such.
+        node = MagicMock(spec=HivemindNode)
+        node.key = "test_node"
+        with self.known_rewards():
+            hivemind_cumulative_reward(node, self.mock_prompts, self.mock_completions, [])
+        self.assertEqual(node.outputs["answer"], "Unknown")
 
 
 if __name__ == "__main__":
@@ -41,8 +41,8 @@ def test_merge_stage1_with_malformed_input():
     assert "agent_answers" in merged
 
     # Verify malformed agents were skipped (their data not in merged result)
-    assert merged["agent_answers"][malformed_agent_id] == "No answer received..."
-    assert merged["agent_answers"][malformed_agent_id2] == "No answer received..."
+    assert malformed_agent_id not in merged["agent_answers"]
+    assert malformed_agent_id2 not in merged["agent_answers"]
 
     # Verify good agents' data is still present
     for agent_id in STAGE_1_OUTPUTS.keys():
@@ -80,8 +80,8 @@ def test_merge_stage2_with_malformed_input():
     assert "agent_opinion" in merged
 
     # Verify malformed agents were skipped (their opinions not in merged result)
-    assert merged["agent_opinion"][malformed_agent_id] == "No feedback received..."
-    assert merged["agent_opinion"][malformed_agent_id2] == "No feedback received..."
+    assert malformed_agent_id not in merged["agent_opinion"]
+    assert malformed_agent_id2 not in merged["agent_opinion"]
 
     # Verify good agents' data is still present
     for agent_id in STAGE_2_OUTPUTS.keys():
@@ -107,3 +107,20 @@ def test_merge_stage2_with_empty_outputs():
     assert "answer" in merged and merged["answer"] is None
     assert "stage2_prompt" in merged and merged["stage2_prompt"] is None
     assert "agent_opinion" in merged and merged["agent_opinion"] == {}
+
+
+def test_merge_without_answers_uses_gold_answers():
+    from hivemind_exp.gsm8k.gold_answers import GoldAnswerIndex
+
+    gold = GoldAnswerIndex.build([STAGE_1_MERGED["question"]], ["95"])
+    for merge_fn, outputs, expected in (
+        (merge_stage1_question, STAGE_1_OUTPUTS, STAGE_1_MERGED),
+        (merge_stage2_question, STAGE_2_OUTPUTS, STAGE_2_MERGED),
+    ):
+        # Outputs from nodes that don't publish answers.
+        stripped = deepcopy(outputs)
+        for o in stripped.values():
+            del o["answer"]
+
+        assert merge_fn(stripped)["answer"] is None
+        assert merge_fn(stripped, gold_answers=gold) == expected
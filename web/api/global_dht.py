@@ -1,5 +1,3 @@
-import multiprocessing
-
 import hivemind
 
 from . import server_cache
@@ -10,7 +8,7 @@ dht: hivemind.DHT | None = None
 dht_cache: server_cache.Cache | None = None
 
 
-def setup_global_dht(initial_peers, coordinator, logger, kinesis_client):
+def setup_global_dht(initial_peers, coordinator, logger, kinesis_client=None):
     global dht
     global dht_cache
     dht = hivemind.DHT(
@@ -21,6 +19,4 @@ def setup_global_dht(initial_peers, coordinator, logger, kinesis_client):
         cache_size=2000,
         client_mode=True,
     )
-    dht_cache = server_cache.Cache(
-        dht, coordinator, multiprocessing.Manager(), logger, kinesis_client
-    )
+    dht_cache = server_cache.Cache(dht, coordinator, logger, kinesis_client)
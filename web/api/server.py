@@ -121,8 +121,8 @@ def get_round_and_stage():
 
 @app.get("/api/leaderboard")
 def get_leaderboard():
-    leaderboard = global_dht.dht_cache.get_leaderboard()
-    res = dict(leaderboard)
+    # Snapshots are never mutated, so handlers read them without copying.
+    res = global_dht.dht_cache.get_leaderboard()
 
     if res is not None:
         return {
@@ -133,8 +133,7 @@ def get_leaderboard():
 
 @app.get("/api/leaderboard-cumulative")
 def get_leaderboard_cumulative():
-    leaderboard = global_dht.dht_cache.get_leaderboard_cumulative()
-    res = dict(leaderboard)
+    res = global_dht.dht_cache.get_leaderboard_cumulative()
 
     if res is not None:
         return {
@@ -150,8 +149,7 @@ def get_leaderboard_cumulative():
 
 @app.get("/api/rewards-history")
 def get_rewards_history():
-    leaderboard = global_dht.dht_cache.get_leaderboard()
-    res = dict(leaderboard)
+    res = global_dht.dht_cache.get_leaderboard()
 
     if res is not None:
         return {
@@ -162,7 +160,7 @@ def get_rewards_history():
 @app.get("/api/name-to-id")
 def get_id_from_name(name: str = Query("")):
     leaderboard = global_dht.dht_cache.get_leaderboard()
-    leader_ids = [leader["id"] for leader in leaderboard["leaders"]] or []
+    leader_ids = [leader["id"] for leader in leaderboard.get("leaders", [])]
 
     peer_id = search_peer_ids_for_name(leader_ids, name)
     return {
@@ -212,8 +210,7 @@ async def id_to_name(request: Request):
 
 @app.get("/api/gossip")
 def get_gossip():
-    gs = global_dht.dht_cache.get_gossips()
-    return dict(gs)
+    return global_dht.dht_cache.get_gossips()
 
 
 if os.getenv("API_ENV") != "dev":
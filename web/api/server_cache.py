@@ -1,7 +1,10 @@
+import dataclasses
 import hashlib
 import itertools
 import random
+import threading
 from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 
 from hivemind_exp.dht_utils import *
@@ -17,75 +20,102 @@ from .kinesis import (
 )
 
 
+@dataclass(frozen=True)
+class CacheSnapshot:
+    """
+    Everything the API serves, as of one DHT poll. The poller builds a new
+    snapshot per poll and never mutates one it has published, so readers can
+    use its dicts without copying.
+    """
+
+    round: int = -1
+    stage: int = -1
+    leaderboard: dict = field(default_factory=dict)
+    leaderboard_v2: dict = field(default_factory=dict)  # Cumulative rewards.
+    rewards_history: dict = field(default_factory=dict)
+    gossips: dict = field(default_factory=dict)
+    last_polled: datetime | None = None
+
+
 class Cache:
-    def __init__(self, dht, coordinator, manager, logger, kinesis_client):
+    """
+    DHT-backed state for the API. Readers take the current snapshot, a single
+    attribute read; the poller swaps in a new one when a poll finishes.
+    """
+
+    def __init__(self, dht, coordinator, logger, kinesis_client=None):
         self.dht = dht
         self.coordinator = coordinator
 
-        self.manager = manager
         self.logger = logger
         self.kinesis_client = kinesis_client
-        self.lock = manager.Lock()
+        # Serializes pollers only; readers never take it.
+        self.lock = threading.Lock()
         self.reset()
 
     def reset(self):
-        self.leaderboard = self.manager.dict()
-        self.leaderboard_v2 = self.manager.dict()  # Cumulative rewards leaderboard.
-
-        self.rewards_history = self.manager.dict()
-        self.gossips = self.manager.dict()
-
-        self.current_round = self.manager.Value("i", -1)
-        self.current_stage = self.manager.Value("i", -1)
-
-        self.last_polled = None
+        self.snapshot = CacheSnapshot()
 
     def get_round_and_stage(self):
-        return self.current_round.value, self.current_stage.value
+        snapshot = self.snapshot
+        return snapshot.round, snapshot.stage
 
     def get_leaderboard(self):
-        return dict(self.leaderboard)
+        return self.snapshot.leaderboard
 
     def get_leaderboard_cumulative(self):
-        return dict(self.leaderboard_v2)
+        return self.snapshot.leaderboard_v2
 
     def get_gossips(self, since_round=0):
-        return dict(self.gossips)
+        return self.snapshot.gossips
 
     def get_last_polled(self):
-        return self.last_polled
+        return self.snapshot.last_polled
 
     def poll_dht(self):
-        try:
-            self._get_round_and_stage()
-            self._get_leaderboard()
-            self._get_leaderboard_v2()
-            self._get_gossip()
-
-            with self.lock:
-                self.last_polled = datetime.now()
-        except Exception as e:
-            self.logger.error("cache failed to poll dht: %s", e)
+        with self.lock:
+            try:
+                prev = self.snapshot
+                r, s = self._get_round_and_stage(prev)
+                snapshot = dataclasses.replace(prev, round=r, stage=s)
+                # The reachable peer group, shared by every view of this poll.
+                rewards = None
+                try:
+                    rewards = self._current_rewards(r, s)
+                except Exception as e:
+                    # Keep serving the last leaderboards.
+                    self.logger.warning("could not get rewards: %s", e)
+                else:
+                    leaderboard, rewards_history = self._get_leaderboard(prev, rewards)
+                    snapshot = dataclasses.replace(
+                        snapshot,
+                        leaderboard=leaderboard,
+                        leaderboard_v2=self._get_leaderboard_v2(prev, rewards, r, s),
+                        rewards_history=rewards_history,
+                    )
+                self.snapshot = dataclasses.replace(
+                    snapshot,
+                    gossips=self._get_gossip(rewards, r, s),
+                    last_polled=datetime.now(),
+                )
+            except Exception as e:
+                self.logger.error("cache failed to poll dht: %s", e)
 
     def _get_dht_value(self, beam_size=100, **kwargs):
         return get_dht_value(self.dht, beam_size=beam_size, **kwargs)
 
-    def _get_round_and_stage(self):
+    def _get_round_and_stage(self, prev: CacheSnapshot) -> tuple[int, int]:
         try:
             r, s = self.coordinator.get_round_and_stage()
             self.logger.info(f"cache polled round and stage: r={r}, s={s}")
-            with self.lock:
-                self.current_round.value = r
-                self.current_stage.value = s
+            return r, s
         except ValueError as e:
             self.logger.warning(
                 "could not get current round or stage; default to -1: %s", e
             )
+            return prev.round, prev.stage
 
-    def _previous_round_and_stage(self):
-        r = self.current_round.value
-        s = self.current_stage.value
-
+    def _previous_round_and_stage(self, r, s):
         s -= 1
         if s < 0:
             s = 2
@@ -93,120 +123,108 @@ class Cache:
 
         return max(0, r), max(0, s)
 
-    def _current_rewards(self) -> dict[str, Any] | None:
+    def _current_rewards(self, r, s) -> dict[str, Any] | None:
         # Basically a proxy for the reachable peer group.
-        curr_round = self.current_round.value
-        curr_stage = self.current_stage.value
-        return self._get_dht_value(
-            key=rewards_key(curr_round, curr_stage), beam_size=500
-        )
+        return self._get_dht_value(key=rewards_key(r, s), beam_size=500)
 
-    def _previous_rewards(self):
+    def _previous_rewards(self, r, s):
         return self._get_dht_value(
-            key=rewards_key(*self._previous_round_and_stage()), beam_size=500
+            key=rewards_key(*self._previous_round_and_stage(r, s)), beam_size=500
         )
 
-    def _get_leaderboard_v2(self):
+    def _get_leaderboard_v2(self, prev: CacheSnapshot, rewards, curr_round, curr_stage):
         try:
-            rewards = self._current_rewards()
             if not rewards:
-                return None
-
-            curr_round = self.current_round.value
-            curr_stage = self.current_stage.value
-
-            with self.lock:
-                # Initialize or get existing leaderboard_v2
-                if "leaders" not in self.leaderboard_v2:
-                    self.leaderboard_v2 = {"leaders": []}
+                return prev.leaderboard_v2
 
-                # Create a map of existing entries for easy lookup
-                existing_entries = {
-                    entry["id"]: entry for entry in self.leaderboard_v2["leaders"]
-                }
+            # Copies of the existing entries, which belong to the published
+            # snapshot.
+            existing_entries = {
+                entry["id"]: dict(entry)
+                for entry in prev.leaderboard_v2.get("leaders", [])
+            }
 
-                # Process each peer's rewards
-                current_time = int(datetime.now().timestamp())
-                for peer_id, score in rewards.items():
-                    if peer_id not in existing_entries:
-                        # First time seeing this peer
-                        existing_entries[peer_id] = {
-                            "id": peer_id,
-                            "nickname": get_name_from_peer_id(peer_id),
-                            "recordedRound": curr_round,
-                            "recordedStage": curr_stage,
-                            "cumulativeScore": float(score),  # Initial score
-                            "lastScore": float(score),  # Track last score
-                            "scoreHistory": [
-                                {"x": current_time, "y": float(score)}
-                            ],  # Initialize history with first point
-                        }
-                    else:
-                        entry = existing_entries[peer_id]
-                        # Same round/stage - just update current score
-                        if (
-                            entry["recordedRound"] == curr_round
-                            and entry["recordedStage"] == curr_stage
-                        ):
-                            entry["cumulativeScore"] = float(score)
-                            entry["lastScore"] = float(score)  # Update last score
-                            # Update history, keeping last 30 points
-                            entry["scoreHistory"] = (
-                                entry["scoreHistory"]
-                                + [{"x": current_time, "y": float(score)}]
-                            )[-30:]
-                        # Different round/stage - add to cumulative
-                        else:
-                            entry["cumulativeScore"] += float(score)
-                            entry["lastScore"] = float(score)  # Update last score
-                            entry["recordedRound"] = curr_round
-                            entry["recordedStage"] = curr_stage
-                            # Add new score to history, keeping last 30 points
-                            entry["scoreHistory"] = (
-                                entry["scoreHistory"]
-                                + [{"x": current_time, "y": entry["cumulativeScore"]}]
-                            )[-30:]
-
-                # Remove entries that are not in the current or previous round/stage.
-                prev_round, prev_stage = self._previous_round_and_stage()
-                current_entries = {}
-                for peer_id, entry in existing_entries.items():
-                    in_current = (
+            # Process each peer's rewards
+            current_time = int(datetime.now().timestamp())
+            for peer_id, score in rewards.items():
+                if peer_id not in existing_entries:
+                    # First time seeing this peer
+                    existing_entries[peer_id] = {
+                        "id": peer_id,
+                        "nickname": get_name_from_peer_id(peer_id),
+                        "recordedRound": curr_round,
+                        "recordedStage": curr_stage,
+                        "cumulativeScore": float(score),  # Initial score
+                        "lastScore": float(score),  # Track last score
+                        "scoreHistory": [
+                            {"x": current_time, "y": float(score)}
+                        ],  # Initialize history with first point
+                    }
+                else:
+                    entry = existing_entries[peer_id]
+                    # Same round/stage - just update current score
+                    if (
                         entry["recordedRound"] == curr_round
                         and entry["recordedStage"] == curr_stage
-                    )
-                    in_prev = (
-                        entry["recordedRound"] == prev_round
-                        and entry["recordedStage"] == prev_stage
-                    )
-                    if in_current or in_prev:
-                        current_entries[peer_id] = entry
+                    ):
+                        entry["cumulativeScore"] = float(score)
+                        entry["lastScore"] = float(score)  # Update last score
+                        # Update history, keeping last 30 points
+                        entry["scoreHistory"] = (
+                            entry["scoreHistory"]
+                            + [{"x": current_time, "y": float(score)}]
+                        )[-30:]
+                    # Different round/stage - add to cumulative
                     else:
-                        self.logger.info(
-                            f"removing entry for peer {peer_id} because it is not in the current or previous round/stage"
-                        )
-
-                # Convert back to sorted list
-                sorted_leaders = sorted(
-                    current_entries.values(),
-                    key=lambda x: (x["cumulativeScore"], x["id"]),
-                    reverse=True,
+                        entry["cumulativeScore"] += float(score)
+                        entry["lastScore"] = float(score)  # Update last score
+                        entry["recordedRound"] = curr_round
+                        entry["recordedStage"] = curr_stage
+                        # Add new score to history, keeping last 30 points
+                        entry["scoreHistory"] = (
+                            entry["scoreHistory"]
+                            + [{"x": current_time, "y": entry["cumulativeScore"]}]
+                        )[-30:]
+
+            # Remove entries that are not in the current or previous round/stage.
+            prev_round, prev_stage = self._previous_round_and_stage(
+                curr_round, curr_stage
+            )
+            current_entries = {}
+            for peer_id, entry in existing_entries.items():
+                in_current = (
+                    entry["recordedRound"] == curr_round
+                    and entry["recordedStage"] == curr_stage
+                )
+                in_prev = (
+                    entry["recordedRound"] == prev_round
+                    and entry["recordedStage"] == prev_stage
                 )
+                if in_current or in_prev:
+                    current_entries[peer_id] = entry
+                else:
+                    self.logger.info(
+                        f"removing entry for peer {peer_id} because it is not in the current or previous round/stage"
+                    )
 
-                # Update leaderboard_v2
-                self.leaderboard_v2 = {
-                    "leaders": sorted_leaders,
-                    "total": len(sorted_leaders),
-                }
+            # Convert back to sorted list
+            sorted_leaders = sorted(
+                current_entries.values(),
+                key=lambda x: (x["cumulativeScore"], x["id"]),
+                reverse=True,
+            )
 
-                # Convert to RewardsMessage format and send to Kinesis
-                # self._send_rewards_to_kinesis(sorted_leaders, curr_round, curr_stage)
+            # Convert to RewardsMessage format and send to Kinesis
+            # self._send_rewards_to_kinesis(sorted_leaders, curr_round, curr_stage)
 
-                return self.leaderboard_v2
+            return {
+                "leaders": sorted_leaders,
+                "total": len(sorted_leaders),
+            }
 
         except Exception as e:
             self.logger.warning("could not get leaderboard data: %s", e)
-            return None
+            return prev.leaderboard_v2
 
     # Sends the rewards data to a Kinesis stream where it can be processed by the UI server.
     def _send_rewards_to_kinesis(self, leaders, round, stage):
@@ -257,9 +275,9 @@ class Cache:
         except Exception as e:
             self.logger.error(f"!!! Failed to send gossip to Kinesis: {e}")
 
-    def _get_leaderboard(self):
+    def _get_leaderboard(self, prev: CacheSnapshot, rewards) -> tuple[dict, dict]:
         try:
-            if rewards := self._current_rewards():
+            if rewards:
                 # Sorted list of (node_key, reward) pairs.
                 raw = list(
                     sorted(rewards.items(), key=lambda t: (t[1], t[0]), reverse=True)
@@ -280,38 +298,37 @@ class Cache:
             self.logger.info("lb_entries length: %d", len(all_entries))
 
             current_history = []
-            with self.lock:
-                for entry in all_entries:
-                    latestScore = entry["score"]
-                    id = entry["id"]
-                    nn = entry["nickname"]
-
-                    past_scores = self.rewards_history.get(id, [])
-                    next_scores = (
-                        past_scores
-                        + [{"x": int(datetime.now().timestamp()), "y": latestScore}][
-                            -100:
-                        ]
-                    )
-                    self.rewards_history[id] = next_scores
-                    current_history.append(
-                        {
-                            "id": id,
-                            "nickname": nn,
-                            "values": next_scores,
-                        }
-                    )
+            rewards_history = dict(prev.rewards_history)
+            for entry in all_entries:
+                latestScore = entry["score"]
+                id = entry["id"]
+                nn = entry["nickname"]
+
+                past_scores = rewards_history.get(id, [])
+                next_scores = (
+                    past_scores
+                    + [{"x": int(datetime.now().timestamp()), "y": latestScore}]
+                )[-100:]
+                rewards_history[id] = next_scores
+                current_history.append(
+                    {
+                        "id": id,
+                        "nickname": nn,
+                        "values": next_scores,
+                    }
+                )
 
-            with self.lock:
-                self.leaderboard = {
-                    "leaders": all_entries,
-                    "total": len(raw),
-                    "rewardsHistory": current_history,
-                }
+            leaderboard = {
+                "leaders": all_entries,
+                "total": len(raw),
+                "rewardsHistory": current_history,
+            }
+            return leaderboard, rewards_history
         except Exception as e:
             self.logger.warning("could not get leaderboard data: %s", e)
+            return prev.leaderboard, prev.rewards_history
 
-    def _get_gossip(self):
+    def _get_gossip(self, rewards, curr_round, curr_stage) -> dict:
         MESSAGE_TARGET = 200
         NODE_TARGET = 20
         STAGE_MESSAGE_FNS = [stage1_message, stage2_message, stage3_message]
@@ -319,9 +336,6 @@ class Cache:
         round_gossip = []
         start_time = datetime.now()
         try:
-            curr_round = self.current_round.value
-            curr_stage = self.current_stage.value
-            rewards = self._current_rewards()
             if not rewards:
                 raise ValueError("missing rewards")
 
@@ -393,8 +407,6 @@ class Cache:
 
         # self._send_gossip_to_kinesis(round_gossip)
 
-        with self.lock:
-            self.gossips = {
-                "messages": [msg for _, msg in sorted(round_gossip, reverse=True)]
-                or [],
-            }
+        return {
+            "messages": [msg for _, msg in sorted(round_gossip, reverse=True)] or [],
+        }
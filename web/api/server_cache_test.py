@@ -0,0 +1,83 @@
+import logging
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add the parent directory to the Python path
+parent_dir = Path(__file__).parent.parent
+sys.path.append(str(parent_dir))
+
+from hivemind_exp.dht_utils import rewards_key
+from web.api.server_cache import Cache, CacheSnapshot
+
+
+class TestCache:
+    """Tests for the snapshot-swapping DHT cache."""
+
+    def setup_method(self):
+        self.coordinator = MagicMock()
+        self.coordinator.get_round_and_stage.return_value = (1, 0)
+        self.rewards = {rewards_key(1, 0): {"peer_a": 2.0, "peer_b": 1.0}}
+        self.cache = Cache(MagicMock(), self.coordinator, logging.getLogger("test"))
+
+        patcher = patch(
+            "web.api.server_cache.get_dht_value",
+            side_effect=lambda dht, key, **kwargs: self.rewards.get(key),
+        )
+        self.get_dht_value = patcher.start()
+        self.patcher = patcher
+
+    def teardown_method(self):
+        self.patcher.stop()
+
+    def test_initial_snapshot(self):
+        assert self.cache.snapshot == CacheSnapshot()
+        assert self.cache.get_round_and_stage() == (-1, -1)
+        assert self.cache.get_leaderboard() == {}
+        assert self.cache.get_last_polled() is None
+
+    def test_poll_swaps_snapshot(self):
+        self.cache.poll_dht()
+        first = self.cache.snapshot
+
+        assert self.cache.get_round_and_stage() == (1, 0)
+        assert self.cache.get_last_polled() is not None
+        leaders = self.cache.get_leaderboard()["leaders"]
+        assert [l["id"] for l in leaders] == ["peer_a", "peer_b"]
+        assert self.cache.get_leaderboard_cumulative()["total"] == 2
+        # Readers share the snapshot's objects; nothing is copied per request.
+        assert self.cache.get_leaderboard() is first.leaderboard
+
+        # The next stage accumulates scores into a new snapshot and leaves the
+        # published one untouched.
+        self.coordinator.get_round_and_stage.return_value = (1, 1)
+        self.rewards[rewards_key(1, 1)] = {"peer_a": 3.0}
+        self.cache.poll_dht()
+
+        assert self.cache.snapshot is not first
+        cumulative = self.cache.get_leaderboard_cumulative()["leaders"]
+        assert cumulative[0]["id"] == "peer_a"
+        assert cumulative[0]["cumulativeScore"] == 5.0
+        assert first.leaderboard_v2["leaders"][0]["cumulativeScore"] == 2.0
+        assert len(first.leaderboard_v2["leaders"][0]["scoreHistory"]) == 1
+        assert len(first.rewards_history["peer_a"]) == 1
+        assert len(self.cache.snapshot.rewards_history["peer_a"]) == 2
+
+    def test_rewards_failure_keeps_leaderboards(self):
+        self.cache.poll_dht()
+        leaderboard = self.cache.get_leaderboard()
+
+        self.get_dht_value.side_effect = RuntimeError("dht down")
+        self.cache.poll_dht()
+        assert self.cache.get_leaderboard() is leaderboard
+        assert self.cache.get_gossips() == {"messages": []}
+
+    def test_rewards_history_is_capped(self):
+        for _ in range(105):
+            self.cache.poll_dht()
+        assert len(self.cache.snapshot.rewards_history["peer_a"]) == 100
+
+    def test_reset(self):
+        self.cache.poll_dht()
+        self.cache.reset()
+        assert self.cache.snapshot == CacheSnapshot()